@@ -0,0 +1,21 @@
+-- Pending balance index (services/pendings.py). Run once in the Supabase SQL editor; safe to re-run.
+-- Add, settle, delete and partial payments change a counterparty's balance by a delta. The increment
+-- happens in one statement per counterparty, so concurrent requests never overwrite each other's change.
+
+create unique index if not exists pending_balance_user_other on pending_balance (user_id, other_user);
+
+-- p_deltas: [{"other_user": "Rahul", "delta_amount": 250.0, "delta_count": 1}, ...]
+create or replace function adjust_pending_balances(p_user_id text, p_deltas jsonb) returns void as $$
+declare
+    d record;
+begin
+    for d in select * from jsonb_to_recordset(p_deltas) as x(other_user text, delta_amount float8, delta_count int) loop
+        insert into pending_balance (user_id, other_user, net_amount, open_count, updated_at)
+        values (p_user_id, d.other_user, round(d.delta_amount::numeric, 2), greatest(d.delta_count, 0), now())
+        on conflict (user_id, other_user) do update
+            set net_amount = round((pending_balance.net_amount + d.delta_amount)::numeric, 2),
+                open_count = greatest(pending_balance.open_count + d.delta_count, 0),
+                updated_at = now();
+    end loop;
+end;
+$$ language plpgsql;
@@ -0,0 +1,101 @@
+-- Delta sync (services/sync.py, /sync/pull and /sync/push).
+-- Every insert/update of a synced row takes the next number of one global sequence, and
+-- deletes leave a tombstone numbered from the same sequence, so a single cursor per client
+-- covers all tables. Run in the Supabase SQL editor; safe to re-run.
+
+create sequence if not exists sync_version_seq;
+
+create table if not exists sync_tombstone (
+    sync_version bigint primary key,
+    user_id text not null,
+    table_name text not null,
+    row_key text not null,
+    deleted_at timestamptz not null default now()
+);
+create index if not exists sync_tombstone_user_version on sync_tombstone (user_id, sync_version);
+
+-- A batch is claimed ("running") before it is applied, and finished ("done") with its result
+create table if not exists sync_push (
+    user_id text not null,
+    batch_id text not null,
+    status text not null default 'running',
+    result jsonb,
+    created_at timestamptz not null default now(),
+    primary key (user_id, batch_id)
+);
+alter table sync_push add column if not exists status text not null default 'done';
+alter table sync_push alter column result drop not null;
+alter table sync_push alter column status set default 'running';
+
+-- Client ids of rows inserted through /sync/push: a replayed insert hits the index instead of duplicating
+alter table "transaction" add column if not exists client_ref text;
+alter table "pending" add column if not exists client_ref text;
+create unique index if not exists transaction_user_client_ref on "transaction" (user_id, client_ref);
+create unique index if not exists pending_user_client_ref on "pending" (user_id, client_ref);
+
+create or replace function sync_bump_version() returns trigger as $$
+begin
+    new.sync_version := nextval('sync_version_seq');
+    new.updated_at := now();
+    return new;
+end;
+$$ language plpgsql;
+
+-- Tombstones carry the deleted row's key; limit and summary are keyed by user_id
+create or replace function sync_tombstone_transaction() returns trigger as $$
+begin
+    insert into sync_tombstone (sync_version, user_id, table_name, row_key)
+    values (nextval('sync_version_seq'), old.user_id, 'transaction', old.transaction_id::text);
+    return old;
+end;
+$$ language plpgsql;
+
+create or replace function sync_tombstone_pending() returns trigger as $$
+begin
+    insert into sync_tombstone (sync_version, user_id, table_name, row_key)
+    values (nextval('sync_version_seq'), old.user_id, 'pending', old.pending_id::text);
+    return old;
+end;
+$$ language plpgsql;
+
+create or replace function sync_tombstone_by_user() returns trigger as $$
+begin
+    insert into sync_tombstone (sync_version, user_id, table_name, row_key)
+    values (nextval('sync_version_seq'), old.user_id, tg_table_name, old.user_id::text);
+    return old;
+end;
+$$ language plpgsql;
+
+alter table "transaction" add column if not exists sync_version bigint, add column if not exists updated_at timestamptz;
+alter table "limit" add column if not exists sync_version bigint, add column if not exists updated_at timestamptz;
+alter table "pending" add column if not exists sync_version bigint, add column if not exists updated_at timestamptz;
+alter table "summary" add column if not exists sync_version bigint, add column if not exists updated_at timestamptz;
+
+create index if not exists transaction_user_sync on "transaction" (user_id, sync_version);
+create index if not exists limit_user_sync on "limit" (user_id, sync_version);
+create index if not exists pending_user_sync on "pending" (user_id, sync_version);
+create index if not exists summary_user_sync on "summary" (user_id, sync_version);
+
+drop trigger if exists transaction_sync_version on "transaction";
+create trigger transaction_sync_version before insert or update on "transaction" for each row execute function sync_bump_version();
+drop trigger if exists limit_sync_version on "limit";
+create trigger limit_sync_version before insert or update on "limit" for each row execute function sync_bump_version();
+drop trigger if exists pending_sync_version on "pending";
+create trigger pending_sync_version before insert or update on "pending" for each row execute function sync_bump_version();
+drop trigger if exists summary_sync_version on "summary";
+create trigger summary_sync_version before insert or update on "summary" for each row execute function sync_bump_version();
+
+drop trigger if exists transaction_sync_tombstone on "transaction";
+create trigger transaction_sync_tombstone after delete on "transaction" for each row execute function sync_tombstone_transaction();
+drop trigger if exists pending_sync_tombstone on "pending";
+create trigger pending_sync_tombstone after delete on "pending" for each row execute function sync_tombstone_pending();
+drop trigger if exists limit_sync_tombstone on "limit";
+create trigger limit_sync_tombstone after delete on "limit" for each row execute function sync_tombstone_by_user();
+drop trigger if exists summary_sync_tombstone on "summary";
+create trigger summary_sync_tombstone after delete on "summary" for each row execute function sync_tombstone_by_user();
+
+-- Existing rows get a version once, so the first pull (cursor 0) returns them
+update "transaction" set sync_version = nextval('sync_version_seq') where sync_version is null;
+update "limit" set sync_version = nextval('sync_version_seq') where sync_version is null;
+update "pending" set sync_version = nextval('sync_version_seq') where sync_version is null;
+update "summary" set sync_version = nextval('sync_version_seq') where sync_version is null;
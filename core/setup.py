@@ -1,14 +1,21 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+from services.resilience import ResilientClient, supabase as supabase_dependency
 
+@lru_cache(maxsize=None)
 def initialize_supabase():
     """
     Initializes Supabase client.
+    The client is created once per process and shared by every router and service.
+    Every table query runs with a deadline and a circuit breaker (services/resilience.py).
     """
     load_dotenv()
     url: str = os.getenv("SUPABASE_URL")
     key: str = os.getenv("SUPABASE_KEY")
-    supabase: Client = create_client(url, key)
-    return supabase
-
+    # The HTTP timeout stops the request itself; the guard's deadline bounds the caller's wait
+    options = ClientOptions(postgrest_client_timeout=supabase_dependency.timeout)
+    supabase: Client = create_client(url, key, options=options)
+    return ResilientClient(supabase)
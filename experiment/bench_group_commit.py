@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for the intake group-commit buffer in services/group_commit.py.
+A local stand-in for Supabase charges a fixed round trip per request plus a small
+per-row cost; N concurrent clients each insert ROWS_PER_CLIENT rows, once with a
+single-row insert per request and once through the group committer.
+Run from the repository root:  python -m experiment.bench_group_commit
+"""
+import asyncio
+import time
+import numpy as np
+
+from services.group_commit import GroupCommitter, COMMITTED
+
+ROUND_TRIP_SECONDS = 0.015  # Network + PostgREST overhead per request
+PER_ROW_SECONDS = 0.0001  # Marginal cost of one more row in a bulk insert
+ROWS_PER_CLIENT = 20
+CONCURRENCY = (1, 8, 32, 128)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeInsert:
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows if isinstance(rows, list) else [rows]
+
+    def execute(self):
+        time.sleep(ROUND_TRIP_SECONDS + PER_ROW_SECONDS * len(self.rows))
+        self.db.requests += 1
+        inserted = []
+        for row in self.rows:
+            self.db.next_id += 1
+            inserted.append(dict(row, transaction_id=self.db.next_id))
+        return FakeResponse(inserted)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.requests = 0
+        self.next_id = 0
+
+    def table(self, name):
+        return self
+
+    def insert(self, rows):
+        return FakeInsert(self, rows)
+
+
+def row(client, i):
+    return {"user_id": f"user-{client}", "amount": 100 + i, "sender_name": "Bench Mart", "payment_type": "expense"}
+
+
+async def run(concurrency, grouped):
+    db = FakeSupabase()
+    committer = GroupCommitter(db=db, durability=COMMITTED)
+    latencies = []
+
+    async def client(c):
+        for i in range(ROWS_PER_CLIENT):
+            started = time.perf_counter()
+            if grouped:
+                inserted = await committer.insert(row(c, i))
+            else:
+                inserted = (await asyncio.to_thread(lambda: db.table('transaction').insert(row(c, i)).execute())).data[0]
+            assert inserted["user_id"] == f"user-{c}" and inserted["amount"] == 100 + i
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    rows = concurrency * ROWS_PER_CLIENT
+    return rows / elapsed, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000, db.requests
+
+
+async def main():
+    print(f"Round trip {ROUND_TRIP_SECONDS * 1000:.0f} ms + {PER_ROW_SECONDS * 1000:.1f} ms/row, "
+          f"{ROWS_PER_CLIENT} rows per client\n")
+    print(f"{'clients':>8} {'mode':>13} {'rows/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'requests':>9}")
+    for concurrency in CONCURRENCY:
+        for grouped in (False, True):
+            rate, p50, p99, requests = await run(concurrency, grouped)
+            mode = "group commit" if grouped else "single-row"
+            print(f"{concurrency:>8} {mode:>13} {rate:>9.0f} {p50:>8.1f} {p99:>8.1f} {requests:>9}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
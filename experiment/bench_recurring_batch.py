@@ -0,0 +1,47 @@
+"""
+Benchmark for the vectorized all-users recurring detection in services/recurring_batch.py.
+Run from the repository root:  python -m experiment.bench_recurring_batch
+"""
+import time
+import numpy as np
+
+from services.recurring_batch import detect_all
+
+ROWS = 3_000_000
+USERS = 50_000
+RECIPIENTS = 2_000
+SUBSCRIPTIONS_PER_USER = 3
+
+rng = np.random.default_rng(7)
+today = int(np.datetime64('2025-11-01', 'D').astype(np.int64))
+
+# Background noise: random one-off expenses over the last two years
+noise = ROWS - USERS * SUBSCRIPTIONS_PER_USER * 12
+user_codes = [rng.integers(0, USERS, noise)]
+recipient_codes = [rng.integers(0, RECIPIENTS, noise)]
+days = [today - rng.integers(0, 730, noise)]
+amounts = [np.round(rng.lognormal(5, 1, noise), 2)]
+
+# Planted monthly subscriptions: 12 payments each, small jitter in amount and date
+subs = USERS * SUBSCRIPTIONS_PER_USER
+sub_users = np.repeat(np.arange(USERS), SUBSCRIPTIONS_PER_USER)
+sub_recipients = RECIPIENTS + np.arange(subs) % 50
+sub_amounts = rng.uniform(99, 999, subs)
+for month in range(12):
+    user_codes.append(sub_users)
+    recipient_codes.append(sub_recipients)
+    days.append(today - 30 * month + rng.integers(-1, 2, subs))
+    amounts.append(np.round(sub_amounts * rng.uniform(0.97, 1.03, subs), 2))
+
+user_codes = np.concatenate(user_codes)
+recipient_codes = np.concatenate(recipient_codes)
+days = np.concatenate(days).astype(np.int64)
+amounts = np.concatenate(amounts)
+
+began = time.perf_counter()
+detected = detect_all(user_codes, recipient_codes, days, amounts)
+elapsed = time.perf_counter() - began
+
+print(f"Rows:               {len(days):,}")
+print(f"Detection time:     {elapsed:.2f} s ({len(days) / elapsed:,.0f} rows/s)")
+print(f"Subscriptions:      {len(detected['user_code']):,} detected, {subs:,} planted")
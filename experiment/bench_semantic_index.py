@@ -0,0 +1,69 @@
+"""
+Query-latency benchmark for the per-user semantic transaction index in services/semantic_index.py.
+Builds one index of 100k synthetic transactions and compares IVF search with an exact scan.
+Run from the repository root:  python -m experiment.bench_semantic_index
+"""
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from services.semantic_index import UserIndex, embed
+
+TRANSACTIONS = 100_000
+QUERIES = 500
+K = 5
+
+rng = np.random.default_rng(11)
+merchants = [f"{a} {b}" for a in ("Blue", "Third Wave", "Chai", "Urban", "Green", "Royal", "City", "Star", "Fresh", "Daily")
+             for b in ("Cafe", "Coffee", "Mart", "Pharmacy", "Fuel", "Bakery", "Kitchen", "Electronics", "Salon", "Books")]
+categories = ["Food", "Groceries", "Travel", "Health", "Shopping", "Bills", "Entertainment"]
+now = datetime(2025, 11, 1, tzinfo=timezone.utc)
+
+rows = []
+for i in range(TRANSACTIONS):
+    merchant = merchants[rng.integers(len(merchants))]
+    amount = round(float(rng.lognormal(5, 1)), 2)
+    rows.append({
+        "transaction_id": i,
+        "created_at": (now - timedelta(minutes=int(rng.integers(0, 2 * 365 * 24 * 60)))).isoformat(),
+        "amount": amount,
+        "sender_name": merchant,
+        "category": categories[rng.integers(len(categories))],
+        "message": f"Rs.{amount} debited from A/c XX{rng.integers(1000, 9999)} to {merchant.upper()} UPI Ref {rng.integers(10**11, 10**12)}",
+        "payment_type": "expense",
+    })
+
+started = time.perf_counter()
+index = UserIndex()
+for i in range(0, TRANSACTIONS, 1000):  # Same page size as the cold load from Supabase
+    index.add(rows[i:i + 1000])
+build_seconds = time.perf_counter() - started
+
+queries = [f"that {merchants[rng.integers(len(merchants))].split()[-1].lower()} near {m.split()[0].lower()}"
+           for m in (merchants[j] for j in rng.integers(0, len(merchants), QUERIES))]
+vectors = embed(queries)
+
+def timed(search):
+    latencies = []
+    for vector in vectors:
+        started = time.perf_counter()
+        search(vector)
+        latencies.append(time.perf_counter() - started)
+    return np.array(latencies) * 1000
+
+ivf = timed(lambda v: index.search(v, K))
+data = index.vectors[:index.size].astype(np.float32)
+exact = timed(lambda v: np.argsort(-(data @ v))[:K])
+
+# Recall of the IVF top-k against the exact top-k scores
+recall = []
+for vector in vectors[:100]:
+    exact_scores = np.sort(data @ vector)[-K:]
+    found = [score for score, _ in index.search(vector, K)]
+    recall.append(np.mean([any(abs(s - e) < 1e-3 for s in found) for e in exact_scores]))
+
+print(f"Index build: {TRANSACTIONS:,} transactions in {build_seconds:.2f} s, {index.n_lists} lists, "
+      f"{index.vectors.nbytes / 2**20:.1f} MiB of vectors")
+for label, latencies in (("IVF search", ivf), ("Exact scan", exact)):
+    print(f"{label}: p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms")
+print(f"IVF recall@{K} vs exact: {np.mean(recall):.2f}")
@@ -0,0 +1,91 @@
+"""
+Encode time and payload size of transaction lists for the serializers behind
+services/serialization.py, against what FastAPI does by default:
+  - jsonable_encoder + json.dumps   (a route returning a list, JSONResponse)
+  - response_model validation       (TypeAdapter validate + dump_json, per row)
+  - orjson                          (APIResponse / respond, the default now)
+  - MessagePack                     (Accept: application/msgpack)
+Sizes are shown raw, gzip-compressed and brotli-compressed.
+Run from the repository root:  python -m experiment.bench_serialization
+"""
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from models.supa import TransactionRow
+from services import serialization
+
+ROW_COUNTS = (1_000, 10_000)
+REPEATS = 5  # Best of
+
+MERCHANTS = ("Swiggy", "Zomato", "Amazon Pay", "BigBasket", "Uber India", "Reliance Fresh", "HP Petrol Pump",
+             "Airtel Prepaid", "BESCOM", "Ramesh Kumar", "Priya Sharma", "Netflix", "IRCTC", "Apollo Pharmacy")
+CATEGORIES = ("Food", "Groceries", "Shopping", "Transport", "Fuel", "Bills", "Entertainment", "Health", "Transfer")
+
+
+def transactions(count, seed=7):
+    """Rows as Supabase returns them: strings for timestamps, floats for amounts, an SMS per row."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        created = start + timedelta(minutes=rng.randrange(0, 600_000))
+        merchant = rng.choice(MERCHANTS)
+        amount = round(rng.lognormvariate(6, 1.2), 2)
+        debit = rng.random() < 0.9
+        rows.append({
+            "transaction_id": 100_000 + i,
+            "user_id": "3f2b9c1e-7a44-4d0b-9a51-0c8e6f2d1a77",
+            "created_at": created.isoformat(),
+            "day": created.strftime("%A"),
+            "amount": amount,
+            "sender_name": merchant,
+            "payment_method": rng.choice(("UPI", "Card", "NetBanking")),
+            "payment_type": "expense" if debit else "income",
+            "category": rng.choice(CATEGORIES),
+            "message": f"Rs.{amount:.2f} {'debited from' if debit else 'credited to'} A/c XX{rng.randrange(1000, 9999)} "
+                       f"on {created:%d-%m-%y} to {merchant}. UPI Ref {rng.randrange(10 ** 11, 10 ** 12)}. "
+                       f"Not you? Call 1800-xxx-xxxx",
+            "anomaly": rng.random() < 0.02,
+        })
+    return rows
+
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        body = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, body
+
+
+def main():
+    adapter = TypeAdapter(List[TransactionRow])
+    encoders = {
+        "jsonable_encoder+json": lambda rows: json.dumps(jsonable_encoder(rows), ensure_ascii=False,
+                                                         separators=(",", ":")).encode(),
+        "response_model": lambda rows: adapter.dump_json(adapter.validate_python(rows)),
+        "orjson": serialization.dumps_json,
+        "msgpack": serialization.dumps_msgpack,
+    }
+
+    print(f"\n{'rows':>7} {'encoder':>22} {'encode ms':>10} {'raw KB':>8} {'gzip KB':>8} {'gzip ms':>8} {'br KB':>7} {'br ms':>7}")
+    for count in ROW_COUNTS:
+        rows = transactions(count)
+        for name, encode in encoders.items():
+            seconds, body = best_of(lambda: encode(rows))
+            gzip_seconds, gzipped = best_of(lambda: serialization.compress(body, "gzip"))
+            assert gzip.decompress(gzipped) == body
+            br_seconds, brotlied = best_of(lambda: serialization.compress(body, "br"))
+            print(f"{count:>7} {name:>22} {seconds * 1000:>10.1f} {len(body) / 1024:>8.0f} "
+                  f"{len(gzipped) / 1024:>8.0f} {gzip_seconds * 1000:>8.1f} {len(brotlied) / 1024:>7.0f} {br_seconds * 1000:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
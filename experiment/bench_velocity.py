@@ -0,0 +1,55 @@
+"""
+Throughput benchmark for services/velocity.py.
+Run from the repository root:  python -m experiment.bench_velocity
+"""
+import random
+import time
+import tracemalloc
+from collections import Counter
+
+from services.velocity import VelocityDetector
+
+USERS = 10_000
+EVENTS = 500_000
+MERCHANTS = 500
+
+random.seed(42)
+start_ts = 1_700_000_000
+events = []
+ts = start_ts
+for _ in range(EVENTS):
+    ts += random.expovariate(1 / 2.0)  # ~one event every 2 seconds across all users
+    events.append((
+        random.randrange(USERS),
+        f"merchant-{random.randrange(MERCHANTS)}",
+        round(random.lognormvariate(5, 1), 2),
+        ts,
+    ))
+
+detector = VelocityDetector()
+reasons_seen = Counter()
+began = time.perf_counter()
+for user_id, merchant, amount, event_ts in events:
+    reasons_seen.update(detector.evaluate(user_id, merchant, amount, event_ts))
+elapsed = time.perf_counter() - began
+
+# Memory is measured on a separate replay so tracing does not skew the throughput numbers
+tracemalloc.start()
+replay = VelocityDetector()
+for user_id, merchant, amount, event_ts in events[:EVENTS // 5]:
+    replay.evaluate(user_id, merchant, amount, event_ts)
+current, _ = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+print(f"Events:            {EVENTS:,}")
+print(f"Throughput:        {EVENTS / elapsed:,.0f} events/s ({elapsed * 1e6 / EVENTS:.1f} µs/event)")
+print(f"Flagged reasons:   {dict(reasons_seen)}")
+print(f"Tracked users:     {len(detector.users):,}")
+print(f"Memory per user:   {current / len(replay.users) / 1024:.1f} KiB (after {EVENTS // 5:,} events)")
+
+# Card-testing burst: 8 small debits within two minutes should be caught
+burst = VelocityDetector()
+reasons = []
+for i in range(8):
+    reasons = burst.evaluate("card-test", f"shop-{i % 2}", 1.0, start_ts + i * 15)
+print(f"Burst reasons:     {reasons}")
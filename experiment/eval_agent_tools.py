@@ -0,0 +1,65 @@
+"""
+Scripted evaluation of the financial agent: runs the same questions with the digest
+tool only and with the aggregate tools, and reports agent iterations and LLM tokens
+per answer. Needs GOOGLE_API_KEY and a user with transactions:
+    EVAL_USER_ID=<user id> python -m experiment.eval_agent_tools
+"""
+import os
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+
+from services.ai import build_agent_executor
+
+QUESTIONS = [
+    "How much did I spend on food this month?",
+    "Compare my food spend this month vs last month.",
+    "Which merchants did I spend the most with in the last 30 days?",
+    "Did my total spending go up this week compared to last week?",
+    "Show my last 5 transactions at Swiggy.",
+    "What were my largest expenses over 5000 in the last 90 days?",
+    "How much did I spend on travel this year?",
+    "What share of my spending this month went to shopping?",
+]
+
+
+class TokenCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens = 0
+        self.calls = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.calls += 1
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.tokens += usage.get("total_tokens", 0)
+
+
+def run(use_aggregate_tools, user_id):
+    executor = build_agent_executor(use_aggregate_tools=use_aggregate_tools, return_intermediate_steps=True)
+    executor.verbose = False
+    iterations, tokens, seconds = [], [], []
+    for question in QUESTIONS:
+        counter = TokenCounter()
+        started = time.perf_counter()
+        result = executor.invoke(
+            {"input": question, "chat_history": [], "user_id": user_id},
+            config={"callbacks": [counter]},
+        )
+        seconds.append(time.perf_counter() - started)
+        iterations.append(len(result["intermediate_steps"]))
+        tokens.append(counter.tokens)
+        print(f"  {question!r}: {iterations[-1]} tool calls, {counter.calls} LLM calls, {counter.tokens} tokens")
+    n = len(QUESTIONS)
+    return sum(iterations) / n, sum(tokens) / n, sum(seconds) / n
+
+
+if __name__ == '__main__':
+    user_id = os.environ["EVAL_USER_ID"]
+    results = {}
+    for label, aggregate in (("digest only", False), ("aggregate tools", True)):
+        print(f"--- {label} ---")
+        results[label] = run(aggregate, user_id)
+    print()
+    for label, (iterations, tokens, seconds) in results.items():
+        print(f"{label:>16}: {iterations:.2f} tool calls/answer, {tokens:,.0f} tokens/answer, {seconds:.2f} s/answer")
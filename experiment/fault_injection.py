@@ -0,0 +1,185 @@
+"""
+Fault-injection checks for services/resilience.py: local stand-ins for Supabase and
+Gemini that are slow or fail on demand, driven through the real guards.
+Run from the repository root:  python -m experiment.fault_injection
+"""
+import asyncio
+import random
+import threading
+import time
+import numpy as np
+
+from services.resilience import Dependency, ResilientClient, CircuitOpen, DeadlineExceeded
+
+
+class FaultPlan:
+    """Latency and error behaviour shared by the stand-ins; change it between scenarios."""
+
+    def __init__(self, latency=0.01, tail_latency=0.0, tail_rate=0.0, error_rate=0.0, hang=False):
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.hang = hang
+        self.release = threading.Event()  # Set when the scenario ends, so a hung call returns
+        self.calls = 0
+
+    def run(self, result):
+        self.calls += 1
+        if self.hang:
+            self.release.wait()
+        time.sleep(self.tail_latency if random.random() < self.tail_rate else self.latency)
+        if random.random() < self.error_rate:
+            raise ConnectionError("injected upstream failure")
+        return result
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """Chainable stand-in for a postgrest request builder."""
+
+    def __init__(self, plan, http_method='GET'):
+        self.plan = plan
+        self.http_method = http_method
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: FakeQuery(self.plan, 'POST' if name in ('insert', 'upsert', 'update', 'delete') else self.http_method)
+
+    def execute(self):
+        return self.plan.run(FakeResponse([{"ok": True}]))
+
+
+class FakeSupabase:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def table(self, name):
+        return FakeQuery(self.plan)
+
+
+class FakeLLM:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def invoke(self, prompt):
+        return self.plan.run("fake reply")
+
+
+def check(label, condition):
+    print(f"{'PASS' if condition else 'FAIL'}  {label}")
+    return condition
+
+
+def hedging():
+    """Tail latency of selects with and without hedging (5% of calls take 400 ms)."""
+    plan = FaultPlan(latency=0.01, tail_latency=0.4, tail_rate=0.05)
+    results = {}
+    for hedge_after in (None, 0.05):
+        dependency = Dependency("supabase_test", 2.0, 5, 1.0, hedge_after)
+        db = ResilientClient(FakeSupabase(plan), dependency)
+        latencies = []
+        for _ in range(400):
+            started = time.perf_counter()
+            db.table('transaction').select('*').eq('user_id', 'u').execute()
+            latencies.append(time.perf_counter() - started)
+        results[hedge_after] = np.percentile(latencies, 99) * 1000
+        print(f"      hedge_after={hedge_after}: p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {results[hedge_after]:.1f} ms")
+    return check("hedged selects cut p99 latency", results[0.05] < results[None] / 2)
+
+
+def writes_are_not_hedged():
+    plan = FaultPlan(latency=0.1)
+    dependency = Dependency("supabase_test", 2.0, 5, 1.0, 0.01)
+    ResilientClient(FakeSupabase(plan), dependency).table('transaction').insert({}).execute()
+    return check("inserts are sent once", plan.calls == 1)
+
+
+def deadline():
+    plan = FaultPlan(hang=True)
+    dependency = Dependency("gemini_test", 0.2, 3, 1.0)
+    started = time.perf_counter()
+    try:
+        dependency.call(lambda: FakeLLM(plan).invoke("hi"))
+        timed_out = False
+    except DeadlineExceeded:
+        timed_out = True
+    finally:
+        plan.release.set()  # The abandoned pool thread is still running the call; let it finish
+    elapsed = time.perf_counter() - started
+    return check(f"a hanging call fails at its deadline ({elapsed:.2f} s)", timed_out and elapsed < 0.4)
+
+
+def breaker():
+    plan = FaultPlan(latency=0.0, error_rate=1.0)
+    dependency = Dependency("gemini_test", 1.0, 3, 0.3)
+    llm = FakeLLM(plan)
+    for _ in range(3):
+        try:
+            dependency.call(lambda: llm.invoke("hi"))
+        except ConnectionError:
+            pass
+    ok = check("breaker opens after 3 consecutive failures", dependency.breaker.state == "open")
+
+    calls_before = plan.calls
+    try:
+        dependency.call(lambda: llm.invoke("hi"))
+        fast_failed = False
+    except CircuitOpen:
+        fast_failed = True
+    ok &= check("open breaker refuses calls without touching the upstream", fast_failed and plan.calls == calls_before)
+
+    time.sleep(0.35)
+    try:
+        dependency.call(lambda: llm.invoke("hi"))
+    except ConnectionError:
+        pass
+    ok &= check("failed half-open probe re-opens the breaker", dependency.breaker.state == "open")
+
+    time.sleep(0.35)
+    plan.error_rate = 0.0
+    dependency.call(lambda: llm.invoke("hi"))
+    ok &= check("successful half-open probe closes the breaker", dependency.breaker.state == "closed")
+    return ok
+
+
+def cancelled_probe():
+    """A half-open probe stream the client abandons must not leave the breaker refusing everything."""
+    plan = FaultPlan(latency=0.0, error_rate=1.0)
+    dependency = Dependency("gemini_test", 1.0, 1, 0.1)
+    try:
+        dependency.call(lambda: FakeLLM(plan).invoke("hi"))
+    except ConnectionError:
+        pass
+    time.sleep(0.15)
+
+    async def stream():
+        with dependency.track():
+            for chunk in ("a", "b", "c"):
+                yield chunk
+
+    async def disconnect():
+        chunks = stream()
+        await chunks.__anext__()  # The half-open probe starts...
+        await chunks.aclose()  # ...and the client goes away mid-stream
+
+    asyncio.run(disconnect())
+    ok = check("abandoned probe stream releases the probe", not dependency.breaker.probing)
+    plan.error_rate = 0.0
+    try:
+        dependency.call(lambda: FakeLLM(plan).invoke("hi"))
+        allowed = True
+    except CircuitOpen:
+        allowed = False
+    ok &= check("next call is let through as the probe and closes the breaker",
+                allowed and dependency.breaker.state == "closed")
+    return ok
+
+
+if __name__ == '__main__':
+    random.seed(3)
+    results = [hedging(), writes_are_not_hedged(), deadline(), breaker(), cancelled_probe()]
+    print(f"\n{sum(results)}/{len(results)} scenarios passed")
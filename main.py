@@ -1,9 +1,18 @@
 import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, RedirectResponse
 
 from core.setup import initialize_supabase
-from routers import alert, prediction, intake, recurring, chatbot
+from routers import alert, prediction, intake, recurring, chatbot, pending, sync
+from services.chat_store import store as chat_store
+from services.work_queue import queue as work_queue
+from services.group_commit import committer as group_committer
+from services import bulk_import
+from services.metrics import metrics
+from services.admission import Rejected
+from services.resilience import CircuitOpen, DeadlineExceeded
+from services.serialization import APIResponse, NegotiationMiddleware
 
 db = initialize_supabase()
 # The db object is imported from core.setup where it is initialized.
@@ -12,11 +21,47 @@ if not db:
     print("❌ Firebase initialization failed. Exiting application.")
     exit(1)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    work_queue.start()
+    yield
+    # Running bulk imports stop at their next record; they resume from their checkpoint
+    bulk_import.stop_requested.set()
+    # Write out buffered intake rows, finish the work they queued, then flush the chat store
+    await group_committer.close()
+    await work_queue.drain()
+    chat_store.flush()
+
 app = FastAPI(
     title="FinSight API",
     description="API for smart expense tracking and financial insights.",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=APIResponse,  # orjson / MessagePack + compression, per the request's Accept headers
 )
+app.add_middleware(NegotiationMiddleware)
+
+@app.exception_handler(Rejected)
+async def admission_rejected(request: Request, exc: Rejected):
+    """Model-bound work that was not admitted: fast 429 so clients back off."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(CircuitOpen)
+async def dependency_unavailable(request: Request, exc: CircuitOpen):
+    """An upstream (Supabase, Gemini) is failing and its circuit breaker is open."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "dependency": exc.name},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def dependency_timeout(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 # Include all the application routers
 app.include_router(alert.alert_router, prefix="/alert")
@@ -24,6 +69,8 @@ app.include_router(prediction.router, prefix="/prediction")
 app.include_router(intake.router, prefix="/intake")
 app.include_router(recurring.router, prefix="/recurring")
 app.include_router(chatbot.router, prefix="/chatbot")
+app.include_router(pending.router, prefix="/pending")
+app.include_router(sync.router, prefix="/sync")
 
  
 @app.get("/")
@@ -31,5 +78,10 @@ async def root():
     """Redirects the root path to the API documentation."""
     return RedirectResponse(url="/docs")
 
+@app.get("/metrics", tags=["Monitoring"])
+async def get_metrics():
+    """In-process counters and timing summaries (per worker)."""
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,12 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal
+
+class PendingCreate(BaseModel):
+    UserID: str
+    description: str
+    amount: float
+    type: Literal['payable', 'receivable']  # payable: you owe, receivable: you are owed
+    person_name: str
+
+class PendingBulk(BaseModel):
+    pending_ids: List[int] = Field(min_length=1, max_length=500)
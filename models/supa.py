@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class TransactionReadOne(BaseModel):
     user_id: Optional[int] = None
@@ -16,4 +16,21 @@ class SummaryReadOne(BaseModel):
     user_id: Optional[int] = None
 
 class ChatHistoryReadOne(BaseModel):
-    user_id: Optional[int] = None
\ No newline at end of file
+    user_id: Optional[int] = None
+
+# Response shapes, for the API docs only: the read routes return rows through
+# services.serialization.respond, which skips validating them one by one
+class TransactionRow(BaseModel):
+    transaction_id: int
+    user_id: str
+    created_at: str
+    day: Optional[str] = None
+    amount: float
+    sender_name: Optional[str] = None
+    payment_method: Optional[str] = None
+    payment_type: Optional[str] = None
+    category: Optional[str] = None
+    message: Optional[str] = None
+    anomaly: bool = False
+
+TransactionRows = List[TransactionRow]
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional, Union
+
+class SyncChange(BaseModel):
+    table: str
+    op: Literal['insert', 'update', 'upsert', 'delete', 'settle']
+    key: Optional[Union[int, str]] = None  # Primary key of an existing row
+    base_version: Optional[int] = None  # sync_version of the row when the client last pulled it
+    row: Optional[Dict[str, Any]] = None
+    client_ref: Optional[str] = None  # Client-side id of an inserted row, echoed back with its new key
+
+class SyncPullPage(BaseModel):
+    # Response shape, for the API docs only (rows are returned as stored, not validated)
+    cursor: int
+    has_more: bool
+    changes: Dict[str, List[Dict[str, Any]]]  # table -> changed rows
+    deleted: Dict[str, List[Union[int, str]]]  # table -> deleted keys
+
+class SyncPush(BaseModel):
+    user_id: str
+    batch_id: str  # Unique per batch; a retried batch is answered from the log instead of re-applied
+    changes: List[SyncChange] = Field(max_length=500)
@@ -1,6 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from services import chatbot as chatbot_service
+from services.admission import Rejected
+from services.resilience import CircuitOpen, DeadlineExceeded
+
+# Mapped to 429 / 503 / 504 by the handlers in main.py
+PASS_THROUGH = (Rejected, CircuitOpen, DeadlineExceeded)
 
 router = APIRouter()
 
@@ -9,9 +16,53 @@ class ChatRequest(BaseModel):
     message: str
 
 @router.post("/chat")
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest):
     try:
-        response = chatbot_service.get_chatbot_response(request.user_id, request.message)
+        response = await chatbot_service.get_chatbot_response(request.user_id, request.message)
         return {"response": response}
+    except PASS_THROUGH:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: Request, body: ChatRequest):
+    """
+    Streams the reply as Server-Sent Events: one `data: {"token": ...}` event per chunk,
+    then `event: done` (or `event: error`). Generation stops when the client disconnects.
+    Answers 429 / 503 before streaming starts when the model is saturated or failing.
+    """
+    stream = chatbot_service.stream_chatbot_response(body.user_id, body.message)
+    try:
+        # Admission and the breaker are checked before the first chunk, so a refusal is a plain status code
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except PASS_THROUGH:
+        await stream.aclose()
+        raise
+
+    async def events():
+        try:
+            if first is not None:
+                yield _sse({"token": first})
+            async for token in stream:
+                if await request.is_disconnected():
+                    break
+                yield _sse({"token": token})
+            else:
+                yield _sse({}, event="done")
+        except Exception as e:
+            yield _sse({"detail": str(e)}, event="error")
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
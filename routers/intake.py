@@ -1,17 +1,26 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import os
+import uuid
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel  # Assuming TransactionData is a Pydantic model
 from datetime import datetime
 
 # Import the parsing function
 from services.parsing_engine import parse_transaction
+from services import velocity
+from services.velocity import detector as velocity_detector
+from services.intake_jobs import enqueue_followups
+from services import group_commit
+from services import bulk_import
 
 # Import the Supabase DB client
 try:
-    from core.setup import initialize_firebase
+    from core.setup import initialize_supabase
 
-    db = initialize_firebase()
+    db = initialize_supabase()
 except ImportError:
-    print("Error: Could not import 'initialize_firebase' from 'core.setup'.")
+    print("Error: Could not import 'initialize_supabase' from 'core.setup'.")
     db = None
 except Exception as e:
     print(f"Error initializing database: {e}")
@@ -39,7 +48,8 @@ async def process_raw_transaction(data: TransactionData):
         raise HTTPException(status_code=500, detail="Database client is not initialized")
 
     # 1. Parse the raw message using the parsing service
-    parsed_details = parse_transaction(data.raw_message)
+    # Off the event loop: the LLM fallback may wait for an admission slot
+    parsed_details = await asyncio.to_thread(parse_transaction, data.raw_message, data.user_id)
 
     if not parsed_details:
         raise HTTPException(status_code=400, detail="Failed to parse transaction from raw_message")
@@ -64,24 +74,124 @@ async def process_raw_transaction(data: TransactionData):
         "anomaly": False  # Set a default value
     }
 
+    # Velocity / burst rules over the user's recent events (in-memory ring buffers,
+    # seeded from the user's latest debits the first time this process sees them)
+    if not velocity_detector.has_user(data.user_id):
+        try:
+            await asyncio.to_thread(velocity.warm_up, data.user_id)
+        except Exception as e:
+            print(f"⚠️ Velocity warm-up failed for UserID '{data.user_id}': {e}")
+    velocity_reasons = velocity_detector.evaluate(
+        data.user_id,
+        final_data["sender_name"],
+        final_data["amount"],
+        dt_object.timestamp(),
+        is_debit=final_data["payment_type"] == "expense",
+    )
+    if velocity_reasons:
+        print(f"🚨 Velocity rules tripped for UserID '{data.user_id}': {', '.join(velocity_reasons)}")
+        final_data["anomaly"] = True
+
     # 3. Insert into Supabase 'transaction' table
-    try:
-        response = db.table('transaction').insert(final_data).execute()
+    # (in group-commit mode the row joins a shared batch that is written with one bulk insert)
+    def on_written(row):
+        # 4. Derived work (anomaly scoring, recurring, refunds, pendings, summary, alerts, caches)
+        # runs on the background work queue, so the response only waits for parse + insert
+        enqueue_followups(data.user_id, row, data.timestamp)
 
-        if not response.data:
-            # This might happen if RLS fails, but .insert() usually errors
-            raise Exception("No data returned from Supabase after insert.")
+    try:
+        if group_commit.ENABLED:
+            row = await group_commit.committer.insert(final_data, on_written=on_written)
+            if row is None:
+                # Write-behind: acknowledged from memory, written with the next batch
+                return dict(final_data, status="buffered")
+        else:
+            response = db.table('transaction').insert(final_data).execute()
+
+            if not response.data:
+                # This might happen if RLS fails, but .insert() usually errors
+                raise Exception("No data returned from Supabase after insert.")
+            row = response.data[0]
+            on_written(row)
 
         print(f"✅ DB Write: Successfully wrote transaction for UserID '{data.user_id}'.")
 
-        # Return the newly created transaction record from the DB
-        return response.data[0]
-
     except Exception as e:
         print(f"❌ DB Write Error: {e}")
         # This will catch RLS (Row Level Security) policy violations
         raise HTTPException(status_code=500, detail=f"Data parsed but failed to save to database: {str(e)}")
 
+    # Return the newly created transaction record from the DB
+    return row
+
+# --- Bulk import of SMS backups ---
+MAX_IMPORT_BYTES = 1024 * 1024 * 1024  # 1 GiB per upload
+import_tasks = set()  # Keeps running imports referenced until they finish
+
+
+def _start_import(job, path):
+    task = asyncio.create_task(asyncio.to_thread(bulk_import.run_import, job, path))
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+
+
+@router.post("/import", status_code=202, tags=["Intake"])
+async def import_sms_backup(request: Request, user_id: str, format: Optional[str] = None):
+    """
+    Bulk import of an SMS backup export (XML, CSV or JSON lines) sent as the raw request
+    body. The upload is spooled to disk, then parsed and inserted in the background;
+    poll GET /intake/import/{import_id} for progress.
+    """
+    if not db:
+        raise HTTPException(status_code=500, detail="Database client is not initialized")
+    if format is not None and format not in bulk_import.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(bulk_import.FORMATS)}")
+
+    import_id = uuid.uuid4().hex
+    path = bulk_import.spool_path(import_id)
+    os.makedirs(bulk_import.IMPORT_DIR, exist_ok=True)
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_IMPORT_BYTES:
+                    raise HTTPException(status_code=413, detail="SMS backup is too large")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    if size == 0:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail="Empty request body")
+
+    job = await asyncio.to_thread(bulk_import.new_job, user_id, path, format or bulk_import.detect_format(path), import_id)
+    _start_import(job, path)
+    return {"import_id": import_id, "status": "running", "bytes": size}
+
+
+@router.get("/import/{import_id}", tags=["Intake"])
+async def import_status(import_id: str):
+    """Progress of a bulk import: records read, inserted, skipped, parsed via LLM, failed."""
+    job = await asyncio.to_thread(bulk_import.load_job, import_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
+
+
+@router.post("/import/{import_id}/resume", status_code=202, tags=["Intake"])
+async def resume_import(import_id: str):
+    """Continues an interrupted or failed import from its last checkpoint."""
+    job = await asyncio.to_thread(bulk_import.load_job, import_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    if job["status"] == "done" or import_id in bulk_import.running:
+        raise HTTPException(status_code=409, detail=f"Import is {'already done' if job['status'] == 'done' else 'running'}")
+    if not os.path.exists(job["source"]):
+        raise HTTPException(status_code=410, detail="The uploaded backup is no longer on this server; upload it again")
+    _start_import(job, job["source"])
+    return {"import_id": import_id, "status": "running", "records_read": job["records_read"]}
+
 
 @router.get("/test", tags=["Intake"])
 async def test_endpoint():
@@ -0,0 +1,102 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from models.pending import PendingCreate, PendingBulk
+from services import pendings as pending_service
+from services.serialization import respond
+
+router = APIRouter(tags=["Pending Payments"])
+
+@router.post("", status_code=201)
+def add_pending_item(item: PendingCreate):
+    """
+    Adds a new pending transaction for a user.
+    'type' should be 'payable' (you owe) or 'receivable' (you are owed).
+    """
+    if item.amount <= 0:
+        raise HTTPException(status_code=400, detail="Invalid amount. Must be a positive number.")
+    try:
+        new_id = pending_service.add_pending_item(
+            item.UserID, item.description, item.amount, item.type, item.person_name
+        )
+        return {"status": "success", "id": new_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add pending item: {e}")
+
+@router.get("/{user_id}")
+def get_pending_items(
+    user_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    include_settled: bool = False,
+):
+    """
+    Retrieves one page of pending items for a given UserID.
+    """
+    try:
+        return respond(pending_service.list_pending_items(user_id, page, page_size, include_settled))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve items: {e}")
+
+@router.get("/{user_id}/balances")
+def get_balances(user_id: str):
+    """
+    Net balance per person: positive means they owe the user, negative means the user owes them.
+    """
+    try:
+        return pending_service.get_balances(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve balances: {e}")
+
+@router.get("/{user_id}/balances/{person_name}")
+def get_balance(user_id: str, person_name: str):
+    try:
+        return pending_service.get_balance(user_id, person_name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve balance: {e}")
+
+@router.post("/{user_id}/balances/rebuild")
+def rebuild_balances(user_id: str):
+    """
+    Recomputes the balance index from the open pending items.
+    """
+    try:
+        return pending_service.rebuild_balances(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild balances: {e}")
+
+@router.post("/{user_id}/settle")
+def settle_pending_items(user_id: str, bulk: PendingBulk):
+    """
+    Marks several pending items as settled in one request.
+    """
+    try:
+        settled = pending_service.settle_pending_items(user_id, bulk.pending_ids)
+        return {"success": True, "settled": settled}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to settle items: {e}")
+
+@router.post("/{user_id}/delete")
+def delete_pending_items(user_id: str, bulk: PendingBulk):
+    """
+    Deletes several pending items in one request.
+    """
+    try:
+        deleted = pending_service.delete_pending_items(user_id, bulk.pending_ids)
+        return {"success": True, "deleted": deleted}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete items: {e}")
+
+@router.delete("/{user_id}/{item_id}")
+def delete_pending_item(user_id: str, item_id: int):
+    """
+    Deletes a specific pending item by its ID.
+    """
+    try:
+        deleted = pending_service.delete_pending_items(user_id, [item_id])
+        if not deleted:
+            raise HTTPException(status_code=404, detail=f"Item {item_id} not found.")
+        return {"success": True, "message": f"Item {item_id} deleted successfully."}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete item: {e}")
@@ -9,7 +9,7 @@ from services.prediction import (
 router = APIRouter(tags=["Prediction"])
 
 @router.get("/spending/{user_id}")
-def predict_spending(user_id: str, timeframe: str = 'monthly'):
+async def predict_spending(user_id: str, timeframe: str = 'monthly'):
     """
     Predicts future expenses for a given user.
 
@@ -24,7 +24,7 @@ def predict_spending(user_id: str, timeframe: str = 'monthly'):
     if timeframe not in ['daily', 'weekly', 'monthly']:
         raise HTTPException(status_code=400, detail="Invalid timeframe. Use 'daily', 'weekly', or 'monthly'.")
 
-    prediction = get_spending_prediction(user_id, timeframe)
+    prediction = await get_spending_prediction.aio(user_id, timeframe)
     
     if "message" in prediction:
         if prediction["message"] == "Not enough data for a reliable prediction.":
@@ -35,7 +35,7 @@ def predict_spending(user_id: str, timeframe: str = 'monthly'):
     return {"user_id": user_id, "timeframe": timeframe, "prediction": prediction}
 
 @router.get("/cashflow/{user_id}")
-def predict_cashflow(user_id: str, timeframe: str = 'monthly'):
+async def predict_cashflow(user_id: str, timeframe: str = 'monthly'):
     """
     Predicts future cashflow for a given user.
 
@@ -50,7 +50,7 @@ def predict_cashflow(user_id: str, timeframe: str = 'monthly'):
     if timeframe not in ['daily', 'weekly', 'monthly']:
         raise HTTPException(status_code=400, detail="Invalid timeframe. Use 'daily', 'weekly', or 'monthly'.")
 
-    prediction = get_cashflow_prediction(user_id, timeframe)
+    prediction = await get_cashflow_prediction.aio(user_id, timeframe)
     
     if "message" in prediction:
         if prediction["message"] == "Not enough data for a reliable prediction.":
@@ -61,7 +61,7 @@ def predict_cashflow(user_id: str, timeframe: str = 'monthly'):
     return {"user_id": user_id, "timeframe": timeframe, "prediction": prediction}
 
 @router.get("/spending/trend/daily/{user_id}")
-def daily_spending_trend(user_id: str):
+async def daily_spending_trend(user_id: str):
     """
     Gets the daily spending trend for the last 7 days.
 
@@ -71,7 +71,7 @@ def daily_spending_trend(user_id: str):
     Returns:
         dict: A dictionary containing the daily spending trend.
     """
-    trend = get_daily_spending_trend(user_id)
+    trend = await get_daily_spending_trend.aio(user_id)
     
     if "message" in trend:
         raise HTTPException(status_code=500, detail=trend["message"])
@@ -79,7 +79,7 @@ def daily_spending_trend(user_id: str):
     return {"user_id": user_id, "daily_spending_trend": trend}
 
 @router.get("/spending/trend/monthly/{user_id}")
-def monthly_spending_trend(user_id: str):
+async def monthly_spending_trend(user_id: str):
     """
     Gets the monthly spending trend for the last 12 months.
 
@@ -89,7 +89,7 @@ def monthly_spending_trend(user_id: str):
     Returns:
         dict: A dictionary containing the monthly spending trend.
     """
-    trend = get_monthly_spending_trend(user_id)
+    trend = await get_monthly_spending_trend.aio(user_id)
     
     if "message" in trend:
         raise HTTPException(status_code=500, detail=trend["message"])
@@ -1,18 +1,46 @@
 from fastapi import APIRouter, HTTPException
-from services.recurring_detector import detect_recurring
+from services.recurring_detector import get_recurring, rebuild_recurring_state, get_upcoming_bills
 
 router = APIRouter(tags=["Recurring Payments"])
 
 @router.get("/{user_id}")
-def get_user_recurrings(user_id: str):
+async def get_user_recurrings(user_id: str):
     """
-    Detects and returns a list of potential recurring payment for a given user.
+    Returns the recurring payments detected for a given user.
+    Reads the per-recipient state that intake keeps up to date.
     """
     try:
-        recurrings = detect_recurring(user_id)
+        recurrings = await get_recurring.aio(user_id)  # Identical concurrent requests share one read
         if not recurrings:
             return {"message": "No recurring payments detected."}
         return recurrings
     except Exception as e:
         # For any unexpected errors in the detection logic
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+@router.get("/{user_id}/upcoming")
+async def get_user_upcoming_bills(user_id: str, days: int = 30):
+    """
+    Returns the recurring payments expected in the next `days` days.
+    """
+    try:
+        bills = await get_upcoming_bills.aio(user_id, days)
+        if not bills:
+            return {"message": "No upcoming bills."}
+        return bills
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+@router.post("/{user_id}/rebuild")
+def rebuild_user_recurrings(user_id: str):
+    """
+    Recomputes the recurring-payment state from the user's full history.
+    Use it to repair the state after imports or manual edits.
+    """
+    try:
+        recurrings = rebuild_recurring_state(user_id)
+        if not recurrings:
+            return {"message": "No recurring payments detected."}
+        return recurrings
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
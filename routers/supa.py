@@ -2,6 +2,7 @@ from fastapi import APIRouter
 
 from models.supa import *
 from core.setup import initialize_supabase
+from services.serialization import respond
 
 router = APIRouter()
 DB = initialize_supabase()
@@ -16,10 +17,10 @@ async def read_all(table_name: str):
         .select("*")
         .execute()
     )
-    return response.data
+    return respond(response.data)
 
 # read one 
-@router.get("/read_one/transaction")
+@router.get("/read_one/transaction", responses={200: {"model": TransactionRows}})
 async def read_one_transaction(transaction: TransactionReadOne):
     user_id = transaction.user_id
     transaction_id = transaction.transaction_id
@@ -32,7 +33,7 @@ async def read_one_transaction(transaction: TransactionReadOne):
             .eq("transaction_id", transaction_id)
             .execute()
         )
-        return response.data
+        return respond(response.data)
     elif (transaction_id is None):
         response = (
             DB.table("transaction")
@@ -40,7 +41,7 @@ async def read_one_transaction(transaction: TransactionReadOne):
             .eq("user_id", user_id)
             .execute()
         )
-        return response.data
+        return respond(response.data)
     else:
         response = (
             DB.table("transaction")
@@ -49,7 +50,7 @@ async def read_one_transaction(transaction: TransactionReadOne):
             .eq("transaction_id", transaction_id)
             .execute()
         )
-        return response.data
+        return respond(response.data)
     
 @router.get("/read_one/limit")
 async def read_one_limit(limit: LimitReadOne):
@@ -0,0 +1,64 @@
+import asyncio
+import zlib
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import ValidationError
+
+from models.sync import SyncPullPage, SyncPush
+from services import sync as sync_service
+from services.resilience import CircuitOpen, DeadlineExceeded
+from services.serialization import respond
+
+router = APIRouter(tags=["Sync"])
+
+MAX_PUSH_BYTES = 8 * 1024 * 1024  # Decompressed push body
+
+
+async def _read_body(request):
+    """Request body, inflated if it was sent with Content-Encoding: gzip (bounded, so a small upload can't explode)."""
+    body = await request.body()
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            body = inflater.decompress(body, MAX_PUSH_BYTES + 1)
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Body is not valid gzip")
+    if len(body) > MAX_PUSH_BYTES:
+        raise HTTPException(status_code=413, detail="Push body is too large")
+    return body
+
+
+@router.get("/pull", responses={200: {"model": SyncPullPage}})
+async def pull(user_id: str, cursor: int = Query(0, ge=0),
+               limit: int = Query(sync_service.MAX_PULL_ROWS, ge=1, le=sync_service.MAX_PULL_ROWS)):
+    """
+    Rows of transaction, limit, pending and summary changed since `cursor`, plus deleted
+    keys. Start with cursor=0, then send back the returned cursor; pull again while
+    `has_more` is true.
+    """
+    try:
+        result = await asyncio.to_thread(sync_service.pull, user_id, cursor, limit)
+    except (CircuitOpen, DeadlineExceeded):
+        raise  # 503 / 504 via the handlers in main.py
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Sync pull failed: {e}")
+    return respond(result)
+
+
+@router.post("/push")
+async def push(request: Request):
+    """
+    Applies a batch of offline changes (JSON body, optionally gzip-compressed) and returns
+    one outcome per change. See services/sync.py for how conflicts are resolved.
+    """
+    try:
+        batch = SyncPush.model_validate_json(await _read_body(request))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    changes = [change.model_dump(exclude_none=True) for change in batch.changes]
+    try:
+        result = await asyncio.to_thread(sync_service.push, batch.user_id, batch.batch_id, changes)
+    except sync_service.SyncError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sync_service.PushInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "2"})
+    return respond(result)
@@ -0,0 +1,170 @@
+import sys
+from datetime import datetime, timezone
+import numpy as np
+from core.setup import initialize_supabase  # Using your custom initializer
+from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+from services.anomaly import LATE_NIGHT_START, LATE_NIGHT_END
+from services.timezones import as_local, as_utc
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+PROFILE_TABLE = 'activity_profile'
+HOURS_PER_WEEK = 168
+HALF_LIFE_DAYS = 60  # An event's weight halves after this many days
+MIN_PROFILE_WEIGHT = 20.0  # Below this the user falls back to the fixed late-night window
+LOW_PROBABILITY_RATIO = 0.1  # Flag hours at least 10x rarer than a uniform spread
+SMOOTHING = 0.05  # Pseudo-count added to every hour so unseen hours are not impossible
+PAGE_SIZE = 1000  # Rows fetched per Supabase request when rebuilding from history
+
+
+# --- 2. PROFILE ---
+class ActivityProfile:
+    """
+    Exponentially decayed hour-of-week histogram of one user's transactions.
+    The state is a fixed 168-slot array plus the time it was last decayed.
+    """
+
+    def __init__(self, weights=None, updated_at=None):
+        self.weights = np.zeros(HOURS_PER_WEEK) if weights is None else np.asarray(weights, dtype=float)
+        self.updated_at = as_utc(updated_at) if updated_at else None
+
+    @staticmethod
+    def slot(dt):
+        # Hour of the week in LOCAL_TIMEZONE: intake timestamps (+05:30) and stored created_at (UTC) agree
+        local = as_local(dt)
+        return local.weekday() * 24 + local.hour
+
+    def _decayed(self, dt):
+        """Weights as they would be at `dt`. Events older than the last update are not decayed."""
+        dt = as_utc(dt)
+        if self.updated_at is None or dt <= self.updated_at:
+            return self.weights
+        age_days = (dt - self.updated_at).total_seconds() / 86400
+        return self.weights * 0.5 ** (age_days / HALF_LIFE_DAYS)
+
+    def add(self, dt):
+        self.weights = self._decayed(dt).copy()
+        self.weights[self.slot(dt)] += 1.0
+        if self.updated_at is None or as_utc(dt) > self.updated_at:
+            self.updated_at = as_utc(dt)
+
+    def probability_ratio(self, dt):
+        """
+        Smoothed probability of `dt`'s hour (and its two neighbours) relative to a
+        uniform spread over the week: 1.0 is average, values near 0 are rare hours.
+        """
+        weights = self._decayed(dt)
+        i = self.slot(dt)
+        local = weights[i - 1] + weights[i] + weights[(i + 1) % HOURS_PER_WEEK] + 3 * SMOOTHING
+        total = weights.sum() + HOURS_PER_WEEK * SMOOTHING
+        return local / total * HOURS_PER_WEEK / 3
+
+    def is_unusual(self, dt):
+        if self._decayed(dt).sum() < MIN_PROFILE_WEIGHT:
+            # Cold start: keep the old fixed window until we know the user's routine
+            return LATE_NIGHT_START <= as_local(dt).hour <= LATE_NIGHT_END
+        return self.probability_ratio(dt) < LOW_PROBABILITY_RATIO
+
+
+# --- 3. PERSISTENCE ---
+def _fetch_timestamps(user_id, before_id=None):
+    """created_at of the user's stored transactions (only ids below `before_id` if given), oldest first."""
+    timestamps = []
+    start = 0
+    while True:
+        query = DB.table('transaction').select('created_at').eq('user_id', user_id)
+        if before_id is not None:
+            query = query.lt('transaction_id', before_id)
+        response = query.order('created_at').range(start, start + PAGE_SIZE - 1).execute()
+        page = response.data or []
+        for row in page:
+            try:
+                timestamps.append(parse_datetime(row['created_at']))
+            except Exception as e:
+                print(f"Skipping transaction due to date parse error: {e}")
+        if len(page) < PAGE_SIZE:
+            return timestamps
+        start += PAGE_SIZE
+
+
+def rebuild_profile(user_id, before_id=None):
+    """
+    Replays the user's stored transactions into a fresh profile and saves it.
+    Used on first load (users who had history before profiles existed) and by the
+    one-off backfill below; `before_id` leaves out the transaction being scored.
+    """
+    profile = ActivityProfile()
+    for dt in sorted(_fetch_timestamps(user_id, before_id), key=as_utc):
+        profile.add(dt)
+    save_profile(user_id, profile)
+    return profile
+
+
+def load_profile(user_id, before_id=None):
+    """
+    Fetches a user's activity profile with a single indexed lookup. A user without a
+    stored profile gets one rebuilt from their history (see rebuild_profile).
+    """
+    response = DB.table(PROFILE_TABLE).select('weights, updated_at').eq('user_id', user_id).execute()
+    if response.data and response.data[0].get('weights'):
+        row = response.data[0]
+        updated_at = parse_datetime(row['updated_at']) if row.get('updated_at') else None
+        return ActivityProfile(row['weights'], updated_at)
+    return rebuild_profile(user_id, before_id)
+
+
+def save_profile(user_id, profile):
+    DB.table(PROFILE_TABLE).upsert({
+        "user_id": user_id,
+        "weights": [round(float(w), 3) for w in profile.weights],
+        "updated_at": (profile.updated_at or datetime.now(timezone.utc)).isoformat(),
+    }).execute()
+
+
+# --- 4. BACKFILL ---
+def _user_ids():
+    """Distinct user_ids that have transactions, paged by transaction_id."""
+    user_ids = set()
+    last_id = 0
+    while True:
+        response = DB.table('transaction').select('transaction_id, user_id') \
+            .gt('transaction_id', last_id) \
+            .order('transaction_id') \
+            .limit(PAGE_SIZE) \
+            .execute()
+        page = response.data or []
+        user_ids.update(row['user_id'] for row in page)
+        if len(page) < PAGE_SIZE:
+            return sorted(user_ids)
+        last_id = page[-1]['transaction_id']
+
+
+def backfill(user_ids=None):
+    """One-off job: rebuilds every user's profile from their transaction history."""
+    user_ids = user_ids or _user_ids()
+    failed = 0
+    for i, user_id in enumerate(user_ids, 1):
+        try:
+            rebuild_profile(user_id)
+        except Exception as e:
+            failed += 1
+            print(f"⚠️ Activity profile rebuild failed for UserID '{user_id}': {e}")
+        if i % 100 == 0:
+            print(f"Rebuilt {i}/{len(user_ids)} activity profiles")
+    print(f"✅ Rebuilt {len(user_ids) - failed} activity profiles ({failed} failed)")
+
+
+# --- 5. EXECUTION ---
+def main(argv=None):
+    """One-off backfill: python -m services.activity_profile [user_id ...] (all users if none given)."""
+    print("--- Starting Activity Profile Backfill ---")
+    if not DB:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+        return
+    backfill(argv if argv is not None else sys.argv[1:])
+    print("\n--- Activity profile backfill finished. ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from services.metrics import metrics
+
+# --- 1. SETTINGS ---
+MAX_CONCURRENT_LLM_CALLS = 8  # Model calls in flight per worker process
+MAX_TRACKED_USERS = 50_000  # Token buckets kept per process (LRU)
+
+# Work classes: lower priority value is served first
+INTAKE = "intake"
+CHAT = "chat"
+IMPORT = "import"  # Bulk SMS history imports: only served when live traffic leaves room
+CLASSES = {
+    # name: (priority, bucket refill per second, bucket size, max queued, max wait in seconds)
+    INTAKE: (0, 1.0, 20, 200, 30.0),
+    CHAT: (1, 0.1, 5, 50, 10.0),
+    IMPORT: (2, 0.5, 5, 20, 60.0),
+}
+
+
+class Rejected(Exception):
+    """Raised when model-bound work is not admitted; mapped to 429 with Retry-After."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# --- 2. TOKEN BUCKETS ---
+class TokenBuckets:
+    """Per-(user, class) token buckets, refilled lazily on access."""
+
+    def __init__(self, max_users=MAX_TRACKED_USERS):
+        self.max_users = max_users
+        self.buckets = OrderedDict()  # (user_id, kind) -> [tokens, last_refill]
+        self.lock = threading.Lock()
+
+    def take(self, user_id, kind, now=None):
+        """Takes one token; returns 0 on success or the seconds until one is available."""
+        _, rate, capacity, _, _ = CLASSES[kind]
+        now = now or time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get((user_id, kind))
+            if bucket is None:
+                bucket = self.buckets[(user_id, kind)] = [capacity, now]
+                if len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end((user_id, kind))
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+
+# --- 3. CONTROLLER ---
+class _Waiter:
+    """A queued request. The controller grants it a slot directly and calls `wake`."""
+    __slots__ = ("kind", "granted", "wake")
+
+    def __init__(self, kind, wake):
+        self.kind = kind
+        self.granted = False
+        self.wake = wake
+
+
+class AdmissionController:
+    """
+    Global cap on concurrent model calls with a priority queue in front of it: queued
+    intake parsing is always served before queued chat. Callers over their per-user
+    rate, or arriving at a full queue, are rejected immediately instead of waiting.
+    Freed slots are handed to the head of the queue; async callers wait on a future, so
+    a queued request holds no thread.
+    """
+
+    def __init__(self, capacity=MAX_CONCURRENT_LLM_CALLS):
+        self.capacity = capacity
+        self.active = 0
+        self.queue = []  # heap of (priority, arrival, waiter)
+        self.depth = {kind: 0 for kind in CLASSES}
+        self.arrivals = itertools.count()
+        self.avg_hold = 2.0  # Seconds a slot is held, smoothed; used to estimate Retry-After
+        self.buckets = TokenBuckets()
+        self.lock = threading.Lock()
+
+    def _publish(self):
+        metrics.gauge("admission.active", self.active)
+        for kind, depth in self.depth.items():
+            metrics.gauge(f"admission.queue_depth.{kind}", depth)
+
+    def _reject(self, kind, reason, retry_after):
+        metrics.increment(f"admission.rejected.{kind}.{reason}")
+        raise Rejected(reason, max(1, math.ceil(retry_after)))
+
+    def _enter(self, user_id, kind, wake):
+        """Takes a free slot (returns None) or queues a waiter (returns it); raises Rejected."""
+        priority, _, _, max_queued, _ = CLASSES[kind]
+        wait = self.buckets.take(user_id, kind)
+        if wait:
+            self._reject(kind, "rate_limited", wait)
+        with self.lock:
+            if self.active < self.capacity and not self.queue:
+                self.active += 1
+                self._publish()
+                metrics.observe(f"admission.wait_seconds.{kind}", 0.0)
+                return None
+            if self.depth[kind] >= max_queued:
+                self._reject(kind, "queue_full", self.avg_hold * (len(self.queue) + 1) / self.capacity)
+            waiter = _Waiter(kind, wake)
+            heapq.heappush(self.queue, (priority, next(self.arrivals), waiter))
+            self.depth[kind] += 1
+            self._publish()
+            return waiter
+
+    def _grant(self):
+        """Hands free slots to the queue, highest priority first (lock held)."""
+        while self.queue and self.active < self.capacity:
+            _, _, waiter = heapq.heappop(self.queue)
+            self.depth[waiter.kind] -= 1
+            self.active += 1
+            waiter.granted = True
+            waiter.wake()
+        self._publish()
+
+    def _leave(self, waiter):
+        """A waiter gives up (timeout, cancel). Returns True if it was granted a slot meanwhile."""
+        with self.lock:
+            if waiter.granted:
+                return True
+            self.queue = [item for item in self.queue if item[2] is not waiter]
+            heapq.heapify(self.queue)
+            self.depth[waiter.kind] -= 1
+            self._publish()
+            return False
+
+    def acquire(self, user_id, kind):
+        """Blocking acquire, for callers already on a worker thread (intake parsing, imports)."""
+        granted = threading.Event()
+        started = time.monotonic()
+        waiter = self._enter(user_id, kind, granted.set)
+        if waiter is None:
+            return
+        if not granted.wait(CLASSES[kind][4]) and not self._leave(waiter):
+            self._reject(kind, "timeout", self.avg_hold)
+        metrics.observe(f"admission.wait_seconds.{kind}", time.monotonic() - started)
+
+    async def acquire_async(self, user_id, kind):
+        """Same as acquire(), awaited on the event loop without holding a thread."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        started = time.monotonic()
+        waiter = self._enter(user_id, kind, wake)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), CLASSES[kind][4])
+        except asyncio.TimeoutError:
+            if not self._leave(waiter):
+                self._reject(kind, "timeout", self.avg_hold)
+        except asyncio.CancelledError:
+            if self._leave(waiter):
+                self.release(0.0)  # Granted just as the caller went away: hand it back
+            raise
+        metrics.observe(f"admission.wait_seconds.{kind}", time.monotonic() - started)
+
+    def release(self, held_seconds):
+        with self.lock:
+            self.active -= 1
+            self.avg_hold = 0.9 * self.avg_hold + 0.1 * held_seconds
+            self._grant()
+
+    @contextmanager
+    def slot(self, user_id, kind):
+        """Holds one model-call slot for the body of the `with` block (blocking callers)."""
+        self.acquire(user_id, kind)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def async_slot(self, user_id, kind):
+        """Same as slot(), for coroutines: queued callers wait on the event loop, not on a thread."""
+        await self.acquire_async(user_id, kind)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+
+admission = AdmissionController()
@@ -0,0 +1,287 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+from core.setup import initialize_supabase  # Using your custom initializer
+from services import semantic_index
+from services.timezones import LOCAL_TIMEZONE
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+CACHE_TTL_SECONDS = 120  # Tool results are reused for this long within and across answers
+MAX_CACHED_USERS = 5_000
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+MAX_SEARCH_RESULTS = 25
+QUERY_WORKERS = 8  # Supabase requests run concurrently by one tool call
+
+Period = Literal["today", "this_week", "last_week", "this_month", "last_month", "last_30_days", "last_90_days", "this_year"]
+
+pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="agent-tools")
+
+
+def period_range(period, now=None):
+    """
+    Returns the [start, end) of a named period as aware datetimes. Days, weeks, months
+    and years begin at midnight in LOCAL_TIMEZONE, not UTC midnight (05:30 in India).
+    """
+    now = (now or datetime.now(timezone.utc)).astimezone(LOCAL_TIMEZONE)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    if period == "today":
+        return today, now
+    if period == "this_week":
+        return week_start, now
+    if period == "last_week":
+        return week_start - timedelta(days=7), week_start
+    if period == "this_month":
+        return month_start, now
+    if period == "last_month":
+        return (month_start - timedelta(days=1)).replace(day=1), month_start
+    if period == "last_30_days":
+        return now - timedelta(days=30), now
+    if period == "last_90_days":
+        return now - timedelta(days=90), now
+    if period == "this_year":
+        return today.replace(month=1, day=1), now
+    raise ValueError(f"Unknown period '{period}'")
+
+
+# --- 2. CACHE ---
+class ToolCache:
+    """Per-user TTL cache of query results; a user's entries can be dropped together."""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_users=MAX_CACHED_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.users = OrderedDict()  # user_id -> {key: (expires_at, value)}
+        self.lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self.lock:
+            entries = self.users.get(user_id)
+            entry = entries.get(key) if entries else None
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self.users.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, key, value):
+        with self.lock:
+            entries = self.users.setdefault(user_id, {})
+            entries[key] = (time.monotonic() + self.ttl, value)
+            self.users.move_to_end(user_id)
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+
+cache = ToolCache()
+
+
+def _cached(user_id, key, compute):
+    value = cache.get(user_id, key)
+    if value is None:
+        value = compute()
+        cache.put(user_id, key, value)
+    return value
+
+
+def invalidate(user_id):
+    """Intake hook: drops the user's cached results so new transactions are visible."""
+    cache.invalidate(user_id)
+
+
+# --- 3. QUERIES ---
+def _fetch_expenses(user_id, period):
+    """Expense rows of one period (refund pairs excluded), cached per user and period."""
+    def fetch():
+        start, end = period_range(period)
+        rows = []
+        offset = 0
+        while True:
+            page = DB.table('transaction').select('amount, category, sender_name') \
+                .eq('user_id', user_id) \
+                .eq('payment_type', 'expense') \
+                .gte('created_at', start.isoformat()) \
+                .lt('created_at', end.isoformat()) \
+                .is_('refunded_by', 'null') \
+                .order('transaction_id') \
+                .range(offset, offset + PAGE_SIZE - 1) \
+                .execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+    return _cached(user_id, ("expenses", period), fetch)
+
+
+def _fetch_many(user_id, periods):
+    """Fetches several periods concurrently; returns {period: rows}."""
+    futures = {period: pool.submit(_fetch_expenses, user_id, period) for period in set(periods)}
+    return {period: future.result() for period, future in futures.items()}
+
+
+def _totals(rows, field):
+    totals = defaultdict(float)
+    for tx in rows:
+        if tx.get('amount') is not None:
+            totals[tx.get(field) or 'Unknown'] += float(tx['amount'])
+    return totals
+
+
+def _rounded(pairs):
+    return [{"name": name, "amount": round(amount, 2)} for name, amount in pairs]
+
+
+# --- 4. TOOLS ---
+def spend_by_category(user_id: str, period: Period = "this_month", category: Optional[str] = None):
+    """Total spend per category in a period, largest first (or just one category)."""
+    rows = _fetch_expenses(user_id.strip(), period)
+    totals = _totals(rows, 'category')
+    if category:
+        wanted = category.strip().lower()
+        totals = {name: amount for name, amount in totals.items() if name.lower() == wanted}
+    return {
+        "period": period,
+        "total": round(sum(totals.values()), 2),
+        "categories": _rounded(sorted(totals.items(), key=lambda kv: -kv[1])),
+    }
+
+
+def top_merchants(user_id: str, period: Period = "this_month", limit: int = 5):
+    """Merchants the user spent the most with in a period."""
+    rows = _fetch_expenses(user_id.strip(), period)
+    totals = _totals(rows, 'sender_name')
+    return {
+        "period": period,
+        "merchants": _rounded(sorted(totals.items(), key=lambda kv: -kv[1])[:max(1, min(limit, 25))]),
+    }
+
+
+def compare_periods(user_id: str, current: Period = "this_month", previous: Period = "last_month",
+                    category: Optional[str] = None):
+    """Spend in two periods side by side (optionally for one category); both are fetched concurrently."""
+    user_id = user_id.strip()
+    rows = _fetch_many(user_id, [current, previous])
+    result = {}
+    for label, period in (("current", current), ("previous", previous)):
+        totals = _totals(rows[period], 'category')
+        if category:
+            totals = {k: v for k, v in totals.items() if k.lower() == category.strip().lower()}
+        result[label] = {"period": period, "total": round(sum(totals.values()), 2)}
+    before, after = result["previous"]["total"], result["current"]["total"]
+    result["category"] = category
+    result["change"] = round(after - before, 2)
+    result["change_percent"] = round((after - before) / before * 100, 1) if before else None
+    return result
+
+
+def search_transactions(user_id: str, merchant: Optional[str] = None, category: Optional[str] = None,
+                        payment_type: Optional[Literal["income", "expense"]] = None,
+                        min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                        period: Period = "last_90_days", limit: int = 10):
+    """Latest transactions matching the filters (merchant is a case-insensitive substring)."""
+    user_id = user_id.strip()
+    key = ("search", merchant, category, payment_type, min_amount, max_amount, period, limit)
+
+    def fetch():
+        start, end = period_range(period)
+        query = DB.table('transaction') \
+            .select('transaction_id, created_at, amount, sender_name, category, payment_type, anomaly') \
+            .eq('user_id', user_id) \
+            .gte('created_at', start.isoformat()) \
+            .lt('created_at', end.isoformat())
+        if merchant:
+            query = query.ilike('sender_name', f"%{merchant.strip()}%")
+        if category:
+            query = query.ilike('category', category.strip())
+        if payment_type:
+            query = query.eq('payment_type', payment_type)
+        if min_amount is not None:
+            query = query.gte('amount', min_amount)
+        if max_amount is not None:
+            query = query.lte('amount', max_amount)
+        response = query.order('created_at', desc=True).limit(max(1, min(limit, MAX_SEARCH_RESULTS))).execute()
+        return {"period": period, "transactions": response.data or []}
+
+    return _cached(user_id, key, fetch)
+
+
+def find_transactions(user_id: str, description: str, limit: int = 5):
+    """Transactions that best match a free-text description (semantic index, not exact filters)."""
+    results = semantic_index.search(user_id.strip(), description, k=max(1, min(limit, MAX_SEARCH_RESULTS)))
+    if results is None:
+        return {"transactions": [], "note": "The search index is still loading; use search_transactions with filters."}
+    return {"transactions": [dict(row, score=round(score, 3)) for score, row in results]}
+
+
+# --- 5. LANGCHAIN WRAPPERS ---
+class SpendByCategoryArgs(BaseModel):
+    user_id: str = Field(description="The user's ID, as given in the request.")
+    period: Period = "this_month"
+    category: Optional[str] = Field(None, description="Only this category, eg 'Food'.")
+
+
+class TopMerchantsArgs(BaseModel):
+    user_id: str = Field(description="The user's ID, as given in the request.")
+    period: Period = "this_month"
+    limit: int = Field(5, ge=1, le=25)
+
+
+class ComparePeriodsArgs(BaseModel):
+    user_id: str = Field(description="The user's ID, as given in the request.")
+    current: Period = "this_month"
+    previous: Period = "last_month"
+    category: Optional[str] = Field(None, description="Compare only this category, eg 'Food'.")
+
+
+class FindTransactionsArgs(BaseModel):
+    user_id: str = Field(description="The user's ID, as given in the request.")
+    description: str = Field(description="What the user remembers, eg 'that cafe last tuesday'.")
+    limit: int = Field(5, ge=1, le=MAX_SEARCH_RESULTS)
+
+
+class SearchTransactionsArgs(BaseModel):
+    user_id: str = Field(description="The user's ID, as given in the request.")
+    merchant: Optional[str] = Field(None, description="Part of the merchant / sender name.")
+    category: Optional[str] = None
+    payment_type: Optional[Literal["income", "expense"]] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    period: Period = "last_90_days"
+    limit: int = Field(10, ge=1, le=MAX_SEARCH_RESULTS)
+
+
+def build_tools():
+    """The aggregate tools, typed so the model fills in every argument in a single call."""
+    return [
+        StructuredTool.from_function(
+            spend_by_category, name="spend_by_category", args_schema=SpendByCategoryArgs,
+            description="Total spending per category for a period. Use for 'how much did I spend on X' questions.",
+        ),
+        StructuredTool.from_function(
+            top_merchants, name="top_merchants", args_schema=TopMerchantsArgs,
+            description="Merchants with the highest spending in a period.",
+        ),
+        StructuredTool.from_function(
+            compare_periods, name="compare_periods", args_schema=ComparePeriodsArgs,
+            description="Compare total (or one category's) spending between two periods, eg this month vs last month.",
+        ),
+        StructuredTool.from_function(
+            search_transactions, name="search_transactions", args_schema=SearchTransactionsArgs,
+            description="Find individual transactions by merchant, category, type, amount range and period.",
+        ),
+        StructuredTool.from_function(
+            find_transactions, name="find_transactions", args_schema=FindTransactionsArgs,
+            description="Find transactions from a vague description ('that cafe I paid last tuesday') when exact filters are unknown.",
+        ),
+    ]
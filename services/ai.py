@@ -1,26 +1,27 @@
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 import os
-from supabase import create_client, Client  # Replaced Firebase
+from core.setup import initialize_supabase
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools import Tool
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from datetime import datetime
+from services.chat_store import store as chat_store
+from services.intent_router import route as route_intent
+from services.digest import get_digest
+from services.agent_tools import build_tools as build_aggregate_tools
+from services.admission import admission, Rejected, CHAT
+from services.resilience import gemini, CircuitOpen, DeadlineExceeded
 
 # --- CONFIGURATION & SETUP ---
 load_dotenv()
 
-# 1a. Supabase Initialization (Replaced Firebase)
+# 1a. Supabase Initialization (shared client: deadlines and circuit breaker included)
 try:
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
-    if not supabase_url or not supabase_key:
-        raise ValueError("SUPABASE_URL or SUPABASE_KEY environment variables not set.")
-
     # Use 'db' as variable name to minimize changes
-    db: Client = create_client(supabase_url, supabase_key)
+    db = initialize_supabase()
     print("--- Supabase Initialized Successfully ---")
 except Exception as e:
     print(f"Supabase initialization failed: {e}\nPlease ensure your .env file is present and valid.")
@@ -32,6 +33,7 @@ if not api_key:
     raise ValueError("GOOGLE_API_KEY environment variable not set.")
 
 # --- GLOBAL AGENT EXECUTOR ---
+AGENT_TIMEOUT_SECONDS = 90
 agent_executor = None
 agent_initialized = False
 
@@ -40,91 +42,49 @@ agent_initialized = False
 
 def get_financial_data(user_id: str) -> str:
     """
-    Fetches the latest income and expense transactions for a specific user_id from Supabase
-    and returns them as a formatted string for the AI to analyze.
+    Returns the user's precomputed financial digest (totals by period, top categories
+    and merchants, recurring payments, recent anomalies) in one cached lookup.
     """
-    if not db:
-        return "Error: Supabase is not connected."
-
-    print(f"--- TOOL: Fetching financial data for UserID: {user_id} ---")
-
+    print(f"--- TOOL: Fetching financial digest for UserID: {user_id} ---")
     try:
-        # Fetch latest 25 income transactions
-        # *** ASSUMPTION: 'payment_type' is 'income' for income ***
-        income_res = db.table('transaction').select('*') \
-            .eq('user_id', user_id) \
-            .eq('payment_type', 'income') \
-            .order('created_at', desc=True) \
-            .limit(25).execute()
-        income_list = income_res.data
-
-        # Fetch latest 25 expense transactions
-        # *** ASSUMPTION: 'payment_type' is 'expense' for expenses ***
-        expenses_res = db.table('transaction').select('*') \
-            .eq('user_id', user_id) \
-            .eq('payment_type', 'expense') \
-            .order('created_at', desc=True) \
-            .limit(25).execute()
-        expenses_list = expenses_res.data
-
-        if not income_list and not expenses_list:
-            return "No transaction data found for this user."
-
-        # Format the data into a readable string for the LLM
-        response_str = "Here is the user's recent financial data:\n"
-
-        if income_list:
-            response_str += "\n--- Recent Income ---\n"
-            for item in income_list:
-                # Using 'sender_name' and 'created_at' from your schema
-                response_str += f"- Amount: {item.get('amount')}, From: {item.get('sender_name')}, Date: {item.get('created_at')}\n"
-
-        if expenses_list:
-            response_str += "\n--- Recent Expenses ---\n"
-            for item in expenses_list:
-                # Using 'sender_name' and 'created_at' from your schema
-                response_str += f"- Amount: {item.get('amount')}, To: {item.get('sender_name')}, Date: {item.get('created_at')}\n"
-
-        return response_str
-
+        return get_digest(user_id.strip())
     except Exception as e:
-        print(f"Error fetching data from Supabase: {e}")
+        print(f"Error fetching financial digest: {e}")
         return f"An error occurred while fetching financial data: {e}"
 
 
 # --- AGENT INITIALIZATION ---
 
-def initialize_agent():
+def build_agent_executor(use_aggregate_tools=True, return_intermediate_steps=False):
     """
-    Initializes the language model, tools, and agent executor.
-    Runs only once when the application first starts.
+    Builds the tool-calling agent. With `use_aggregate_tools` the typed aggregate tools
+    (services/agent_tools.py) are offered next to the digest tool.
     """
-    global agent_executor, agent_initialized
-    if agent_initialized:
-        return
-
-    print("--- Initializing Financial Agent ---")
-
     # 1. Initialize LLM
-    llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro", temperature=0.3)
+    llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro", temperature=0.3, timeout=gemini.timeout)
 
     # 2. Create Tools
     financial_tool = Tool(
         name="financial_data_retriever",
         func=get_financial_data,
         description="""
-        Use this tool to search the user's financial records in Supabase to answer questions about their income, expenses, and spending patterns.
+        Use this tool to get a digest of the user's finances: spending and income totals for today, 7, 30 and 90 days,
+        top categories and merchants, recurring payments and recently flagged transactions.
         This tool requires the 'user_id' as an argument.
         """
     )
     tools = [financial_tool]
+    if use_aggregate_tools:
+        tools.extend(build_aggregate_tools())
 
     # 3. Create Prompt
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system",
              "You are a friendly and helpful AI Financial Assistant. Your primary goal is to answer questions about the user's spending and income by analyzing their transaction data. "
-             "You MUST use the 'financial_data_retriever' tool to get the user's transaction history. The user's ID is provided with each request. "
+             "You MUST use the tools to get the user's financial data. The user's ID is provided with each request. "
+             "Start with 'financial_data_retriever' for an overview; use the aggregate tools for exact totals per category, merchant or period, "
+             "comparisons between periods and looking up specific transactions. Prefer one aggregate call over reasoning across raw rows. "
              "Do NOT answer questions about their personal finances from your own general knowledge. If the tool returns no data, inform the user that you couldn't find any transactions for them."),
             ("placeholder", "{chat_history}"),
             ("human", "{input}\n\nUser ID: {user_id}"),  # Pass user_id directly in the prompt
@@ -132,9 +92,22 @@ def initialize_agent():
         ]
     )
 
-    # 4. Create and Assign Agent Executor
+    # 4. Create Agent Executor
     agent = create_tool_calling_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    return AgentExecutor(agent=agent, tools=tools, verbose=True, return_intermediate_steps=return_intermediate_steps)
+
+
+def initialize_agent():
+    """
+    Initializes the language model, tools, and agent executor.
+    Runs only once when the application first starts.
+    """
+    global agent_executor, agent_initialized
+    if agent_initialized:
+        return
+
+    print("--- Initializing Financial Agent ---")
+    agent_executor = build_agent_executor()
     agent_initialized = True
     print("--- Financial Agent Initialized Successfully ---")
 
@@ -142,32 +115,18 @@ def initialize_agent():
 # --- CHAT HISTORY MANAGEMENT ---
 
 def get_chat_history(user_id: str):
-    """Fetches chat history from the 'chat_history' table in Supabase."""
-    if not db: return []
+    """Fetches the latest chat messages ({"role", "content"}) from the shared chat store."""
     try:
-        response = db.table("chat_history").select("chat_history").eq("user_id", user_id).execute()
-        if response.data:
-            # Your schema has 'chat_history' as the json column
-            return response.data[0].get('chat_history', [])
-        return []
+        return chat_store.get_recent(user_id)
     except Exception as e:
         print(f"Error getting chat history: {e}")
         return []
 
 
 def update_chat_history(user_id: str, query: str, response: str):
-    """Updates chat history in the 'chat_history' table in Supabase."""
-    if not db: return
+    """Appends the turn to the chat store; it is persisted by the write-behind flusher."""
     try:
-        history = get_chat_history(user_id)
-        history.append({"human": query, "ai": response})
-        history = history[-20:]  # Keep last 20 messages
-
-        # Use upsert to create or update the record
-        db.table("chat_history").upsert({
-            "user_id": user_id,
-            "chat_history": history
-        }).execute()
+        chat_store.append_turn(user_id, query, response)
     except Exception as e:
         print(f"Error updating chat history: {e}")
 
@@ -194,20 +153,37 @@ def handle_chat():
     user_id = data["UserID"]
     query = data["query"]
 
+    # Common questions are answered from precomputed data without running the agent
+    routed = route_intent(user_id, query)
+    if routed is not None:
+        update_chat_history(user_id, query, routed)
+        return jsonify({"response": routed})
+
     raw_history = get_chat_history(user_id)
     chat_history = []
     for record in raw_history:
-        if record.get("human"): chat_history.append(HumanMessage(content=record["human"]))
-        if record.get("ai"): chat_history.append(AIMessage(content=record["ai"]))
+        if record["role"] == "user": chat_history.append(HumanMessage(content=record["content"]))
+        if record["role"] == "assistant": chat_history.append(AIMessage(content=record["content"]))
 
     try:
         # Invoke the agent, passing the user_id for the tool to use
-        response = agent_executor.invoke({"input": query, "chat_history": chat_history, "user_id": user_id})
+        with admission.slot(user_id, CHAT):
+            # Several model and tool round trips, so a longer deadline than a single call
+            response = gemini.call(
+                lambda: agent_executor.invoke({"input": query, "chat_history": chat_history, "user_id": user_id}),
+                timeout=AGENT_TIMEOUT_SECONDS,
+            )
         ai_response = response["output"]
 
         update_chat_history(user_id, query, ai_response)
 
         return jsonify({"response": ai_response})
+    except Rejected as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    except CircuitOpen as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"An error occurred during agent execution: {e}")
         return jsonify({"error": "An error occurred while processing your request."}), 500
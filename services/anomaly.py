@@ -1,124 +1,207 @@
 import os
 import numpy as np
-from collections import defaultdict
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from dateutil.parser import parse as parse_datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from supabase import Client
 from core.setup import initialize_supabase
 
+# --- 1. Settings ---
+
+# Keywords to identify and exclude known large, recurring payments from anomaly detection.
+RECURRING_EXPENSE_KEYWORDS = ['rent', 'housing', 'monthly fee', 'subscription']
+IQR_MULTIPLIER = 2.0  # Upper bound is Q3 + IQR_MULTIPLIER * IQR
+MIN_CATEGORY_SAMPLES = 5  # Categories with fewer transactions are not checked
+
+# Cold-start late-night window, used until a user's activity profile has enough history
+LATE_NIGHT_START = 1  # 1 AM
+LATE_NIGHT_END = 5  # 5 AM
+
+JOB_NAME = 'anomaly_scan'
+JOB_STATE_TABLE = 'job_state'
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+USERS_PER_PARTITION = 200  # Users whose history is scanned together in one worker task
+UPDATE_BATCH_SIZE = 500  # transaction_ids per bulk update request
+
+
 # --- 2. Data Fetching ---
 
-def fetch_transactions(db: Client):
-    """
-    Fetches all documents from the 'transaction' table.
+def _page(query_factory):
+    """Yields pages of rows from a query ordered by transaction_id until it is exhausted."""
+    start = 0
+    while True:
+        page = query_factory().range(start, start + PAGE_SIZE - 1).execute().data or []
+        if page:
+            yield page
+        if len(page) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
 
-    Args:
-        db: The initialized Supabase client.
+
+def fetch_new_transaction_users(db: Client, high_water_mark: int):
+    """
+    Streams the (transaction_id, user_id) of every transaction added after the high-water mark.
 
     Returns:
-        list: A list of transaction dictionaries, or an empty list if an error occurs or table is empty.
+        tuple: (sorted list of affected user_ids, highest transaction_id seen)
     """
-    try:
-        # Select all columns from the 'transaction' table
-        response = db.table('transaction').select('*').execute()
+    users = set()
+    newest = high_water_mark
+    pages = _page(lambda: db.table('transaction').select('transaction_id, user_id')
+                  .gt('transaction_id', high_water_mark)
+                  .order('transaction_id'))
+    for page in pages:
+        for tx in page:
+            users.add(tx['user_id'])
+            newest = max(newest, tx['transaction_id'])
+    print(f"📊 Found {len(users)} users with transactions after #{high_water_mark}.")
+    return sorted(users, key=str), newest
+
+
+def fetch_partition(db: Client, user_ids):
+    """
+    Loads the expense history of one partition of users as columnar arrays,
+    ready to be shipped to a worker process.
+    """
+    tx_ids, groups, amounts, excluded = [], [], [], []
+    pages = _page(lambda: db.table('transaction')
+                  .select('transaction_id, user_id, category, amount, message')
+                  .in_('user_id', list(user_ids))
+                  .eq('payment_type', 'expense')
+                  .is_('refunded_by', 'null')
+                  .order('transaction_id'))
+    for page in pages:
+        for tx in page:
+            if tx.get('amount') is None:
+                continue
+            message = str(tx.get('message') or '').lower()
+            tx_ids.append(tx['transaction_id'])
+            groups.append(f"{tx['user_id']}\x1f{tx.get('category') or 'Uncategorized'}")
+            amounts.append(float(tx['amount']))
+            excluded.append(any(keyword in message for keyword in RECURRING_EXPENSE_KEYWORDS))
+
+    if groups:
+        _, group_codes = np.unique(np.array(groups, dtype=object), return_inverse=True)
+    else:
+        group_codes = np.zeros(0, dtype=int)
+    return (
+        np.array(tx_ids, dtype=np.int64),
+        group_codes,
+        np.array(amounts, dtype=float),
+        np.array(excluded, dtype=bool),
+    )
 
-        transactions = response.data
 
-        if not transactions:
-            print("⚠️ Warning: No documents found in 'transaction' table.")
-        else:
-            print(f"📊 Found {len(transactions)} transactions.")
-        return transactions
-    except Exception as e:
-        print(f"🔥 Error fetching transactions: {e}")
-        return []
+# --- 3. Anomaly Detection Algorithms ---
 
+def _group_percentile(sorted_amounts, starts, counts, p):
+    """Linear-interpolated percentile of every group in one vectorized pass."""
+    rank = (counts - 1) * p
+    low = np.floor(rank).astype(int)
+    high = np.minimum(low + 1, counts - 1)
+    lower = sorted_amounts[starts + low]
+    upper = sorted_amounts[starts + high]
+    return lower + (upper - lower) * (rank - low)
 
-# --- 3. Anomaly Detection Algorithms ---
 
-def detect_amount_anomalies_by_category(transactions):
-    """
-    Detects transactions with unusually high amounts within their category using the IQR method,
-    while ignoring known recurring large payments like rent.
+def category_upper_bounds(group_codes, amounts):
     """
-    print("   - Running Categorical Amount Anomaly Detection...")
+    Computes the Q3 + IQR_MULTIPLIER * IQR bound of every (user, category) group at once.
+    Groups smaller than MIN_CATEGORY_SAMPLES get an infinite bound.
 
-    # Keywords to identify and exclude known large, recurring payments from anomaly detection.
-    RECURRING_EXPENSE_KEYWORDS = ['rent', 'housing', 'monthly fee', 'subscription']
-
-    # Group transactions by category, excluding known recurring ones from the check.
-    categorized_transactions = defaultdict(list)
+    Returns:
+        np.ndarray: the upper bound indexed by group code.
+    """
+    n_groups = int(group_codes.max()) + 1 if len(group_codes) else 0
+    bounds = np.full(n_groups, np.inf)
+    if not n_groups:
+        return bounds
 
-    for tx in transactions:
-        # Ensure message is a string before calling .lower()
-        message = tx.get('message', '')
-        if not isinstance(message, str):
-            message = str(message)
+    order = np.lexsort((amounts, group_codes))
+    sorted_groups = group_codes[order]
+    sorted_amounts = amounts[order]
 
-        # Rule-Based Filtering
-        if any(keyword in message.lower() for keyword in RECURRING_EXPENSE_KEYWORDS):
-            continue  # Skip this transaction from amount anomaly check
+    present, starts, counts = np.unique(sorted_groups, return_index=True, return_counts=True)
+    q1 = _group_percentile(sorted_amounts, starts, counts, 0.25)
+    q3 = _group_percentile(sorted_amounts, starts, counts, 0.75)
 
-        # Use 'category' field from your schema
-        category = tx.get('category', 'Uncategorized')
-        categorized_transactions[category].append(tx)
+    eligible = counts >= MIN_CATEGORY_SAMPLES
+    bounds[present[eligible]] = (q3 + (q3 - q1) * IQR_MULTIPLIER)[eligible]
+    return bounds
 
-    anomaly_ids = set()
 
-    # Perform IQR analysis on each category
-    for category, tx_list in categorized_transactions.items():
-        if len(tx_list) < 5:
-            continue
+def scan_partition(args):
+    """
+    Worker task: flags the new transactions of one partition whose amount is unusual
+    for the user's own category history. Time anomalies are scored at intake against
+    the user's learned activity profile (services/activity_profile.py).
 
-        # Use 'amount' field from your schema
-        amounts = [tx['amount'] for tx in tx_list if 'amount' in tx and tx['amount'] is not None]
-        if not amounts:
-            continue
+    Returns:
+        list: transaction_ids to flag.
+    """
+    tx_ids, group_codes, amounts, excluded, high_water_mark = args
+    checked = ~excluded
+    bounds = category_upper_bounds(group_codes[checked], amounts[checked])
 
-        q1 = np.percentile(amounts, 25)
-        q3 = np.percentile(amounts, 75)
-        iqr = q3 - q1
+    is_new = tx_ids > high_water_mark
+    high_amount = np.zeros(len(tx_ids), dtype=bool)
+    if checked.any():
+        high_amount[checked] = amounts[checked] > bounds[group_codes[checked]]
+    return tx_ids[is_new & high_amount].tolist()
 
-        upper_bound = q3 + (iqr * 2.0)
 
-        print(f"     - Category '{category}': Upper threshold set at ₹{upper_bound:,.2f}")
+# --- 4. Write-back & Job State ---
 
-        for tx in tx_list:
-            # Use 'amount' and 'transaction_id' fields
-            if tx.get('amount', 0) > upper_bound:
-                anomaly_ids.add(tx.get('transaction_id'))
+def flag_transactions(db: Client, transaction_ids):
+    """Sets anomaly = true on the given transactions with bulk updates."""
+    transaction_ids = sorted(set(transaction_ids))
+    for i in range(0, len(transaction_ids), UPDATE_BATCH_SIZE):
+        db.table('transaction').update({"anomaly": True}) \
+            .in_('transaction_id', transaction_ids[i:i + UPDATE_BATCH_SIZE]) \
+            .execute()
+    return len(transaction_ids)
 
-    return anomaly_ids
 
+def load_high_water_mark(db: Client, job=JOB_NAME):
+    response = db.table(JOB_STATE_TABLE).select('high_water_mark').eq('job', job).execute()
+    if response.data:
+        return response.data[0].get('high_water_mark') or 0
+    return 0
 
-def detect_time_anomalies(transactions):
-    """
-    Detects transactions that occur at unusual times (e.g., late at night).
-    """
-    LATE_NIGHT_START = 1  # 1 AM
-    LATE_NIGHT_END = 5  # 5 AM
 
-    anomaly_ids = set()
-    for tx in transactions:
-        # Use 'created_at' field from your schema
-        timestamp_str = tx.get('created_at')
-        if not timestamp_str:
-            continue
+def save_high_water_mark(db: Client, value, job=JOB_NAME):
+    db.table(JOB_STATE_TABLE).upsert({
+        "job": job,
+        "high_water_mark": value,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }).execute()
 
-        try:
-            # Parse the ISO 8601 timestamp string from Supabase
-            dt = parse_datetime(timestamp_str)
-            hour = dt.hour
-        except Exception:
-            # Skip if the timestamp is in an unexpected format
-            continue
 
-        if LATE_NIGHT_START <= hour <= LATE_NIGHT_END:
-            # Use 'transaction_id' field
-            anomaly_ids.add(tx.get('transaction_id'))
+def run_batch(db: Client, workers=None):
+    """
+    Scans every transaction added since the last run and writes the anomaly flag back.
+    Partitions are loaded one after another while earlier ones are scored in the pool.
 
-    print("   - Time Anomaly Detection: Flagging transactions between 1 AM and 5 AM.")
-    return anomaly_ids
+    Returns:
+        int: number of transactions flagged.
+    """
+    high_water_mark = load_high_water_mark(db)
+    users, newest = fetch_new_transaction_users(db, high_water_mark)
+    if not users:
+        return 0
+
+    flagged = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for i in range(0, len(users), USERS_PER_PARTITION):
+            partition = fetch_partition(db, users[i:i + USERS_PER_PARTITION])
+            futures.append(pool.submit(scan_partition, partition + (high_water_mark,)))
+        for future in futures:
+            flagged.update(future.result())
+
+    flag_transactions(db, flagged)
+    # Only advance the mark once every flag is written, so a failed run is simply retried
+    save_high_water_mark(db, newest)
+    return len(flagged)
 
 
 def main():
@@ -133,54 +216,17 @@ def main():
         print("\n--- Halting execution due to Supabase connection error. ---")
         return
 
-    transactions = fetch_transactions(db)
-
-    if not transactions:
-        print("\n--- Halting execution as there are no transactions to analyze. ---")
-        return
-
-    print("\n🔬 Running improved anomaly detection algorithms...")
-    high_amount_ids = detect_amount_anomalies_by_category(transactions)
-    unusual_time_ids = detect_time_anomalies(transactions)
+    print("\n🔬 Running partitioned anomaly scan...")
+    flagged = run_batch(db, workers=os.cpu_count())
 
     print("\n--- Analysis Complete ---")
-
-    flagged_anomalies = []
-    for tx in transactions:
-        reasons = []
-        # Use 'transaction_id' field
-        tx_id = tx.get('transaction_id')
-
-        if tx_id in high_amount_ids:
-            # Use 'category' field
-            reasons.append(f"Amount is significantly higher than other '{tx.get('category', 'N/A')}' expenses.")
-        if tx_id in unusual_time_ids:
-            reasons.append("Transaction occurred at an unusual time (late night).")
-
-        if reasons:
-            flagged_anomalies.append({'transaction': tx, 'reasons': reasons})
-
-    if not flagged_anomalies:
-        print("\n✅ No anomalies detected. All transactions appear normal.")
+    if not flagged:
+        print("\n✅ No anomalies detected. All new transactions appear normal.")
     else:
-        print(f"\n🚨 Found {len(flagged_anomalies)} potential anomalies:\n")
-        for i, anomaly in enumerate(flagged_anomalies, 1):
-            tx = anomaly['transaction']
-            # Use schema fields
-            amount = tx.get('amount', 'N/A')
-            category = tx.get('category', 'N/A')
-            date_str = tx.get('created_at', 'N/A')  # The ISO string is fine for a report
-
-            print(f"--- Anomaly #{i} ---")
-            print(f"  Transaction ID: {tx.get('transaction_id', 'N/A')}")
-            print(f"  Details: ₹{amount:,.2f} in '{category}' on {date_str}")
-            print("  Reasons:")
-            for reason in anomaly['reasons']:
-                print(f"    - {reason}")
-            print("-" * 20)
+        print(f"\n🚨 Flagged {flagged} high-amount transactions.")
 
     print("\n--- End of Report ---")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,202 @@
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.anomaly import RECURRING_EXPENSE_KEYWORDS, IQR_MULTIPLIER, MIN_CATEGORY_SAMPLES
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+SKETCH_TABLE = 'anomaly_sketch'
+PAGE_SIZE = 1000  # Rows fetched / written per Supabase request when rebuilding
+
+
+# --- 2. P² QUANTILE ESTIMATOR ---
+class P2Quantile:
+    """
+    Streaming estimate of a single quantile using the P² algorithm (Jain & Chlamtac).
+    Keeps five markers, so both updates and reads are O(1) and the state is ten numbers.
+    """
+
+    def __init__(self, p, heights=None, positions=None, count=0):
+        self.p = p
+        self.heights = list(heights or [])
+        self.positions = list(positions or [0, 1, 2, 3, 4])
+        self.count = count
+
+    def _desired(self, i):
+        # Desired (0-based) marker positions are fully determined by the count
+        fractions = (0, self.p / 2, self.p, (1 + self.p) / 2, 1)
+        return (self.count - 1) * fractions[i]
+
+    def add(self, x):
+        self.count += 1
+        if self.count <= 5:
+            # Warm-up: the first five observations become the initial markers
+            self.heights.append(x)
+            self.heights.sort()
+            return
+
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+
+        for i in (1, 2, 3):
+            d = self._desired(i) - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = self._parabolic(i, d)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if not self.heights:
+            return None
+        if self.count > 5:
+            return self.heights[2]
+        # Exact linear-interpolated percentile while still warming up
+        rank = (len(self.heights) - 1) * self.p
+        low = int(rank)
+        high = min(low + 1, len(self.heights) - 1)
+        return self.heights[low] + (self.heights[high] - self.heights[low]) * (rank - low)
+
+    def to_state(self):
+        return {"h": self.heights, "n": self.positions}
+
+    @classmethod
+    def from_state(cls, p, state, count):
+        return cls(p, state.get("h"), state.get("n"), count)
+
+
+class CategorySketch:
+    """Q1/Q3 sketch of one user's spending in one category."""
+
+    def __init__(self, count=0, q1=None, q3=None):
+        self.count = count
+        self.q1 = q1 or P2Quantile(0.25)
+        self.q3 = q3 or P2Quantile(0.75)
+
+    def add(self, amount):
+        self.count += 1
+        self.q1.add(amount)
+        self.q3.add(amount)
+
+    def upper_bound(self):
+        """Same rule as the batch IQR check: Q3 + IQR_MULTIPLIER * IQR."""
+        if self.count < MIN_CATEGORY_SAMPLES:
+            return None
+        q1, q3 = self.q1.value(), self.q3.value()
+        return q3 + (q3 - q1) * IQR_MULTIPLIER
+
+    def is_anomaly(self, amount):
+        bound = self.upper_bound()
+        return bound is not None and amount > bound
+
+    def to_state(self):
+        return {"q1": self.q1.to_state(), "q3": self.q3.to_state()}
+
+    @classmethod
+    def from_state(cls, state, count):
+        return cls(
+            count,
+            P2Quantile.from_state(0.25, state.get("q1", {}), count),
+            P2Quantile.from_state(0.75, state.get("q3", {}), count),
+        )
+
+
+# --- 3. PERSISTENCE ---
+def load_sketch(user_id, category):
+    """Fetches the persisted sketch for (user_id, category) with a single indexed lookup."""
+    response = DB.table(SKETCH_TABLE).select('count, sketch') \
+        .eq('user_id', user_id) \
+        .eq('category', category) \
+        .execute()
+    if response.data:
+        row = response.data[0]
+        return CategorySketch.from_state(row.get('sketch') or {}, row.get('count', 0))
+    return CategorySketch()
+
+
+def save_sketch(user_id, category, sketch):
+    DB.table(SKETCH_TABLE).upsert({
+        "user_id": user_id,
+        "category": category,
+        "count": sketch.count,
+        "sketch": sketch.to_state(),
+    }, on_conflict='user_id,category').execute()
+
+
+# --- 4. INTAKE HOOKS ---
+def _is_tracked(tx):
+    if tx.get('payment_type') != 'expense' or tx.get('amount') is None:
+        return False
+    message = str(tx.get('message') or '').lower()
+    return not any(keyword in message for keyword in RECURRING_EXPENSE_KEYWORDS)
+
+
+def score_transaction(user_id, tx):
+    """
+    Scores a new transaction against the user's own category distribution.
+
+    Returns:
+        tuple: (is_anomaly, sketch). Pass the sketch to `record_transaction`
+        once the transaction has been stored. The sketch is None for
+        transactions that are not tracked (income, rent-like payments).
+    """
+    if not _is_tracked(tx):
+        return False, None
+    sketch = load_sketch(user_id, tx.get('category') or 'Uncategorized')
+    return sketch.is_anomaly(tx['amount']), sketch
+
+
+def record_transaction(user_id, tx, sketch):
+    """Folds the stored transaction into the sketch and persists it."""
+    if sketch is None:
+        return
+    sketch.add(tx['amount'])
+    save_sketch(user_id, tx.get('category') or 'Uncategorized', sketch)
+
+
+# --- 5. REBUILD ---
+def rebuild_sketches(user_id):
+    """
+    Replays the user's stored expenses, oldest first, into fresh category sketches and
+    saves them. Used after a bulk import, whose rows never went through intake.
+    """
+    sketches = {}
+    start = 0
+    while True:
+        response = DB.table('transaction').select('amount, category, payment_type, message') \
+            .eq('user_id', user_id) \
+            .eq('payment_type', 'expense') \
+            .order('created_at') \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute()
+        page = response.data or []
+        for tx in page:
+            if _is_tracked(tx):
+                sketches.setdefault(tx.get('category') or 'Uncategorized', CategorySketch()).add(float(tx['amount']))
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+    rows = [{"user_id": user_id, "category": category, "count": sketch.count, "sketch": sketch.to_state()}
+            for category, sketch in sketches.items()]
+    for i in range(0, len(rows), PAGE_SIZE):
+        DB.table(SKETCH_TABLE).upsert(rows[i:i + PAGE_SIZE], on_conflict='user_id,category').execute()
+    return len(rows)
@@ -0,0 +1,442 @@
+import argparse
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+from dateutil.parser import parse as parse_datetime  # For parsing timestamps
+from services.parsing_engine import parse_with_regex, parse_with_llm
+from services.admission import Rejected, IMPORT
+from services.resilience import CircuitOpen, is_rejected
+from services.recurring_detector import rebuild_recurring_state
+from services.anomaly_stream import rebuild_sketches
+from services.activity_profile import rebuild_profile
+from services import refunds
+from services.summary import refresh_summary
+from services.digest import mark_stale as mark_digest_stale
+from services import agent_tools
+from services import semantic_index
+from services import single_flight
+from services.metrics import metrics
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+IMPORT_TABLE = 'import_job'
+IMPORT_DIR = os.getenv("IMPORT_DIR", os.path.join(tempfile.gettempdir(), "finsight-imports"))  # Spooled uploads
+PARSE_WORKERS = 8  # Messages parsed concurrently (the LLM fallback waits on admission, not the regex path)
+PARSE_AHEAD = 256  # Messages in flight ahead of the insert cursor; bounds memory whatever the file size
+CHUNK_SIZE = 500  # Rows per bulk insert, and per checkpoint
+CHECKPOINT_EVERY = 5_000  # Records read between checkpoints even when nothing was inserted
+CIRCUIT_RETRIES = 5  # Gemini outages waited out before the import stops (it can be resumed)
+
+# SMS backups store UTC epochs; the banks whose messages we parse are Indian
+DEFAULT_TIMEZONE = timezone(timedelta(hours=5, minutes=30))
+
+FORMATS = ("xml", "csv", "jsonl")
+BODY_KEYS = ("body", "message", "text", "sms", "raw_message")
+DATE_KEYS = ("date", "timestamp", "created_at", "time", "date_sent")
+SENDER_KEYS = ("address", "sender", "from")
+
+# Cheap pre-filter: most of an SMS history is OTPs, chats and promotions, which never reach a parser
+# (an OTP for a payment names the amount too, but the debit SMS that follows is the transaction)
+AMOUNT = re.compile(r"(?:₹|\brs\.?|\binr)\s*[\d,]+(?:\.\d{1,2})?", re.IGNORECASE)
+TRANSACTION_WORDS = re.compile(
+    r"\b(?:debited|credited|paid|spent|received|sent|withdrawn|purchase|transaction|txn|transferred)\b",
+    re.IGNORECASE,
+)
+NOT_A_TRANSACTION = re.compile(r"\b(?:otp|one time password|verification code)\b", re.IGNORECASE)
+
+
+class ImportStopped(Exception):
+    """The import was interrupted (shutdown, Gemini outage); it resumes from its last checkpoint."""
+
+
+stop_requested = threading.Event()
+running = set()  # import_ids being processed in this process
+running_lock = threading.Lock()
+
+
+# --- 2. STREAMING READERS ---
+def _first(record, keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _normalize(record):
+    """Maps one backup record to {"body", "timestamp", "sender"}, or None when it has no text or date."""
+    body = _first(record, BODY_KEYS)
+    raw_date = _first(record, DATE_KEYS)
+    if not body or raw_date is None:
+        return None
+    try:
+        if str(raw_date).strip().lstrip("-").isdigit():
+            epoch = int(raw_date)
+            dt = datetime.fromtimestamp(epoch / 1000 if epoch > 10**11 else epoch, DEFAULT_TIMEZONE)
+        else:
+            dt = parse_datetime(str(raw_date))
+            dt = dt.replace(tzinfo=DEFAULT_TIMEZONE) if dt.tzinfo is None else dt
+    except (ValueError, OverflowError):
+        return None
+    return {"body": str(body), "timestamp": dt.isoformat(), "sender": _first(record, SENDER_KEYS)}
+
+
+def read_xml(path):
+    """'SMS Backup & Restore' exports: <smses><sms body=... date=... type=... /></smses>."""
+    root = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and elem.tag == "sms":
+            if elem.get("type", "1") == "1":  # Received messages only; sent ones are the user's own
+                yield dict(elem.attrib)
+            root.clear()  # Constant memory: drop everything parsed so far
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            yield {key.strip().lower(): value for key, value in row.items() if key}
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield {}  # Still a record, so checkpoint positions stay stable
+                continue
+            yield {str(key).lower(): value for key, value in record.items()} if isinstance(record, dict) else {}
+
+
+READERS = {"xml": read_xml, "csv": read_csv, "jsonl": read_jsonl}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("xml", "csv"):
+        return extension
+    if extension in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    with open(path, "rb") as f:
+        head = f.read(512).lstrip()
+    if head.startswith(b"<"):
+        return "xml"
+    if head.startswith(b"{"):
+        return "jsonl"
+    return "csv"
+
+
+def records(path, fmt):
+    """Yields normalized records (None for unusable ones) in file order."""
+    for record in READERS[fmt](path):
+        yield _normalize(record)
+
+
+# --- 3. PARSING ---
+def looks_like_transaction(body):
+    return bool(AMOUNT.search(body) and TRANSACTION_WORDS.search(body) and not NOT_A_TRANSACTION.search(body))
+
+
+def _parse_with_llm(body, user_id):
+    """LLM fallback at IMPORT priority: waits out its rate limit and short Gemini outages."""
+    outages = 0
+    while not stop_requested.is_set():
+        try:
+            return parse_with_llm(body, user_id, kind=IMPORT)
+        except Rejected as e:
+            time.sleep(e.retry_after)
+        except CircuitOpen as e:
+            outages += 1
+            if outages > CIRCUIT_RETRIES:
+                raise ImportStopped(f"Gemini unavailable: {e}") from e
+            time.sleep(e.retry_after)
+    raise ImportStopped("Import stopped")
+
+
+def parse_record(record, user_id):
+    """
+    Same hybrid as parse_transaction (regex first, then the LLM) behind the pre-filter.
+    Returns (row or None, outcome) where outcome is skipped / regex / llm / failed.
+    """
+    if record is None or not looks_like_transaction(record["body"]):
+        return None, "skipped"
+    parsed = parse_with_regex(record["body"])
+    outcome = "regex"
+    if parsed:
+        parsed["message"] = record["body"]
+    else:
+        parsed = _parse_with_llm(record["body"], user_id)
+        outcome = "llm" if parsed else "failed"
+    if not parsed:
+        return None, outcome
+    dt = datetime.fromisoformat(record["timestamp"])
+    # Same columns as /intake/process writes
+    return {
+        "user_id": user_id,
+        "created_at": record["timestamp"],
+        "day": dt.strftime("%A"),
+        "amount": parsed.get("amount"),
+        "sender_name": parsed.get("sender_name"),
+        "payment_method": parsed.get("payment_method"),
+        "payment_type": parsed.get("payment_type"),
+        "category": parsed.get("category"),
+        "message": parsed.get("message"),
+        "anomaly": False,
+    }, outcome
+
+
+# --- 4. CHECKPOINTS ---
+def load_job(import_id):
+    response = DB.table(IMPORT_TABLE).select('*').eq('import_id', import_id).execute()
+    return response.data[0] if response.data else None
+
+
+def save_job(job):
+    job["updated_at"] = datetime.now(timezone.utc).isoformat()
+    DB.table(IMPORT_TABLE).upsert(job, on_conflict='import_id').execute()
+
+
+def new_job(user_id, source, fmt, import_id=None):
+    job = {
+        "import_id": import_id or uuid.uuid4().hex,
+        "user_id": user_id,
+        "source": source,
+        "format": fmt,
+        "status": "pending",
+        "records_read": 0,  # Checkpoint: every record before this position is fully handled
+        "inserted": 0,
+        "skipped": 0,
+        "parsed_regex": 0,
+        "parsed_llm": 0,
+        "failed": 0,
+        "error": None,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+    save_job(job)
+    return job
+
+
+# --- 5. INSERTS ---
+def _same_instant(a, b):
+    try:
+        return parse_datetime(a) == parse_datetime(b)
+    except (ValueError, TypeError):
+        return False
+
+
+def _drop_already_inserted(user_id, rows):
+    """
+    After a resume, or an insert whose answer was lost, the chunk may already be stored
+    (crash between the insert and its checkpoint): rows with the same message and timestamp
+    are left out.
+    """
+    times = sorted(row["created_at"] for row in rows)
+    existing = DB.table('transaction').select('created_at, message') \
+        .eq('user_id', user_id) \
+        .gte('created_at', times[0]) \
+        .lte('created_at', times[-1]) \
+        .execute().data or []
+    by_message = {}
+    for row in existing:
+        by_message.setdefault(row.get("message"), []).append(row.get("created_at"))
+    return [row for row in rows
+            if not any(_same_instant(row["created_at"], ts) for ts in by_message.get(row["message"], ()))]
+
+
+def insert_chunk(rows):
+    """
+    One bulk insert. If Supabase rejects it, row by row so only the bad rows fail. After an
+    ambiguous failure (deadline, reset) the chunk may be stored already: only the rows that
+    are missing are sent again, and a second failure stops the import (resume skips what
+    was stored). Returns (inserted, failed); raises if nothing can be written.
+    """
+    try:
+        DB.table('transaction').insert(rows).execute()
+        return len(rows), 0
+    except Exception as e:
+        if not is_rejected(e):
+            print(f"⚠️ Bulk insert of {len(rows)} rows failed without an answer, checking what was stored: {e}")
+            missing = _drop_already_inserted(rows[0]["user_id"], rows)
+            if missing:
+                DB.table('transaction').insert(missing).execute()
+            return len(rows), 0
+        print(f"⚠️ Bulk insert of {len(rows)} rows was rejected, retrying one by one: {e}")
+    inserted, error = 0, None
+    for row in rows:
+        try:
+            DB.table('transaction').insert(row).execute()
+            inserted += 1
+        except Exception as e:
+            if not is_rejected(e):
+                raise  # May or may not be stored: the checkpoint is still before this chunk
+            error = e
+    if inserted == 0:
+        raise error  # Every row rejected (schema, permissions): stop here, the checkpoint is still before this chunk
+    return inserted, len(rows) - inserted
+
+
+# --- 6. IMPORT ---
+def _format_progress(job, started, read_since_start):
+    rate = read_since_start / max(time.monotonic() - started, 1e-6)
+    return (f"📥 Import {job['import_id'][:8]}: {job['records_read']} records read, "
+            f"{job['inserted']} inserted, {job['skipped']} skipped, {job['parsed_llm']} via LLM, "
+            f"{job['failed']} failed ({rate:.0f} records/s)")
+
+
+def finish_import(user_id):
+    """Rebuilds what intake would have kept current, once for the whole history instead of per row."""
+    steps = [
+        ("recurring state", lambda: rebuild_recurring_state(user_id)),
+        ("amount sketches", lambda: rebuild_sketches(user_id)),
+        ("activity profile", lambda: rebuild_profile(user_id)),
+        ("refund backfill", lambda: refunds.backfill_refunds(user_id)),
+        ("refund index", lambda: refunds.index.drop_user(user_id)),
+        ("summary", lambda: refresh_summary(user_id)),
+        ("digest", lambda: mark_digest_stale(user_id)),
+        ("agent tool cache", lambda: agent_tools.invalidate(user_id)),
+        ("semantic index", lambda: semantic_index.invalidate(user_id)),
+        ("read cache", lambda: single_flight.invalidate(user_id)),
+    ]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            print(f"⚠️ Post-import {name} rebuild failed for UserID '{user_id}': {e}")
+
+
+def run_import(job, path, progress=print):
+    """
+    Streams `path` into the transaction table for job["user_id"], continuing from the
+    job's checkpoint. Memory stays constant: at most PARSE_AHEAD parsed messages and
+    one chunk of rows are held at a time. Returns the final job row.
+    """
+    import_id, user_id = job["import_id"], job["user_id"]
+    with running_lock:
+        if import_id in running:
+            raise ImportStopped(f"Import {import_id} is already running")
+        running.add(import_id)
+
+    resume_from = job["records_read"]
+    resumed = resume_from > 0
+    job.update(status="running", error=None)
+    save_job(job)
+    started = time.monotonic()
+    chunk = []
+    position = resume_from  # Records fully handled (parsed, and inserted if they were transactions)
+
+    def checkpoint():
+        nonlocal chunk, resumed
+        if chunk:
+            rows = _drop_already_inserted(user_id, chunk) if resumed else chunk
+            if rows:
+                inserted, failed = insert_chunk(rows)
+                job["inserted"] += inserted
+                job["failed"] += failed
+                metrics.increment("bulk_import.inserted", inserted)
+            resumed = False
+            chunk = []
+        job["records_read"] = position
+        save_job(job)
+        progress(_format_progress(job, started, position - resume_from))
+
+    pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="bulk-import")
+    in_flight = deque()
+
+    def collect():
+        nonlocal position
+        row, outcome = in_flight.popleft().result()
+        position += 1
+        if outcome == "skipped":
+            job["skipped"] += 1
+        elif outcome == "failed":
+            job["failed"] += 1
+        else:
+            job[f"parsed_{outcome}"] += 1
+            chunk.append(row)
+        metrics.increment(f"bulk_import.{outcome}")
+        if len(chunk) >= CHUNK_SIZE or position - job["records_read"] >= CHECKPOINT_EVERY:
+            checkpoint()
+
+    try:
+        for i, record in enumerate(records(path, job["format"])):
+            if i < resume_from:
+                continue
+            if stop_requested.is_set():
+                raise ImportStopped("Import stopped")
+            in_flight.append(pool.submit(parse_record, record, user_id))
+            if len(in_flight) >= PARSE_AHEAD:
+                collect()
+        while in_flight:
+            collect()
+        checkpoint()
+    except Exception as e:
+        job.update(status="interrupted" if isinstance(e, ImportStopped) else "failed", error=str(e))
+        save_job(job)
+        print(f"❌ Import {import_id} {job['status']} at record {job['records_read']}: {e}")
+        return job
+    finally:
+        # Parsed-ahead messages past the checkpoint are re-read on resume; don't wait for them
+        pool.shutdown(wait=False, cancel_futures=True)
+        with running_lock:
+            running.discard(import_id)
+
+    finish_import(user_id)
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(IMPORT_DIR):
+        os.remove(path)  # A spooled upload; CLI files are left alone
+    job.update(status="done", finished_at=datetime.now(timezone.utc).isoformat())
+    save_job(job)
+    progress(f"✅ Import {import_id} finished: {job['inserted']} transactions from {job['records_read']} records.")
+    return job
+
+
+def spool_path(import_id):
+    return os.path.join(IMPORT_DIR, import_id)
+
+
+# --- 7. EXECUTION ---
+def main(argv=None):
+    """CLI: python -m services.bulk_import --user-id U --file backup.xml [--format xml] [--resume IMPORT_ID]"""
+    parser = argparse.ArgumentParser(description="Bulk import an SMS backup into the transaction table.")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--file", required=True, help="SMS backup export (XML, CSV or JSON lines)")
+    parser.add_argument("--format", choices=FORMATS, help="Detected from the file when omitted")
+    parser.add_argument("--resume", metavar="IMPORT_ID", help="Continue an interrupted import from its checkpoint")
+    args = parser.parse_args(argv)
+
+    print("--- Starting SMS Bulk Import ---")
+    if not DB:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+        return
+    job = load_job(args.resume) if args.resume else None
+    if args.resume and job is None:
+        print(f"Halting: no import with id {args.resume}.")
+        return
+    if job is None:
+        job = new_job(args.user_id, os.path.abspath(args.file), args.format or detect_format(args.file))
+        print(f"Import id: {job['import_id']} (pass --resume {job['import_id']} to continue if interrupted)")
+    try:
+        run_import(job, args.file)
+    except KeyboardInterrupt:
+        stop_requested.set()
+        print(f"\nInterrupted; resume with --resume {job['import_id']}")
+    print("\n--- Import finished. ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import lru_cache
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.chat_store import store as chat_store
+from services.metrics import metrics
+from services.resilience import gemini
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+SUMMARY_TABLE = 'chat_summary'
+HISTORY_TOKEN_BUDGET = 1500  # Summary + prior turns sent with each request (system prompt excluded)
+SUMMARY_TOKEN_LIMIT = 300  # Target length of the rolling summary
+MAX_HISTORY_MESSAGES = 12  # Below chat_store.RECENT_MESSAGES so turns are summarized before the ring buffer forgets them
+COMPACT_AFTER_MESSAGES = 4  # Dropped-but-unsummarized messages that trigger a compaction
+MAX_CACHED_SUMMARIES = 10_000  # Summaries kept in memory per process (LRU)
+CHARS_PER_TOKEN = 4  # Rough English/Hinglish average for Gemini's tokenizer
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and FinSight, a financial assistant. "
+    "Merge the previous summary with the new messages into one short paragraph of at most "
+    f"{SUMMARY_TOKEN_LIMIT * 3 // 4} words. Keep amounts, dates, merchants, goals and open questions; drop small talk."
+)
+
+
+def count_tokens(text):
+    """
+    Cheap local token estimate. Counting with the model's tokenizer would cost an API
+    round trip per message, and the budget only needs to be roughly right.
+    """
+    if not text:
+        return 0
+    return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+
+@lru_cache(maxsize=8)
+def system_prefix(system_prompt):
+    """The system message is built (and counted) once per prompt text, not per turn."""
+    return SystemMessage(content=system_prompt), count_tokens(system_prompt)
+
+
+# --- 2. ROLLING SUMMARY ---
+class SummaryCache:
+    """
+    Rolling summary per user: {"summary", "covered_seq"}, where covered_seq is the seq of
+    the newest message already folded into it. Read from Supabase once per user.
+    """
+
+    def __init__(self, max_users=MAX_CACHED_SUMMARIES):
+        self.max_users = max_users
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                self.entries.move_to_end(user_id)
+                return entry
+        try:
+            response = DB.table(SUMMARY_TABLE).select('summary, covered_seq').eq('user_id', user_id).execute()
+            row = response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error reading chat summary: {e}")
+            row = None
+        entry = {"summary": row['summary'], "covered_seq": row['covered_seq']} if row else {"summary": "", "covered_seq": None}
+        self._put(user_id, entry)
+        return entry
+
+    def _put(self, user_id, entry):
+        with self.lock:
+            self.entries[user_id] = entry
+            self.entries.move_to_end(user_id)
+            if len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def save(self, user_id, summary, covered_seq):
+        entry = {"summary": summary, "covered_seq": covered_seq}
+        self._put(user_id, entry)
+        try:
+            DB.table(SUMMARY_TABLE).upsert({
+                "user_id": user_id,
+                "summary": summary,
+                "covered_seq": covered_seq,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }, on_conflict='user_id').execute()
+        except Exception as e:
+            print(f"Error saving chat summary: {e}")
+        return entry
+
+
+summaries = SummaryCache()
+
+
+def _is_uncovered(message, covered_seq):
+    return covered_seq is None or message['seq'] > covered_seq
+
+
+def compact(user_id, llm, previous, messages):
+    """Folds `messages` into the previous summary with one model call and stores the result."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    request = [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=f"Previous summary:\n{previous['summary'] or '(none)'}\n\nNew messages:\n{transcript}"),
+    ]
+    response = gemini.call(lambda: llm.invoke(request))
+    metrics.increment("chat_context.compactions")
+    return summaries.save(user_id, response.content.strip(), messages[-1]['seq'])
+
+
+# --- 3. CONTEXT BUILDER ---
+def build_context(user_id, message, system_prompt, llm=None, budget=HISTORY_TOKEN_BUDGET, retrieved=None):
+    """
+    Builds [system prompt, rolling summary, retrieved rows, newest prior turns that fit, new message].
+
+    Prior turns are added newest first until the token budget is spent; older turns are
+    represented by the stored summary instead. Once COMPACT_AFTER_MESSAGES turns have
+    fallen out of the window without being summarized, they are folded into the summary
+    (one extra model call, then reused on every following turn).
+    """
+    prefix, prefix_tokens = system_prefix(system_prompt)
+    try:
+        history = chat_store.get_recent(user_id)
+    except Exception as e:
+        print(f"Error fetching chat history: {e}")
+        history = []
+
+    summary = summaries.get(user_id) if history else {"summary": "", "covered_seq": None}
+    remaining = budget - count_tokens(message) - count_tokens(summary['summary']) - count_tokens(retrieved)
+
+    kept = []
+    for msg in reversed(history):
+        if len(kept) >= MAX_HISTORY_MESSAGES or not _is_uncovered(msg, summary['covered_seq']):
+            break  # Beyond the window, or already folded into the summary
+        cost = count_tokens(msg['content'])
+        if cost > remaining:
+            break
+        kept.append(msg)
+        remaining -= cost
+    kept.reverse()
+
+    dropped = [m for m in history[:len(history) - len(kept)] if _is_uncovered(m, summary['covered_seq'])]
+    if llm is not None and len(dropped) >= COMPACT_AFTER_MESSAGES:
+        try:
+            summary = compact(user_id, llm, summary, dropped)
+        except Exception as e:
+            print(f"Error compacting chat history: {e}")
+
+    prompt = [prefix]
+    if summary['summary']:
+        prompt.append(SystemMessage(content=f"Summary of the earlier conversation: {summary['summary']}"))
+    if retrieved:
+        prompt.append(SystemMessage(content=f"The user's transactions most relevant to this message:\n{retrieved}"))
+    for msg in kept:
+        if msg['role'] == 'user':
+            prompt.append(HumanMessage(content=msg['content']))
+        elif msg['role'] == 'assistant':
+            prompt.append(AIMessage(content=msg['content']))
+    prompt.append(HumanMessage(content=message))
+
+    used = count_tokens(summary['summary']) + count_tokens(retrieved) + sum(count_tokens(m['content']) for m in kept) + count_tokens(message)
+    metrics.observe("chat_context.prompt_tokens", prefix_tokens + used)
+    metrics.observe("chat_context.history_messages", len(kept))
+    return prompt
@@ -0,0 +1,158 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+MESSAGE_TABLE = 'chat_message'
+LEGACY_TABLE = 'chat_history'
+RECENT_MESSAGES = 20  # Messages kept in memory per user and sent to the model as history
+MAX_ACTIVE_USERS = 10_000  # Ring buffers kept per process (LRU)
+FLUSH_INTERVAL_SECONDS = 0.5  # Write-behind: buffered messages are inserted at least this often
+FLUSH_BATCH_SIZE = 200  # ...or as soon as this many are waiting
+MAX_PENDING_WRITES = 10_000  # Messages kept for retry if Supabase is unreachable
+
+
+# --- 2. STORE ---
+class ChatStore:
+    """
+    Chat history on top of the append-only 'chat_message' table.
+    Recent messages of active users live in per-user ring buffers; new messages are
+    appended to the buffer immediately and written to Supabase in batches by a
+    background thread.
+    """
+
+    def __init__(self):
+        self.recent = OrderedDict()  # user_id -> deque of {"role", "content", "seq"}
+        self.last_seq = {}  # user_id -> last seq handed out by this process
+        self.pending = []  # rows waiting to be inserted
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.flusher = None
+
+    # -- reads --
+    def _load(self, user_id):
+        """Loads the latest messages of a user who is not in memory yet (one indexed query)."""
+        response = DB.table(MESSAGE_TABLE).select('seq, role, content') \
+            .eq('user_id', user_id) \
+            .order('seq', desc=True) \
+            .limit(RECENT_MESSAGES) \
+            .execute()
+        rows = list(reversed(response.data or []))
+        if rows:
+            return [{"role": r['role'], "content": r['content'], "seq": r['seq']} for r in rows], rows[-1]['seq']
+        return self._load_legacy(user_id), 0
+
+    @staticmethod
+    def _load_legacy(user_id):
+        """
+        Reads the old single-row JSON history so existing conversations carry over.
+        Legacy messages get negative seqs so they sort before every new message.
+        """
+        try:
+            response = DB.table(LEGACY_TABLE).select('chat_history').eq('user_id', user_id).execute()
+        except Exception as e:
+            print(f"Error reading legacy chat history: {e}")
+            return []
+        messages = []
+        for record in (response.data[0].get('chat_history') or []) if response.data else []:
+            if 'role' in record:
+                messages.append({"role": record['role'], "content": record['content']})
+            else:
+                if record.get('human'):
+                    messages.append({"role": "user", "content": record['human']})
+                if record.get('ai'):
+                    messages.append({"role": "assistant", "content": record['ai']})
+        messages = messages[-RECENT_MESSAGES:]
+        for i, message in enumerate(messages):
+            message["seq"] = i - len(messages)
+        return messages
+
+    def _buffer(self, user_id):
+        buffer = self.recent.get(user_id)
+        if buffer is not None:
+            self.recent.move_to_end(user_id)
+        return buffer
+
+    def get_recent(self, user_id):
+        """Returns the user's latest messages, oldest first, as {"role", "content", "seq"} dicts."""
+        with self.lock:
+            buffer = self._buffer(user_id)
+            if buffer is not None:
+                return list(buffer)
+
+        messages, last_seq = self._load(user_id)
+        with self.lock:
+            buffer = self._buffer(user_id)
+            if buffer is None:
+                buffer = self.recent[user_id] = deque(messages, maxlen=RECENT_MESSAGES)
+                self.last_seq[user_id] = max(self.last_seq.get(user_id, 0), last_seq)
+                if len(self.recent) > MAX_ACTIVE_USERS:
+                    evicted, _ = self.recent.popitem(last=False)
+                    self.last_seq.pop(evicted, None)
+            return list(buffer)
+
+    # -- writes --
+    def append(self, user_id, role, content):
+        """Appends one message; it is visible immediately and persisted by the flusher."""
+        self.get_recent(user_id)  # Make sure the ring buffer (and last seq) is loaded
+        with self.lock:
+            # Microsecond clock keeps seq increasing across workers without a read
+            seq = max(self.last_seq.get(user_id, 0) + 1, int(time.time() * 1_000_000))
+            self.last_seq[user_id] = seq
+            message = {"role": role, "content": content, "seq": seq}
+            buffer = self._buffer(user_id)
+            if buffer is not None:
+                buffer.append(message)
+            self.pending.append({
+                "user_id": user_id,
+                "seq": seq,
+                "role": role,
+                "content": content,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+            self._ensure_flusher()
+            if len(self.pending) >= FLUSH_BATCH_SIZE:
+                self.wakeup.notify()
+
+    def append_turn(self, user_id, user_message, assistant_message):
+        self.append(user_id, "user", user_message)
+        self.append(user_id, "assistant", assistant_message)
+
+    # -- write-behind --
+    def _ensure_flusher(self):
+        if self.flusher is None or not self.flusher.is_alive():
+            self.flusher = threading.Thread(target=self._run, name="chat-store-flusher", daemon=True)
+            self.flusher.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                self.wakeup.wait(FLUSH_INTERVAL_SECONDS)
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered message in one bulk request (idempotent). Safe to call from any thread."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        try:
+            # A batch retried after a lost response may already be stored: (user_id, seq) is unique,
+            # so rows that made it are skipped instead of failing the whole batch again
+            DB.table(MESSAGE_TABLE).upsert(batch, on_conflict='user_id,seq', ignore_duplicates=True).execute()
+            return len(batch)
+        except Exception as e:
+            print(f"Error saving chat messages to Supabase: {e}")
+            with self.lock:
+                # Keep them for the next flush, but never grow without bound
+                self.pending = (batch + self.pending)[-MAX_PENDING_WRITES:]
+            return 0
+
+
+store = ChatStore()
+atexit.register(store.flush)
@@ -1,54 +1,28 @@
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from core.setup import initialize_supabase
-# --- 1. Supabase Initialization ---
-# This replaces the get_firestore_client() service
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from services.chat_store import store as chat_store
+from services.chat_context import build_context
+from services.intent_router import route as route_intent
+from services.semantic_index import search as semantic_search, format_results
+from services.metrics import metrics
+from services.admission import admission, CHAT
+from services.resilience import gemini
+# --- 1. Chat Storage ---
+# History lives in the append-only 'chat_message' table behind an in-memory ring buffer
 load_dotenv()
-db = initialize_supabase
 
+# Set CHATBOT_FAKE_LLM=1 to use a local streaming stand-in (offline development and tests)
+FAKE_LLM = os.getenv("CHATBOT_FAKE_LLM", "").lower() in ("1", "true", "yes")
+RETRIEVED_TRANSACTIONS = 5  # Transactions retrieved from the semantic index into each prompt
+FAKE_RESPONSES = [
+    "I am FinSight running in offline mode. Your spending this month looks on track.",
+]
 
-
-def get_chatbot_response(user_id: str, message: str):
-    """
-    Handles the chatbot conversation logic using Supabase for chat history.
-    """
-    if not db:
-        return "Error: Supabase client is not initialized. Please check credentials."
-
-    llm = ChatGoogleGenerativeAI(model="gemini-pro", google_api_key=os.getenv("GEMINI_API_KEY"))
-
-    # --- Fetch Chat History from Supabase ---
-    # This replaces the Firebase get() logic
-    try:
-        response = db.table("chat_history").select("chat_history").eq("user_id", user_id).execute()
-        if response.data:
-            # 'chat_history' is the JSON column in your Supabase schema
-            messages_dict = response.data[0].get("chat_history", [])
-        else:
-            messages_dict = []
-    except Exception as e:
-        print(f"Error fetching chat history from Supabase: {e}")
-        messages_dict = []
-
-    # Convert list of dicts to LangChain message objects
-    messages = []
-    for msg in messages_dict:
-        if msg['role'] == 'user':
-            messages.append(HumanMessage(content=msg['content']))
-        elif msg['role'] == 'assistant':
-            messages.append(AIMessage(content=msg['content']))
-
-    # --- Core LangChain Logic (Unchanged) ---
-
-    # Add the new user message to the history
-    messages.append(HumanMessage(content=message))
-
-    # Construct the prompt for Gemini
-    prompt = [
-        SystemMessage(content="""You are FinSight, a friendly and intelligent financial assistant. Your purpose is to help users understand their spending and make smarter financial decisions. You can answer questions about the user's transactions, subscriptions, budgets, and spending patterns. You can also provide insights and predictions based on their financial activity.
+SYSTEM_PROMPT = """You are FinSight, a friendly and intelligent financial assistant. Your purpose is to help users understand their spending and make smarter financial decisions. You can answer questions about the user's transactions, subscriptions, budgets, and spending patterns. You can also provide insights and predictions based on their financial activity.
 
 You have access to the following information about the user's financial data:
 
@@ -76,39 +50,115 @@ You have access to the following information about the user's financial data:
 * Spending summaries
 * Pending payments tracking
 
-**Your role is to answer questions and provide guidance related to these features and data. If a user asks a question that is not related to their finances or the FinSight app, you must politely decline and steer the conversation back to your purpose. For example, if they ask about the weather or a movie, you should say something like: 'I am a financial assistant and can only answer questions about your finances and the FinSight app. How can I help you with your spending today?'"""),
-    ]
-    prompt.extend(messages)
+**Your role is to answer questions and provide guidance related to these features and data. If a user asks a question that is not related to their finances or the FinSight app, you must politely decline and steer the conversation back to your purpose. For example, if they ask about the weather or a movie, you should say something like: 'I am a financial assistant and can only answer questions about your finances and the FinSight app. How can I help you with your spending today?'"""
 
-    response = llm.invoke(prompt)
 
-    # Add the bot's response to the history
-    messages.append(response)
+def get_llm():
+    """Returns the chat model: Gemini normally, a fake streaming model when FAKE_LLM is set."""
+    if FAKE_LLM:
+        return FakeListChatModel(responses=FAKE_RESPONSES, sleep=0.01)
+    return ChatGoogleGenerativeAI(model="gemini-pro", google_api_key=os.getenv("GEMINI_API_KEY"), timeout=gemini.timeout)
 
-    # --- End of Core Logic ---
 
-    # --- Save Updated Chat History to Supabase ---
-    # This replaces the Firebase set() logic
+def _retrieve(user_id: str, message: str):
+    """Top-k semantically relevant transactions for the message, as prompt text (or None)."""
+    try:
+        results = semantic_search(user_id, message, k=RETRIEVED_TRANSACTIONS)
+    except Exception as e:
+        print(f"Error searching transactions: {e}")
+        return None
+    return format_results(results) if results else None
 
-    # Convert LangChain objects back to a list of dicts
-    messages_to_save = []
-    for msg in messages:
-        if isinstance(msg, HumanMessage):
-            messages_to_save.append({"role": "user", "content": msg.content})
-        elif isinstance(msg, AIMessage):
-            messages_to_save.append({"role": "assistant", "content": msg.content})
 
-    # Keep only the last 20 messages (10 pairs)
-    messages_to_save = messages_to_save[-20:]
+def build_prompt(user_id: str, message: str, llm=None):
+    """
+    System prompt + rolling summary + the transactions relevant to the message + the
+    recent turns that fit the token budget + the new message, as LangChain messages
+    (see services/chat_context.py).
+    """
+    return build_context(user_id, message, SYSTEM_PROMPT, llm=llm, retrieved=_retrieve(user_id, message))
+
 
+def _save_turn(user_id: str, message: str, reply: str):
+    # --- Append the turn (written to Supabase in batches, in the background) ---
     try:
-        # Use upsert to create or update the record for this user_id
-        db.table("chat_history").upsert({
-            "user_id": user_id,
-            "chat_history": messages_to_save  # Store the list in the 'chat_history' JSON column
-        }).execute()
+        chat_store.append_turn(user_id, message, reply)
     except Exception as e:
-        print(f"Error saving chat history to Supabase: {e}")
+        print(f"Error saving chat history: {e}")
         # Note: We still return the response even if saving fails
 
-    return response.content
\ No newline at end of file
+
+async def get_chatbot_response(user_id: str, message: str):
+    """
+    Handles the chatbot conversation logic using the chat store for history.
+    Common questions are answered by the intent router without calling the model.
+    Model calls go through admission control (admission.Rejected -> 429); the prompt is
+    built before a slot is taken, and a queued request waits on the event loop.
+    """
+    reply = await asyncio.to_thread(route_intent, user_id, message)
+    if reply is not None:
+        _save_turn(user_id, message, reply)
+        return reply
+
+    llm = get_llm()
+    prompt = await asyncio.to_thread(build_prompt, user_id, message, llm)
+    async with admission.async_slot(user_id, CHAT):
+        response = await asyncio.to_thread(gemini.call, lambda: llm.invoke(prompt))
+
+    _save_turn(user_id, message, response.content)
+    return response.content
+
+
+def _chunk_text(chunk):
+    if isinstance(chunk.content, str):
+        return chunk.content
+    # Some models stream a list of content parts
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in chunk.content)
+
+
+async def stream_chatbot_response(user_id: str, message: str):
+    """
+    Async generator yielding the reply as the model produces it.
+    The turn is saved only when the model finishes; if the consumer stops early
+    (client disconnected) the generator is closed and nothing is persisted.
+    Raises admission.Rejected before the first chunk when the model is saturated.
+    """
+    reply = await asyncio.to_thread(route_intent, user_id, message)
+    if reply is not None:
+        yield reply
+        _save_turn(user_id, message, reply)
+        return
+
+    llm = get_llm()
+    # Supabase reads and history compaction happen before the slot is taken, not while holding it
+    prompt = await asyncio.to_thread(build_prompt, user_id, message, llm)
+    async with admission.async_slot(user_id, CHAT):
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        chunks = llm.astream(prompt)
+        try:
+            with gemini.track():
+                while True:
+                    try:
+                        # Deadline per chunk: a stalled stream fails instead of holding the slot
+                        chunk = await asyncio.wait_for(anext(chunks), gemini.timeout)
+                    except StopAsyncIteration:
+                        break
+                    text = _chunk_text(chunk)
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        metrics.observe("chatbot.time_to_first_token_seconds", first_token_at - started)
+                    parts.append(text)
+                    yield text
+        except (GeneratorExit, asyncio.CancelledError):
+            metrics.increment("chatbot.stream_cancelled")
+            raise
+        finally:
+            await chunks.aclose()
+
+    metrics.observe("chatbot.stream_duration_seconds", time.perf_counter() - started)
+    metrics.increment("chatbot.stream_completed")
+    _save_turn(user_id, message, "".join(parts))
@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.timezones import as_utc
+from services.chat_context import count_tokens, CHARS_PER_TOKEN
+from services.recurring_detector import get_recurring
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+DIGEST_TABLE = 'financial_digest'
+HISTORY_DAYS = 90  # Look-back window summarized in the digest
+DIGEST_TOKEN_BUDGET = 600  # The rendered digest never exceeds this many tokens
+DIGEST_TTL = timedelta(hours=1)  # Stored digests older than this are rebuilt on read
+LOCAL_TTL_SECONDS = 60  # In-process cache in front of the table (several tool calls per answer)
+MAX_CACHED_DIGESTS = 10_000
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+LIST_SIZES = (8, 5, 3, 1)  # Items per list, shrunk until the digest fits the budget
+
+PERIODS = [("Today", 1), ("Last 7 days", 7), ("Last 30 days", 30), ("Last 90 days", 90)]
+
+
+# --- 2. DATA FETCHING ---
+def _fetch_rows(user_id, since):
+    rows = []
+    start = 0
+    while True:
+        response = DB.table('transaction') \
+            .select('amount, payment_type, category, sender_name, anomaly, created_at') \
+            .eq('user_id', user_id) \
+            .gte('created_at', since) \
+            .is_('refund_of', 'null') \
+            .is_('refunded_by', 'null') \
+            .order('transaction_id') \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute()
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+# --- 3. DIGEST ---
+def compute_digest(rows, recurring, now=None):
+    """
+    Aggregates one user's transactions into the digest fields: totals per period,
+    30-day spend per category and merchant, recurring payments and recent anomalies.
+    """
+    now = now or datetime.now(timezone.utc)
+    totals = {label: [0.0, 0.0] for label, _ in PERIODS}  # label -> [spent, received]
+    categories = defaultdict(float)
+    merchants = defaultdict(float)
+    anomalies = []
+
+    for tx in rows:
+        if tx.get('amount') is None:
+            continue
+        amount = float(tx['amount'])
+        ts = as_utc(tx['created_at'])
+        age_days = (now - ts).total_seconds() / 86400
+        is_expense = tx.get('payment_type') == 'expense'
+        for label, days in PERIODS:
+            if age_days < days:
+                totals[label][0 if is_expense else 1] += amount
+        if is_expense and age_days < 30:
+            categories[tx.get('category') or 'Uncategorized'] += amount
+            merchants[tx.get('sender_name') or 'Unknown'] += amount
+        if tx.get('anomaly'):
+            anomalies.append((ts, amount, tx.get('sender_name') or 'Unknown'))
+
+    anomalies.sort(reverse=True)
+    return {
+        "totals": totals,
+        "categories": sorted(categories.items(), key=lambda kv: -kv[1]),
+        "merchants": sorted(merchants.items(), key=lambda kv: -kv[1]),
+        "recurring": sorted(recurring, key=lambda r: -float(r['amount'] or 0)),
+        "anomalies": anomalies,
+        "transaction_count": len(rows),
+    }
+
+
+def _render(digest, n):
+    lines = [f"Financial digest ({digest['transaction_count']} transactions, last {HISTORY_DAYS} days, amounts in ₹):"]
+    lines.append("Totals (spent / received): " + "; ".join(
+        f"{label} {spent:,.0f} / {received:,.0f}" for label, (spent, received) in digest['totals'].items()
+    ))
+    if digest['categories']:
+        lines.append("Top categories, 30 days: " + ", ".join(f"{c} {a:,.0f}" for c, a in digest['categories'][:n]))
+    if digest['merchants']:
+        lines.append("Top merchants, 30 days: " + ", ".join(f"{m} {a:,.0f}" for m, a in digest['merchants'][:n]))
+    if digest['recurring']:
+        lines.append("Recurring payments: " + ", ".join(
+            f"{r['recipient']} {float(r['amount']):,.0f} {r['frequency']}" for r in digest['recurring'][:n]
+        ))
+    if digest['anomalies']:
+        lines.append("Recent flagged transactions: " + ", ".join(
+            f"{ts.date().isoformat()} {merchant} {amount:,.0f}" for ts, amount, merchant in digest['anomalies'][:n]
+        ))
+    return "\n".join(lines)
+
+
+def render_digest(digest, budget=DIGEST_TOKEN_BUDGET):
+    """Renders the digest as compact text, shortening the lists until it fits the token budget."""
+    for n in LIST_SIZES:
+        text = _render(digest, n)
+        if count_tokens(text) <= budget:
+            return text
+    return text[:budget * CHARS_PER_TOKEN]
+
+
+def refresh_digest(user_id):
+    """Rebuilds and stores one user's digest. Returns the stored row."""
+    since = (datetime.now(timezone.utc) - timedelta(days=HISTORY_DAYS)).isoformat()
+    digest = compute_digest(_fetch_rows(user_id, since), get_recurring(user_id))
+    text = render_digest(digest)
+    row = {
+        "user_id": user_id,
+        "digest": text,
+        "token_count": count_tokens(text),
+        "stale": False,
+        "computed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    DB.table(DIGEST_TABLE).upsert(row, on_conflict='user_id').execute()
+    local_cache.put(user_id, text)
+    return row
+
+
+# --- 4. CACHE ---
+class LocalCache:
+    """Short-lived per-process copy of rendered digests (LRU + TTL)."""
+
+    def __init__(self, ttl=LOCAL_TTL_SECONDS, max_users=MAX_CACHED_DIGESTS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.entries = OrderedDict()  # user_id -> (expires_at, text)
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, text):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, text)
+            self.entries.move_to_end(user_id)
+            if len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+local_cache = LocalCache()
+
+
+def _is_fresh(row):
+    if row.get('stale'):
+        return False
+    try:
+        return datetime.now(timezone.utc) - as_utc(row['computed_at']) <= DIGEST_TTL
+    except Exception:
+        return False
+
+
+def get_digest(user_id):
+    """
+    Returns the user's rendered digest in one lookup: the in-process copy, else the
+    stored row, rebuilding it only when it is missing, marked stale or past DIGEST_TTL.
+    """
+    text = local_cache.get(user_id)
+    if text is not None:
+        return text
+    response = DB.table(DIGEST_TABLE).select('digest, stale, computed_at').eq('user_id', user_id).execute()
+    if response.data and _is_fresh(response.data[0]):
+        text = response.data[0]['digest']
+        local_cache.put(user_id, text)
+        return text
+    return refresh_digest(user_id)['digest']
+
+
+def mark_stale(user_id):
+    """Intake hook: the next read rebuilds the digest so new transactions show up."""
+    local_cache.discard(user_id)
+    DB.table(DIGEST_TABLE).update({"stale": True}).eq('user_id', user_id).execute()
+
+
+def refresh_all_digests():
+    """Scheduled job: rebuilds the digests that are marked stale or past DIGEST_TTL."""
+    cutoff = (datetime.now(timezone.utc) - DIGEST_TTL).isoformat()
+    user_ids = set()
+    for column, value in (('stale', True), ('computed_at', cutoff)):
+        start = 0
+        while True:
+            query = DB.table(DIGEST_TABLE).select('user_id')
+            query = query.eq(column, value) if column == 'stale' else query.lt(column, value)
+            page = query.order('user_id').range(start, start + PAGE_SIZE - 1).execute().data or []
+            user_ids.update(row['user_id'] for row in page)
+            if len(page) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+
+    refreshed = 0
+    for user_id in user_ids:
+        try:
+            refresh_digest(user_id)
+            refreshed += 1
+        except Exception as e:
+            print(f"Error refreshing digest for user {user_id}: {e}")
+    print(f"✅ Refreshed {refreshed} financial digests.")
+    return refreshed
+
+
+# --- 5. EXECUTION ---
+def main():
+    """Entry point for the scheduled digest job (e.g. run from cron every hour)."""
+    print("--- Starting Financial Digest Refresh ---")
+    if not DB:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+        return
+    refresh_all_digests()
+    print("\n--- Digest refresh finished. ---")
+
+
+if __name__ == '__main__':
+    main()
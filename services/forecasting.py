@@ -0,0 +1,253 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from core.setup import initialize_supabase  # Using your custom initializer
+from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+FORECAST_TABLE = 'forecast'
+HISTORY_DAYS = 90  # Same look-back window the old on-demand prediction used
+MIN_TRANSACTIONS = 15  # Below this a forecast is not considered reliable
+EWMA_ALPHA = 0.2  # Weight of the newest day in the smoothed daily level
+TREND_WINDOW = 30  # Days compared against the previous window for the trend
+FORECAST_TTL = timedelta(hours=6)  # Cached forecasts older than this are recomputed on read
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+USERS_PER_CHUNK = 500  # Users fitted together in one worker task
+
+TIMEFRAME_DAYS = {
+    "daily": 1,
+    "weekly": 7,
+    "monthly": 30,
+}
+
+
+# --- 2. DATA FETCHING ---
+def _fetch_history(since: str, user_ids=None):
+    """
+    Pages through the 'transaction' table and returns every row created since `since`.
+    Only the columns needed for forecasting are selected.
+    """
+    rows = []
+    start = 0
+    while True:
+        # Matched refund pairs cancel out, so they are left out of the history entirely
+        query = DB.table('transaction').select('user_id, created_at, amount, payment_type') \
+            .gte('created_at', since) \
+            .is_('refund_of', 'null') \
+            .is_('refunded_by', 'null')
+        if user_ids is not None:
+            query = query.in_('user_id', list(user_ids))
+        response = query.order('transaction_id').range(start, start + PAGE_SIZE - 1).execute()
+
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def _to_matrices(rows, start_date, n_days):
+    """
+    Converts transaction rows into dense (users x days) expense and income matrices.
+
+    Returns:
+        tuple: (user_ids, expense_matrix, income_matrix, transaction_counts)
+    """
+    users, day_index, amounts, is_income = [], [], [], []
+    for tx in rows:
+        if tx.get('amount') is None or tx.get('payment_type') not in ('expense', 'income'):
+            continue
+        try:
+            offset = (parse_datetime(tx['created_at']).date() - start_date).days
+        except Exception:
+            continue
+        if not 0 <= offset < n_days:
+            continue
+        users.append(str(tx['user_id']))
+        day_index.append(offset)
+        amounts.append(float(tx['amount']))
+        is_income.append(tx['payment_type'] == 'income')
+
+    if not users:
+        return np.array([], dtype=object), np.zeros((0, n_days)), np.zeros((0, n_days)), np.zeros(0, dtype=int)
+
+    user_ids, user_index = np.unique(np.array(users, dtype=object), return_inverse=True)
+    day_index = np.array(day_index)
+    amounts = np.array(amounts)
+    is_income = np.array(is_income)
+
+    expense = np.zeros((len(user_ids), n_days))
+    income = np.zeros((len(user_ids), n_days))
+    np.add.at(expense, (user_index[~is_income], day_index[~is_income]), amounts[~is_income])
+    np.add.at(income, (user_index[is_income], day_index[is_income]), amounts[is_income])
+    counts = np.bincount(user_index, minlength=len(user_ids))
+
+    return user_ids, expense, income, counts
+
+
+# --- 3. VECTORIZED MODELS ---
+def _ewma_level(daily):
+    """Exponentially weighted daily level for every row (user) at once."""
+    level = daily[:, 0].copy()
+    for t in range(1, daily.shape[1]):
+        level = EWMA_ALPHA * daily[:, t] + (1 - EWMA_ALPHA) * level
+    return level
+
+
+def _weekday_factors(daily, weekdays):
+    """
+    Multiplicative weekday seasonality per user: mean spend on each weekday divided
+    by the overall daily mean. Users with no activity get a flat profile of 1.0.
+    """
+    overall = daily.mean(axis=1)
+    factors = np.ones((daily.shape[0], 7))
+    for w in range(7):
+        columns = weekdays == w
+        if columns.any():
+            factors[:, w] = daily[:, columns].mean(axis=1)
+    active = overall > 0
+    factors[active] /= overall[active, None]
+    factors[~active] = 1.0
+    return factors
+
+
+def _project(level, factors, first_weekday, horizon):
+    """Sums the seasonal daily forecast over the next `horizon` days."""
+    horizon_weekdays = (first_weekday + np.arange(horizon)) % 7
+    return level * factors[:, horizon_weekdays].sum(axis=1)
+
+
+def _trend(daily):
+    """Percentage change of the last TREND_WINDOW days against the window before it."""
+    last = daily[:, -TREND_WINDOW:].mean(axis=1)
+    previous = daily[:, -2 * TREND_WINDOW:-TREND_WINDOW].mean(axis=1)
+    trend = np.zeros_like(last)
+    np.divide((last - previous) * 100, previous, out=trend, where=previous > 0)
+    return trend
+
+
+def _fit_chunk(args):
+    """
+    Fits the EWMA + weekday model for one block of users.
+    Runs inside a worker process, so it only deals with plain arrays.
+    """
+    expense, income, first_weekday, next_weekday = args
+    weekdays = (first_weekday + np.arange(expense.shape[1])) % 7
+
+    expense_level = _ewma_level(expense)
+    income_level = _ewma_level(income)
+    expense_factors = _weekday_factors(expense, weekdays)
+    income_factors = _weekday_factors(income, weekdays)
+
+    result = {"trend": _trend(expense)}
+    for timeframe, days in TIMEFRAME_DAYS.items():
+        expected_expense = _project(expense_level, expense_factors, next_weekday, days)
+        expected_income = _project(income_level, income_factors, next_weekday, days)
+        result[f"{timeframe}_expense"] = expected_expense
+        result[f"{timeframe}_cashflow"] = expected_income - expected_expense
+    return result
+
+
+def compute_forecasts(rows, now=None, workers=None):
+    """
+    Builds forecast cache rows for every user present in `rows`.
+    With `workers` > 1 the users are split into chunks and fitted in a process pool.
+    """
+    now = now or datetime.now()
+    start_date = (now - timedelta(days=HISTORY_DAYS - 1)).date()
+    user_ids, expense, income, counts = _to_matrices(rows, start_date, HISTORY_DAYS)
+    if len(user_ids) == 0:
+        return []
+
+    next_weekday = (now.date() + timedelta(days=1)).weekday()
+    chunks = [
+        (expense[i:i + USERS_PER_CHUNK], income[i:i + USERS_PER_CHUNK], start_date.weekday(), next_weekday)
+        for i in range(0, len(user_ids), USERS_PER_CHUNK)
+    ]
+
+    if workers and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fitted = list(pool.map(_fit_chunk, chunks))
+    else:
+        fitted = [_fit_chunk(chunk) for chunk in chunks]
+
+    columns = {key: np.concatenate([part[key] for part in fitted]) for key in fitted[0]}
+    computed_at = datetime.now(timezone.utc).isoformat()
+
+    forecasts = []
+    for i, user_id in enumerate(user_ids):
+        row = {"user_id": user_id, "transaction_count": int(counts[i]), "computed_at": computed_at}
+        for key, values in columns.items():
+            row[key] = round(float(values[i]), 2)
+        forecasts.append(row)
+    return forecasts
+
+
+# --- 4. CACHE READ / WRITE ---
+def _save_forecasts(forecasts):
+    """Upserts forecast rows into the cache table in PAGE_SIZE batches."""
+    for i in range(0, len(forecasts), PAGE_SIZE):
+        DB.table(FORECAST_TABLE).upsert(forecasts[i:i + PAGE_SIZE]).execute()
+
+
+def refresh_user_forecast(user_id):
+    """Recomputes and caches the forecast of a single user. Returns the new cache row or None."""
+    since = (datetime.now() - timedelta(days=HISTORY_DAYS)).isoformat()
+    forecasts = compute_forecasts(_fetch_history(since, user_ids=[user_id]))
+    if not forecasts:
+        return None
+    _save_forecasts(forecasts)
+    return forecasts[0]
+
+
+def _is_stale(forecast):
+    try:
+        computed_at = parse_datetime(forecast['computed_at'])
+    except Exception:
+        return True
+    if computed_at.tzinfo is None:
+        computed_at = computed_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - computed_at > FORECAST_TTL
+
+
+def get_cached_forecast(user_id):
+    """
+    Returns the cached forecast for a user, recomputing it on demand only when
+    it is missing or older than FORECAST_TTL.
+    """
+    response = DB.table(FORECAST_TABLE).select('*').eq('user_id', user_id).execute()
+    if response.data and not _is_stale(response.data[0]):
+        return response.data[0]
+    return refresh_user_forecast(user_id)
+
+
+def refresh_all_forecasts(workers=None):
+    """Scheduled job: recomputes and caches forecasts for every user with recent activity."""
+    since = (datetime.now() - timedelta(days=HISTORY_DAYS)).isoformat()
+    rows = _fetch_history(since)
+    print(f"📊 Loaded {len(rows)} transactions from the last {HISTORY_DAYS} days.")
+
+    forecasts = compute_forecasts(rows, workers=workers)
+    _save_forecasts(forecasts)
+    print(f"✅ Cached forecasts for {len(forecasts)} users.")
+    return len(forecasts)
+
+
+# --- 5. EXECUTION ---
+def main():
+    """
+    Entry point for the scheduled forecasting job (e.g. run from cron every few hours).
+    """
+    print("--- Starting Batch Forecasting Engine ---")
+    if not DB:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+        return
+    refresh_all_forecasts(workers=os.cpu_count())
+    print("\n--- Forecasting finished. ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import time
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.metrics import metrics
+from services.resilience import is_rejected
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+
+def _env_flag(name):
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+ENABLED = _env_flag("INTAKE_GROUP_COMMIT")  # Off: every request does its own single-row insert
+MAX_BATCH_ROWS = int(os.getenv("INTAKE_GROUP_COMMIT_MAX_ROWS", "50"))  # Flush as soon as this many rows wait
+MAX_DELAY_MS = float(os.getenv("INTAKE_GROUP_COMMIT_MAX_DELAY_MS", "5"))  # ... or when the oldest has waited this long
+MAX_CONCURRENT_FLUSHES = 4  # Bulk inserts in flight at once; later batches wait for one to finish
+MAX_BUFFERED_ROWS = 2_000  # Write-behind only: above this, callers wait for their flush again
+
+# Durability of an acknowledged row:
+#   "committed" - the request returns once its batch is in Supabase (the row carries its transaction_id)
+#   "buffered"  - write-behind: the request returns once the row is queued in memory; a crash before
+#                 the flush loses it, and failed flushes are only retried and logged
+COMMITTED = "committed"
+BUFFERED = "buffered"
+DURABILITY = os.getenv("INTAKE_GROUP_COMMIT_DURABILITY", COMMITTED)
+WRITE_BEHIND_ATTEMPTS = 3
+WRITE_BEHIND_BACKOFF_SECONDS = 0.5
+
+
+# --- 2. GROUP COMMIT ---
+class GroupCommitter:
+    """
+    Collects rows from concurrent requests and writes them with one bulk insert per
+    batch. Every caller gets back its own inserted row (or its own error): when Supabase
+    rejects a bulk insert, the batch is retried row by row so one bad row fails only its
+    request.
+    """
+
+    def __init__(self, table='transaction', max_rows=MAX_BATCH_ROWS, max_delay_ms=MAX_DELAY_MS,
+                 durability=DURABILITY, max_concurrent_flushes=MAX_CONCURRENT_FLUSHES, db=None):
+        if durability not in (COMMITTED, BUFFERED):
+            raise ValueError(f"Unknown durability '{durability}'")
+        self.table = table
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.durability = durability
+        self.max_concurrent_flushes = max_concurrent_flushes
+        self.db = db or DB
+        self.buffer = []  # [(row, future or None, on_written)]
+        self.timer = None
+        self.flushing = set()  # Running flush tasks
+        self.writing = 0  # Batches not yet answered by Supabase
+        self.slots = None  # asyncio.Semaphore bounding concurrent bulk inserts
+        self.loop = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.slots = asyncio.Semaphore(self.max_concurrent_flushes)
+
+    def buffered_rows(self):
+        return len(self.buffer) + sum(getattr(task, "rows", 0) for task in self.flushing)
+
+    async def insert(self, row, on_written=None):
+        """
+        Adds a row to the current batch. Returns the inserted row once the batch is
+        committed, or None straight away in write-behind mode, where `on_written(row)`
+        is called after the flush instead.
+        """
+        self._bind()
+        wait = self.durability == COMMITTED or self.buffered_rows() >= MAX_BUFFERED_ROWS
+        future = self.loop.create_future() if wait else None
+        self.buffer.append((row, future, on_written))
+        metrics.gauge("group_commit.buffered_rows", len(self.buffer))
+        if len(self.buffer) >= self.max_rows or not self.writing:
+            # Nothing in flight means no batch to join: write now instead of waiting out the delay
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.max_delay, self.flush)
+        if future is None:
+            return None
+        row = await future
+        if on_written is not None:
+            on_written(row)
+        return row
+
+    def flush(self):
+        """Starts writing the current batch (called by the size / delay triggers)."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        metrics.gauge("group_commit.buffered_rows", 0)
+        self.writing += 1
+        task = self.loop.create_task(self._write(batch))
+        task.rows = len(batch)
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    def _insert(self, rows):
+        response = self.db.table(self.table).insert(rows).execute()
+        if not response.data or len(response.data) != len(rows):
+            raise Exception("Supabase did not return every inserted row.")
+        return response.data
+
+    async def _insert_rows(self, rows):
+        """
+        Bulk insert. If Supabase rejects it, row by row (concurrently) so errors stay with
+        their rows. Any other failure (deadline, reset) may have committed the batch, so it
+        is not re-sent: every row gets the error.
+        """
+        try:
+            return await asyncio.to_thread(self._insert, rows)
+        except Exception as e:
+            if not is_rejected(e):
+                metrics.increment("group_commit.ambiguous_batches")
+                return [e] * len(rows)
+            if len(rows) == 1:
+                return [e]
+            metrics.increment("group_commit.split_batches")
+            print(f"⚠️ Bulk insert of {len(rows)} rows failed, retrying one by one: {e}")
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._insert, [row]) for row in rows), return_exceptions=True
+        )
+        return [result if isinstance(result, Exception) else result[0] for result in results]
+
+    async def _write(self, batch):
+        try:
+            async with self.slots:
+                started = time.perf_counter()
+                results = await self._insert_rows([row for row, _, _ in batch])
+                metrics.observe("group_commit.batch_rows", len(batch))
+                metrics.observe("group_commit.flush_seconds", time.perf_counter() - started)
+        finally:
+            self.writing -= 1
+
+        retry = []
+        for (row, future, on_written), result in zip(batch, results):
+            failed = isinstance(result, Exception)
+            if failed:
+                metrics.increment("group_commit.failed_rows")
+            if future is not None:
+                if future.done():
+                    continue  # The request was cancelled while its batch was written
+                if failed:
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            elif failed:
+                retry.append((row, on_written, result))
+            elif on_written is not None:
+                try:
+                    on_written(result)
+                except Exception as e:
+                    print(f"⚠️ Post-insert callback failed: {e}")
+        for row, on_written, error in retry:
+            await self._write_behind_retry(row, on_written, error)
+
+    def _find_stored(self, row):
+        """The row as stored, if an insert whose answer was lost did commit it."""
+        query = self.db.table(self.table).select('*') \
+            .eq('user_id', row.get('user_id')) \
+            .eq('created_at', row.get('created_at')) \
+            .eq('amount', row.get('amount'))
+        if row.get('message') is not None:
+            query = query.eq('message', row['message'])
+        response = query.limit(1).execute()
+        return response.data[0] if response.data else None
+
+    async def _write_behind_retry(self, row, on_written, error):
+        """
+        Acknowledged rows that failed to flush: a few more attempts, then they are logged as
+        lost. After an ambiguous failure the row is looked up first, so it isn't stored twice.
+        """
+        for attempt in range(1, WRITE_BEHIND_ATTEMPTS):
+            await asyncio.sleep(WRITE_BEHIND_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            try:
+                inserted = None if is_rejected(error) else await asyncio.to_thread(self._find_stored, row)
+                if inserted is None:
+                    inserted = (await asyncio.to_thread(self._insert, [row]))[0]
+            except Exception as e:
+                error = e
+                continue
+            if on_written is not None:
+                on_written(inserted)
+            return
+        metrics.increment("group_commit.lost_rows")
+        print(f"❌ DB Write Error (write-behind) for UserID '{row.get('user_id')}', row dropped: {error}")
+
+    async def close(self):
+        """Flushes what is buffered and waits for every running flush (called on shutdown)."""
+        if self.loop is None:
+            return
+        self.flush()
+        while self.flushing:
+            await asyncio.gather(*list(self.flushing), return_exceptions=True)
+
+
+committer = GroupCommitter()
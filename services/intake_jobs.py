@@ -0,0 +1,69 @@
+from datetime import datetime
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.anomaly_stream import score_transaction, record_transaction
+from services.activity_profile import load_profile, save_profile
+from services.recurring_detector import update_recurring_state
+from services import refunds
+from services.pendings import reconcile_transaction
+from services.digest import mark_stale as mark_digest_stale
+from services import agent_tools
+from services import semantic_index
+from services import single_flight
+from services.summary import refresh_summary
+from services.alert import limit_checker
+from services.metrics import metrics
+from services.work_queue import queue as work_queue
+
+# --- 1. SUPABASE INITIALIZATION ---
+DB = initialize_supabase()
+
+
+def _flag_anomaly(transaction_id):
+    DB.table('transaction').update({"anomaly": True}).eq('transaction_id', transaction_id).execute()
+
+
+# --- 2. JOBS ---
+# Each job ends with its only non-idempotent write, so a retried job never applies a change twice.
+def score_amount(user_id, tx):
+    """Amount check against the user's category sketch, then the amount is folded into it."""
+    anomaly, sketch = score_transaction(user_id, tx)
+    if anomaly and not tx.get('anomaly'):
+        _flag_anomaly(tx['transaction_id'])
+    record_transaction(user_id, tx, sketch)
+
+
+def score_activity(user_id, tx, timestamp):
+    """Time-of-week check against the user's learned activity hours, then the profile learns it."""
+    dt = datetime.fromisoformat(timestamp)  # Scored by its hour in LOCAL_TIMEZONE, like the replayed history
+    profile = load_profile(user_id, before_id=tx['transaction_id'])  # A first load replays the earlier history
+    if profile.is_unusual(dt) and not tx.get('anomaly'):
+        _flag_anomaly(tx['transaction_id'])
+    profile.add(dt)
+    save_profile(user_id, profile)
+
+
+def check_limits(user_id):
+    alert = limit_checker(user_id)
+    if alert != "No alerts":
+        metrics.increment("alerts.limit_reached")
+        print(f"🔔 Spending limit alert for UserID '{user_id}': {alert}")
+
+
+# --- 3. ENQUEUEING ---
+def enqueue_followups(user_id, tx, timestamp):
+    """
+    Queues everything derived from a stored transaction (`tx` is the inserted row).
+    Per-user jobs run in this order; cache drops and rebuilds coalesce across a burst.
+    """
+    tx = dict(tx)  # The jobs outlive the request; don't share the response's dict
+    work_queue.submit(user_id, "score_amount", score_amount, user_id, tx)
+    work_queue.submit(user_id, "score_activity", score_activity, user_id, tx, timestamp)
+    work_queue.submit(user_id, "recurring_state", update_recurring_state, user_id, tx)
+    work_queue.submit(user_id, "refund_matching", refunds.process_transaction, user_id, tx)
+    work_queue.submit(user_id, "pending_reconciliation", reconcile_transaction, user_id, tx)
+    work_queue.submit(user_id, "semantic_index", semantic_index.add_transaction, user_id, tx)
+    work_queue.submit(user_id, "agent_tools_cache", agent_tools.invalidate, user_id, coalesce=True)
+    work_queue.submit(user_id, "read_cache", single_flight.invalidate, user_id, coalesce=True)
+    work_queue.submit(user_id, "digest_stale", mark_digest_stale, user_id, coalesce=True)
+    work_queue.submit(user_id, "summary", refresh_summary, user_id, coalesce=True)
+    work_queue.submit(user_id, "limit_alerts", check_limits, user_id, coalesce=True)
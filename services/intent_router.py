@@ -0,0 +1,236 @@
+import re
+import threading
+import time
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.metrics import metrics
+from services.prediction import get_spending_prediction, get_cashflow_prediction
+from services.recurring_detector import get_recurring, get_upcoming_bills
+from services import pendings
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+# Questions asking for advice or explanations always go to the LLM, even if they mention a known topic
+OPEN_ENDED = re.compile(r"\b(why|should|advice|advise|suggest|tips?|help me|how (can|do|to)|plan|explain|compare|reduce|save more)\b")
+
+# Period slot -> column prefix of the 'summary' table
+PERIODS = [
+    (re.compile(r"\b(today|todays|today's|this day)\b"), "day", "today"),
+    (re.compile(r"\b(this|current) week\b|\bweekly\b"), "week", "this week"),
+    (re.compile(r"\b(this|current) month\b|\bmonthly\b"), "month", "this month"),
+    (re.compile(r"\b(this|current) year\b|\byearly\b|\bannual(ly)?\b"), "year", "this year"),
+]
+# Periods the summary table has no columns for (past, future or custom ranges): those questions go to the LLM
+MONTH_NAMES = r"jan(uary)?|feb(ruary)?|mar(ch)?|apr(il)?|june?|july?|aug(ust)?|sep(t(ember)?)?|oct(ober)?|nov(ember)?|dec(ember)?"
+OTHER_PERIOD = re.compile(
+    r"\b(last|previous|prior|past|yesterday|ago|since|between|till|until|next|tomorrow)\b"
+    r"|\b\d+\s*(days?|weeks?|months?|years?)\b"
+    rf"|\b({MONTH_NAMES})\b|\b(in|of|during) may\b|\bmay \d"
+    r"|\b(19|20)\d{2}\b"
+)
+# Forecast horizon slot -> services.forecasting timeframe
+HORIZONS = [
+    (re.compile(r"\b(tomorrow|next day|daily)\b"), "daily", "tomorrow"),
+    (re.compile(r"\b(next week|weekly)\b"), "weekly", "next week"),
+    (re.compile(r"\b(next month|monthly)\b"), "monthly", "next month"),
+]
+
+# (intent, pattern) checked in order; the first match wins
+INTENTS = [
+    ("forecast", re.compile(r"\b(predict\w*|forecast\w*|expect\w*|projected|will i (spend|have)|going to spend)\b")),
+    ("upcoming_bills", re.compile(r"\b(upcoming|due|next) (bills?|payments?|subscriptions?)\b|\bbills? (due|coming)\b")),
+    ("subscriptions", re.compile(r"\b(subscriptions?|recurring|regular payments?|auto ?pay)\b")),
+    ("owed", re.compile(r"\b(owe[sd]?|pending|lent|borrowed|due from)\b")),
+    ("cashflow", re.compile(r"\b(cash ?flow|net (savings|cash ?flow)|saved|savings|left over)\b")),
+    ("income", re.compile(r"\b(income|earn(ed|ings)?|received|credited|salary)\b")),
+    ("spending", re.compile(r"\b(spen[dt]|spending|expenses?|paid|debited|outflow)\b")),
+]
+
+# Questions that only look like a total: rankings ("what did I spend the most on"), picks ("which category"),
+# repayments ("has Rahul paid me back") and balances the app doesn't track ("net worth"). They go to the LLM.
+AMBIGUOUS = re.compile(
+    r"\b(most|least|biggest|largest|highest|lowest|smallest|top|max(imum)?|min(imum)?|more|less|than)\b"
+    r"|\b(which|what|who|whom|where|when)\b"
+    r"|\b(paid|pay|repaid|returned)\s+(me|us|back)\b|\bworth\b"
+)
+
+# "spent on food" / "paid to Swiggy": per-category and per-merchant totals are not in the summary table
+SCOPED = re.compile(r"\b(on|at|to|from|for|in)\s+(?!(this|current|last|the|today|tomorrow|next)\b)[a-z]")
+OWED_BY_PERSON = re.compile(r"\b(?:does|did|has)\s+([a-z][a-z .'-]{0,40}?)\s+owe\b|\bdo i owe\s+([a-z][a-z .'-]{0,40}?)\s*\??$")
+
+
+def _money(value):
+    return f"₹{float(value or 0):,.2f}"
+
+
+def _find_slot(slots, text, default):
+    for pattern, value, label in slots:
+        if pattern.search(text):
+            return value, label
+    return default
+
+
+def classify(message):
+    """
+    Returns (intent, slots) for questions the router can answer from precomputed
+    data, or (None, {}) when the message should go to the LLM.
+    """
+    original = " ".join(message.split())
+    text = original.lower()
+    if OPEN_ENDED.search(text):
+        return None, {}
+    for intent, pattern in INTENTS:
+        if not pattern.search(text):
+            continue
+        slots = {}
+        if intent in ("spending", "income", "cashflow"):
+            if SCOPED.search(text) or OTHER_PERIOD.search(text) or AMBIGUOUS.search(text):
+                return None, {}
+            slots["period"], slots["period_label"] = _find_slot(PERIODS, text, ("month", "this month"))
+        elif intent == "forecast":
+            slots["timeframe"], slots["period_label"] = _find_slot(HORIZONS, text, ("monthly", "next month"))
+            slots["cashflow"] = bool(re.search(r"\b(cash ?flow|save|savings|left)\b", text))
+        elif intent == "owed":
+            match = OWED_BY_PERSON.search(text)
+            if match:
+                group = 1 if match.group(1) else 2
+                # The name as the user wrote it: balances are stored with the original casing
+                slots["person"] = original[match.start(group):match.end(group)].strip()
+        elif intent == "upcoming_bills":
+            days = re.search(r"\b(\d{1,3}) days?\b", text)
+            slots["days"] = int(days.group(1)) if days else (7 if "week" in text else 30)
+        return intent, slots
+    return None, {}
+
+
+# --- 2. ANSWERS ---
+def _read_summary(user_id):
+    response = DB.table('summary').select('*').eq('user_id', user_id).maybe_single().execute()
+    return (response.data if response else None) or {}
+
+
+def _answer_summary(user_id, slots, column, verb):
+    summary = _read_summary(user_id)
+    if not summary:
+        return None  # Not computed yet (new user): the LLM reads the transactions instead of answering 0
+    amount = summary.get(f"{slots['period']}_{column}")
+    return f"You {verb} {_money(amount)} {slots['period_label']}."
+
+
+def _answer_cashflow(user_id, slots):
+    summary = _read_summary(user_id)
+    if not summary:
+        return None
+    period = slots['period']
+    cashflow = float(summary.get(f"{period}_cashflow") or 0)
+    direction = "saved" if cashflow >= 0 else "overspent by"
+    return f"You {direction} {_money(abs(cashflow))} {slots['period_label']} " \
+           f"(income {_money(summary.get(period + '_in'))}, spending {_money(summary.get(period + '_out'))})."
+
+
+def _answer_forecast(user_id, slots):
+    if slots["cashflow"]:
+        result = get_cashflow_prediction(user_id, slots["timeframe"])
+        if "predicted_cashflow" not in result:
+            return result.get("message")
+        return f"Your predicted cashflow for {slots['period_label']} is {_money(result['predicted_cashflow'])}."
+    result = get_spending_prediction(user_id, slots["timeframe"])
+    if "predicted_expense" not in result:
+        return result.get("message")
+    trend = result['trend']
+    trend_text = f", {abs(trend):.0f}% {'higher' if trend > 0 else 'lower'} than your recent pace" if abs(trend) >= 1 else ""
+    return f"You are expected to spend about {_money(result['predicted_expense'])} {slots['period_label']}{trend_text}."
+
+
+def _answer_subscriptions(user_id, slots):
+    subscriptions = get_recurring(user_id)
+    if not subscriptions:
+        return "I haven't found any subscriptions or regular payments yet."
+    subscriptions = sorted(subscriptions, key=lambda s: -float(s['amount'] or 0))  # Shared result: don't sort in place
+    lines = [f"- {s['recipient']}: {_money(s['amount'])} {s['frequency']}" for s in subscriptions]
+    return f"You have {len(subscriptions)} recurring payments:\n" + "\n".join(lines)
+
+
+def _answer_upcoming_bills(user_id, slots):
+    bills = get_upcoming_bills(user_id, days=slots["days"])
+    if not bills:
+        return f"No bills are due in the next {slots['days']} days."
+    lines = [f"- {b['recipient']}: {_money(b['amount'])} on {b['next_due_date']}" for b in bills]
+    return f"Bills due in the next {slots['days']} days:\n" + "\n".join(lines)
+
+
+def _answer_owed(user_id, slots):
+    if slots.get("person"):
+        balance = pendings.get_balance(user_id, slots["person"])
+        amount = float(balance['net_amount'] or 0)
+        if amount > 0:
+            return f"{balance['other_user']} owes you {_money(amount)}."
+        if amount < 0:
+            return f"You owe {balance['other_user']} {_money(-amount)}."
+        return f"You and {balance['other_user']} are settled up."
+    balances = pendings.get_balances(user_id)
+    if not balances:
+        return "You have no pending payments."
+    lines = [
+        f"- {b['other_user']} owes you {_money(b['net_amount'])}" if b['net_amount'] > 0
+        else f"- You owe {b['other_user']} {_money(-b['net_amount'])}"
+        for b in balances if b['net_amount']
+    ]
+    return "Your pending balances:\n" + "\n".join(lines) if lines else "You have no pending payments."
+
+
+ANSWERS = {
+    "spending": lambda user_id, slots: _answer_summary(user_id, slots, "out", "spent"),
+    "income": lambda user_id, slots: _answer_summary(user_id, slots, "in", "received"),
+    "cashflow": _answer_cashflow,
+    "forecast": _answer_forecast,
+    "subscriptions": _answer_subscriptions,
+    "upcoming_bills": _answer_upcoming_bills,
+    "owed": _answer_owed,
+}
+
+
+# --- 3. ROUTER ---
+class RouterStats:
+    """Counts routed vs. LLM-bound messages and publishes the handled fraction as a gauge."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handled = 0
+        self.total = 0
+
+    def record(self, handled):
+        with self.lock:
+            self.total += 1
+            self.handled += handled
+            fraction = self.handled / self.total
+        metrics.gauge("intent_router.handled_fraction", round(fraction, 4))
+
+
+stats = RouterStats()
+
+
+def route(user_id, message):
+    """
+    Answers recognized intents from precomputed aggregates.
+
+    Returns:
+        str or None: the reply, or None when the message should go to the LLM
+        (unrecognized, open-ended, or the data lookup failed).
+    """
+    started = time.perf_counter()
+    intent, slots = classify(message)
+    reply = None
+    if intent is not None:
+        try:
+            reply = ANSWERS[intent](user_id, slots)
+        except Exception as e:
+            print(f"Error answering intent '{intent}': {e}")
+
+    stats.record(reply is not None)
+    if reply is None:
+        metrics.increment("intent_router.fallback")
+        return None
+    metrics.increment(f"intent_router.handled.{intent}")
+    metrics.observe("intent_router.answer_seconds", time.perf_counter() - started)
+    return reply
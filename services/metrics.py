@@ -0,0 +1,61 @@
+import threading
+from collections import defaultdict, deque
+
+# --- 1. SETTINGS ---
+RESERVOIR_SIZE = 1024  # Latest observations kept per timing metric for percentiles
+
+
+# --- 2. REGISTRY ---
+class Metrics:
+    """
+    Tiny in-process metrics registry: counters, gauges and timing summaries.
+    Exposed as JSON on GET /metrics; values are per worker process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.observations = defaultdict(lambda: deque(maxlen=RESERVOIR_SIZE))
+        self.totals = defaultdict(lambda: [0, 0.0])  # name -> [count, sum] over the whole lifetime
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.observations[name].append(value)
+            total = self.totals[name]
+            total[0] += 1
+            total[1] += value
+
+    @staticmethod
+    def _percentile(values, p):
+        rank = (len(values) - 1) * p
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    def snapshot(self):
+        with self.lock:
+            summaries = {}
+            for name, values in self.observations.items():
+                ordered = sorted(values)
+                count, total = self.totals[name]
+                summaries[name] = {
+                    "count": count,
+                    "mean": round(total / count, 6) if count else 0.0,
+                    "p50": round(self._percentile(ordered, 0.50), 6),
+                    "p95": round(self._percentile(ordered, 0.95), 6),
+                    "p99": round(self._percentile(ordered, 0.99), 6),
+                    "max": round(ordered[-1], 6),
+                }
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges), "timings": summaries}
+
+
+metrics = Metrics()
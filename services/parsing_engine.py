@@ -3,6 +3,8 @@ import re
 from datetime import datetime
 from pydantic import BaseModel, Field
 from langchain_google_genai import ChatGoogleGenerativeAI
+from services.admission import admission, INTAKE
+from services.resilience import gemini, CircuitOpen
 # Note: Removed 'supabase: Client' import. This file no longer knows about the DB.
 
 
@@ -47,16 +49,26 @@ class TransactionDetails(BaseModel):
     category: str = Field(description="A suggested category (e.g., Food, Shopping, Salary, Travel).")
 
 
-def parse_with_llm(message: str):
+def parse_with_llm(message: str, user_id: str = "anonymous", kind: str = INTAKE):
     """
     Parses a message using a structured output LLM.
+    The call goes through admission control (as work class `kind`) and raises
+    admission.Rejected when the user is over their rate or the model queue is full,
+    and resilience.CircuitOpen while Gemini is failing.
     """
     # Assuming the Google API key is set in the environment variables
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
+    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0, timeout=gemini.timeout)
     structured_llm = llm.with_structured_output(TransactionDetails)
     prompt = f"Analyze the following financial transaction message and extract the details. Message: \"{message}\""
+    with admission.slot(user_id, kind):
+        try:
+            response = gemini.call(lambda: structured_llm.invoke(prompt))
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            print(f"LLM parsing failed: {e}")
+            return None
     try:
-        response = structured_llm.invoke(prompt)
         response_dict = response.dict()
         response_dict['message'] = message
         return response_dict
@@ -66,7 +78,7 @@ def parse_with_llm(message: str):
 
 
 # --- 4. HYBRID PARSER CONTROLLER (Unchanged) ---
-def parse_transaction(message: str):
+def parse_transaction(message: str, user_id: str = "anonymous"):
     """
     Parses a transaction message using a hybrid approach.
     First, it tries with regex. If that fails, it falls back to an LLM.
@@ -80,7 +92,7 @@ def parse_transaction(message: str):
         return result
 
     print("--- Regex failed. Falling back to LLM parser... ---")
-    result = parse_with_llm(message)
+    result = parse_with_llm(message, user_id)
     if result:
         print("--- LLM parsing successful. ---")
     return result
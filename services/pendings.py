@@ -1,112 +1,415 @@
-from flask import Flask, request, jsonify
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from core.setup import initialize_supabase  # Using your custom initializer
+from services.resilience import is_unique_violation
 
-# Note: datetime is no longer needed as Supabase handles timestamps
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+# Shared client; 'created_at' and 'pending_id' are handled automatically by Supabase
+DB = initialize_supabase()
 
-# --- 1. SUPABASE INITIALIZATION ---
-# Initialize the Supabase client using your custom function
-db = initialize_supabase()
+PENDING_TABLE = 'pending'
+BALANCE_TABLE = 'pending_balance'
+BALANCE_FUNCTION = 'adjust_pending_balances'  # Atomic balance increments, see Docs/pendings.sql
+INDEX_TTL_SECONDS = 300  # Reload a user's open items after this long (other workers may have changed them)
+MAX_INDEXED_USERS = 50_000  # Users kept in the reconciliation index per process (LRU)
+REDUCE_RETRIES = 3  # Conditional partial-payment writes attempted before giving up
 
-# --- 2. FLASK APPLICATION ---
-app = Flask(__name__)
 
+# --- 2. HELPERS ---
+def _to_item(row):
+    """Maps a 'pending' row back to the JSON format the app uses."""
+    return {
+        "id": row['pending_id'],
+        "description": row['reason'],
+        "amount": row['amount'],
+        "person_name": row['other_user'],
+        "type": 'payable' if row['to_give'] else 'receivable',
+        "created_at": row['created_at'],
+        "settled_at": row.get('settled_at'),
+    }
 
-# --- 3. PENDING TRANSACTIONS API ENDPOINTS ---
 
-@app.route('/pending', methods=['POST'])
-def add_pending_item():
+def _signed_amount(row):
+    # Positive: the other person owes the user. Negative: the user owes them.
+    return -row['amount'] if row['to_give'] else row['amount']
+
+
+def _adjust_balances(user_id, rows, sign, count_items=True):
     """
-    Adds a new pending transaction for a user.
-    Expects JSON: {"UserID", "description", "amount", "type", "person_name"}
-    'type' should be 'payable' (you owe) or 'receivable' (you are owed).
+    Applies the open pending `rows` to the per-counterparty balance index.
+    `sign` is +1 when the rows are opened and -1 when they are settled or deleted.
+    With count_items=False only the amounts change (partial payments).
+    The deltas are added in the database (Docs/pendings.sql), not read and written back.
     """
-    if not db: return jsonify({"error": "Supabase not initialized"}), 500
+    deltas = {}
+    for row in rows:
+        amount, count = deltas.get(row['other_user'], (0.0, 0))
+        deltas[row['other_user']] = (amount + sign * _signed_amount(row), count + (sign if count_items else 0))
+    if not deltas:
+        return
+    DB.rpc(BALANCE_FUNCTION, {
+        "p_user_id": user_id,
+        "p_deltas": [{"other_user": other_user, "delta_amount": round(amount, 2), "delta_count": count}
+                     for other_user, (amount, count) in deltas.items()],
+    }).execute()
 
-    data = request.get_json()
-    required_fields = ["UserID", "description", "amount", "type", "person_name"]
-    if not data or not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields: UserID, description, amount, type, person_name"}), 400
 
-    user_id = data["UserID"]
+def _open_rows(user_id, pending_ids):
+    response = DB.table(PENDING_TABLE).select('*') \
+        .eq('user_id', user_id) \
+        .in_('pending_id', list(pending_ids)) \
+        .is_('settled_at', 'null') \
+        .execute()
+    return response.data or []
 
-    # --- Map incoming JSON to your Supabase schema ---
-    try:
-        new_item = {
-            "user_id": user_id,
-            "reason": data["description"],
-            "amount": float(data["amount"]),
-            # Map 'type' to the 'to_give' boolean
-            "to_give": True if data["type"] == 'payable' else False,
-            "other_user": data["person_name"]
-            # 'created_at' and 'pending_id' are handled automatically by Supabase
-        }
-    except ValueError:
-        return jsonify({"error": "Invalid amount. Must be a number."}), 400
 
-    try:
-        # Insert the new record into the 'pending' table
-        response = db.table('pending').insert(new_item).execute()
+# --- 3. OPEN ITEMS INDEX (FOR RECONCILIATION) ---
+def normalize_name(name):
+    """Lower-case letters and single spaces only, eg "Rahul  K." -> "rahul k"."""
+    return " ".join(re.sub(r"[^a-z ]+", " ", str(name or "").lower()).split())
 
-        if not response.data:
-            raise Exception("Failed to insert data or no data returned.")
 
-        # Get the new ID from the returned data
-        new_id = response.data[0]['pending_id']
-
-        return jsonify({"status": "success", "id": new_id}), 201
-    except Exception as e:
-        return jsonify({"error": f"Failed to add pending item: {e}"}), 500
+def _paise(amount):
+    return int(round(float(amount) * 100))
 
 
-@app.route('/pending/<user_id>', methods=['GET'])
-def get_pending_items(user_id):
+class OpenPendingIndex:
     """
-    Retrieves all pending items for a given UserID.
+    In-memory index of each user's open pending items, keyed by
+    (direction, normalized counterparty) and (direction, normalized counterparty, amount).
+    A user's items are loaded once and then kept in sync by the functions in this module.
     """
-    if not db: return jsonify({"error": "Supabase not initialized"}), 500
 
+    def __init__(self):
+        self.users = OrderedDict()  # user_id -> {"loaded_at", "by_id", "by_name", "by_amount"}
+        self.lock = threading.Lock()
+
+    def _entry(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is None or time.monotonic() - entry["loaded_at"] > INDEX_TTL_SECONDS:
+            return None
+        self.users.move_to_end(user_id)
+        return entry
+
+    def load(self, user_id, rows):
+        entry = {"loaded_at": time.monotonic(), "by_id": {}, "by_name": {}, "by_amount": {}}
+        with self.lock:
+            self.users[user_id] = entry
+            self.users.move_to_end(user_id)
+            if len(self.users) > MAX_INDEXED_USERS:
+                self.users.popitem(last=False)
+            for row in sorted(rows, key=lambda r: r.get('created_at') or ''):
+                self._insert(entry, row)
+
+    @staticmethod
+    def _insert(entry, row):
+        name = (row['to_give'], normalize_name(row['other_user']))
+        entry["by_id"][row['pending_id']] = row
+        entry["by_name"].setdefault(name, OrderedDict())[row['pending_id']] = row
+        entry["by_amount"].setdefault(name + (_paise(row['amount']),), OrderedDict())[row['pending_id']] = row
+
+    @staticmethod
+    def _discard(index, key, pending_id):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.pop(pending_id, None)
+            if not bucket:
+                del index[key]
+
+    def add(self, user_id, row):
+        with self.lock:
+            entry = self._entry(user_id)
+            if entry is not None:
+                self._insert(entry, row)
+
+    def remove(self, user_id, pending_ids):
+        with self.lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            for pending_id in pending_ids:
+                row = entry["by_id"].pop(pending_id, None)
+                if row is None:
+                    continue
+                name = (row['to_give'], normalize_name(row['other_user']))
+                self._discard(entry["by_name"], name, pending_id)
+                self._discard(entry["by_amount"], name + (_paise(row['amount']),), pending_id)
+
+    def _set_amount(self, user_id, row, amount):
+        """Changes an item's amount and moves it to its new amount bucket (lock held)."""
+        old_amount = row['amount']
+        row['amount'] = amount
+        entry = self._entry(user_id)
+        if entry is None or row['pending_id'] not in entry["by_id"]:
+            return
+        indexed = entry["by_id"][row['pending_id']]  # A reload may have replaced the caller's row
+        indexed['amount'] = amount
+        name = (row['to_give'], normalize_name(row['other_user']))
+        self._discard(entry["by_amount"], name + (_paise(old_amount),), row['pending_id'])
+        entry["by_amount"].setdefault(name + (_paise(amount),), OrderedDict())[row['pending_id']] = indexed
+
+    def decrement(self, user_id, row, paid):
+        """Takes a partial payment off an item. Returns (old_amount, new_amount)."""
+        with self.lock:
+            old_amount = row['amount']
+            remaining = round(old_amount - paid, 2)
+            self._set_amount(user_id, row, remaining)
+            return old_amount, remaining
+
+    def set_amount(self, user_id, row, amount):
+        with self.lock:
+            self._set_amount(user_id, row, amount)
+
+    def candidates(self, user_id, to_give, names, amount):
+        """
+        Open items that a payment could settle: exact-amount matches first, otherwise
+        every open item with that person, oldest first. Returns None if the user is not loaded.
+        """
+        with self.lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return None
+            for name in names:
+                exact = entry["by_amount"].get((to_give, name, _paise(amount)))
+                if exact:
+                    return [next(iter(exact.values()))]
+            for name in names:
+                items = entry["by_name"].get((to_give, name))
+                if items:
+                    return list(items.values())
+            return []
+
+
+open_index = OpenPendingIndex()
+
+
+# --- 4. PENDING ITEMS ---
+def add_pending_item(user_id, description, amount, item_type, person_name, client_ref=None):
+    """
+    Inserts a pending item and adds it to the balance index. Returns the new pending_id.
+    With a `client_ref` (offline sync), inserting the same item again returns the existing id.
+    """
+    new_item = {
+        "user_id": user_id,
+        "reason": description,
+        "amount": float(amount),
+        # Map 'type' to the 'to_give' boolean
+        "to_give": item_type == 'payable',
+        "other_user": person_name.strip(),
+    }
+    if client_ref is not None:
+        new_item["client_ref"] = client_ref
     try:
-        # Select all items from 'pending' table for the user
-        response = db.table('pending').select('*').eq('user_id', user_id).execute()
-
-        pending_list = []
-
-        # --- Map Supabase columns back to original JSON format ---
-        for item in response.data:
-            pending_list.append({
-                "id": item['pending_id'],
-                "description": item['reason'],
-                "amount": item['amount'],
-                "person_name": item['other_user'],
-                "type": 'payable' if item['to_give'] else 'receivable',
-                "created_at": item['created_at']
-            })
-
-        return jsonify(pending_list)
+        response = DB.table(PENDING_TABLE).insert(new_item).execute()
     except Exception as e:
-        return jsonify({"error": f"Failed to retrieve items: {e}"}), 500
+        if client_ref is None or not is_unique_violation(e):
+            raise
+        existing = DB.table(PENDING_TABLE).select('pending_id') \
+            .eq('user_id', user_id) \
+            .eq('client_ref', client_ref) \
+            .execute()
+        return existing.data[0]['pending_id']  # Already inserted (and counted) by an earlier attempt
+    if not response.data:
+        raise Exception("Failed to insert data or no data returned.")
+
+    _adjust_balances(user_id, response.data, +1)
+    open_index.add(user_id, response.data[0])
+    return response.data[0]['pending_id']
+
+
+def list_pending_items(user_id, page=1, page_size=50, include_settled=False):
+    """Returns one page of a user's pending items, newest first, with the total count."""
+    start = (page - 1) * page_size
+    query = DB.table(PENDING_TABLE).select('*', count='exact').eq('user_id', user_id)
+    if not include_settled:
+        query = query.is_('settled_at', 'null')
+    response = query.order('created_at', desc=True).range(start, start + page_size - 1).execute()
+    return {
+        "items": [_to_item(row) for row in response.data or []],
+        "page": page,
+        "page_size": page_size,
+        "total": response.count,
+    }
+
 
+def settle_pending_items(user_id, pending_ids):
+    """Marks open items as settled (kept for history) and removes them from the balances."""
+    # Only rows this update actually settled count: a concurrent settle of the same item gets none back
+    response = DB.table(PENDING_TABLE).update({"settled_at": datetime.now(timezone.utc).isoformat()}) \
+        .eq('user_id', user_id) \
+        .in_('pending_id', list(pending_ids)) \
+        .is_('settled_at', 'null') \
+        .execute()
+    rows = response.data or []
+    if not rows:
+        return 0
+    _adjust_balances(user_id, rows, -1)
+    open_index.remove(user_id, [row['pending_id'] for row in rows])
+    return len(rows)
 
-@app.route('/pending/<user_id>/<item_id>', methods=['DELETE'])
-def delete_pending_item(user_id, item_id):
+
+def delete_pending_items(user_id, pending_ids):
+    """Deletes items; open ones are also removed from the balances."""
+    response = DB.table(PENDING_TABLE).delete() \
+        .eq('user_id', user_id) \
+        .in_('pending_id', list(pending_ids)) \
+        .execute()
+    deleted = response.data or []
+    _adjust_balances(user_id, [row for row in deleted if not row.get('settled_at')], -1)
+    open_index.remove(user_id, [row['pending_id'] for row in deleted])
+    return len(deleted)
+
+
+def reduce_pending_item(user_id, row, paid):
     """
-    Deletes a specific pending item by its ID.
+    Records a partial payment: lowers the item's amount and its counterparty balance.
+    The write only applies if the stored amount is still the one we decremented; when
+    another worker changed it first, the item is re-read and the payment applied to that.
+
+    Returns:
+        float or None: the remaining amount, or None if the item was settled meanwhile.
     """
-    if not db: return jsonify({"error": "Supabase not initialized"}), 500
+    expected, remaining = open_index.decrement(user_id, row, paid)
+    for _ in range(REDUCE_RETRIES):
+        response = DB.table(PENDING_TABLE).update({"amount": remaining}) \
+            .eq('user_id', user_id) \
+            .eq('pending_id', row['pending_id']) \
+            .eq('amount', expected) \
+            .is_('settled_at', 'null') \
+            .execute()
+        if response.data:
+            _adjust_balances(user_id, [{**row, "amount": paid}], -1, count_items=False)
+            return remaining
 
-    try:
-        # Delete from 'pending' table where user_id and pending_id match
-        db.table('pending').delete() \
+        current = _open_rows(user_id, [row['pending_id']])
+        if not current:
+            open_index.remove(user_id, [row['pending_id']])
+            return None
+        expected = current[0]['amount']
+        if paid >= expected - 0.005:
+            settle_pending_items(user_id, [row['pending_id']])  # What is left is covered by this payment
+            return 0.0
+        remaining = round(expected - paid, 2)
+        open_index.set_amount(user_id, row, remaining)
+    print(f"⚠️ Pending item #{row['pending_id']} kept changing; partial payment of {paid} not recorded.")
+    open_index.set_amount(user_id, row, expected)
+    return None
+
+
+# --- 5. BALANCE INDEX ---
+def get_balances(user_id):
+    """Net balance with every counterparty that still has open items."""
+    response = DB.table(BALANCE_TABLE).select('other_user, net_amount, open_count, updated_at') \
+        .eq('user_id', user_id) \
+        .gt('open_count', 0) \
+        .order('net_amount', desc=True) \
+        .execute()
+    return response.data or []
+
+
+def get_balance(user_id, other_user):
+    """
+    Single indexed lookup of what one person owes the user (negative: the user owes them).
+    The name is matched case-insensitively ("rahul" finds "Rahul").
+    """
+    name = re.sub(r"([\\%_])", r"\\\1", other_user.strip())  # Literal match: escape ilike wildcards
+    response = DB.table(BALANCE_TABLE).select('other_user, net_amount, open_count, updated_at') \
+        .eq('user_id', user_id) \
+        .ilike('other_user', name) \
+        .execute()
+    if response.data:
+        return response.data[0]
+    return {"other_user": other_user.strip(), "net_amount": 0.0, "open_count": 0, "updated_at": None}
+
+
+def rebuild_balances(user_id):
+    """
+    Repair tool: recomputes the user's balance index from their open pending items.
+    The recomputed rows are upserted first and only counterparties with no open items
+    left are deleted, so readers never see the balances empty.
+    """
+    response = DB.table(PENDING_TABLE).select('*') \
+        .eq('user_id', user_id) \
+        .is_('settled_at', 'null') \
+        .execute()
+    totals = {}
+    for row in response.data or []:
+        amount, count = totals.get(row['other_user'], (0.0, 0))
+        totals[row['other_user']] = (amount + _signed_amount(row), count + 1)
+
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [{"user_id": user_id, "other_user": other_user, "net_amount": round(amount, 2),
+             "open_count": count, "updated_at": now}
+            for other_user, (amount, count) in totals.items()]
+    if rows:
+        DB.table(BALANCE_TABLE).upsert(rows, on_conflict='user_id,other_user').execute()
+
+    stored = DB.table(BALANCE_TABLE).select('other_user').eq('user_id', user_id).execute().data or []
+    stale = [row['other_user'] for row in stored if row['other_user'] not in totals]
+    if stale:
+        DB.table(BALANCE_TABLE).delete().eq('user_id', user_id).in_('other_user', stale).execute()
+    return get_balances(user_id)
+
+
+# --- 6. RECONCILIATION WITH INCOMING TRANSACTIONS ---
+def _open_candidates(user_id, tx):
+    """Open items the transaction's counterparty could be paying off (see OpenPendingIndex.candidates)."""
+    if tx.get('amount') is None or tx.get('payment_type') not in ('income', 'expense'):
+        return []
+    to_give = tx['payment_type'] == 'expense'
+    full_name = normalize_name(tx.get('sender_name'))
+    if not full_name:
+        return []
+    names = [full_name] + ([full_name.split()[0]] if " " in full_name else [])
+
+    candidates = open_index.candidates(user_id, to_give, names, tx['amount'])
+    if candidates is None:
+        response = DB.table(PENDING_TABLE).select('*') \
             .eq('user_id', user_id) \
-            .eq('pending_id', item_id) \
+            .is_('settled_at', 'null') \
             .execute()
+        open_index.load(user_id, response.data or [])
+        candidates = open_index.candidates(user_id, to_give, names, tx['amount'])
+    return candidates
+
+
+def settles_pending(user_id, tx):
+    """True when reconcile_transaction would apply the transaction to an open pending item."""
+    return bool(_open_candidates(user_id, tx))
 
-        return jsonify({"success": True, "message": f"Item {item_id} deleted successfully."})
-    except Exception as e:
-        return jsonify({"error": f"Failed to delete item: {e}"}), 500
 
+def reconcile_transaction(user_id, tx):
+    """
+    Settles open pending items paid by a parsed transaction: a credit from a person
+    settles what they owe the user, a debit to them settles what the user owes.
+    Uses the in-memory index; the 'pending' table is only read the first time a user
+    is seen (or after INDEX_TTL_SECONDS).
+
+    Returns:
+        list: {"pending_id", "paid", "settled"} for every item the payment touched.
+    """
+    candidates = _open_candidates(user_id, tx)
+    remaining = float(tx['amount'])
+    touched, settled = [], []
+    for row in candidates:
+        if remaining <= 0:
+            break
+        if remaining >= row['amount'] - 0.005:
+            remaining -= row['amount']
+            settled.append(row['pending_id'])
+            touched.append({"pending_id": row['pending_id'], "paid": row['amount'], "settled": True})
+        else:
+            left = reduce_pending_item(user_id, row, remaining)
+            if left is not None:
+                touched.append({"pending_id": row['pending_id'], "paid": round(remaining, 2), "settled": left == 0})
+            remaining = 0
 
-# --- 4. MAIN EXECUTION BLOCK ---
-if __name__ == '__main__':
-    # Running on port 5001 (as in your original file)
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    if settled:
+        settle_pending_items(user_id, settled)
+        open_index.remove(user_id, settled)
+    if touched:
+        print(f"🤝 Reconciled {len(touched)} pending item(s) for UserID '{user_id}' against '{tx.get('sender_name')}'.")
+    return touched
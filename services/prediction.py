@@ -1,156 +1,69 @@
 from core.setup import initialize_supabase  # Using your custom initializer
 from datetime import datetime, timedelta
 from collections import defaultdict
-import numpy as np
 from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+from services.forecasting import get_cached_forecast, MIN_TRANSACTIONS, TIMEFRAME_DAYS
+from services.single_flight import single_flight
 
 
+@single_flight("spending_prediction")
 def get_spending_prediction(user_id: str, timeframe: str):
     """
-    Predicts future expenses based on historical data from Supabase.
+    Returns the predicted expenses from the cached per-user forecast.
+    The forecast is only recomputed here when the cache entry is missing or stale.
     """
     try:
-        db = initialize_supabase()
-        if not db:
-            raise Exception("Supabase client not initialized")
-
-        # Fetch last 90 days of transactions for the user
-        ninety_days_ago = (datetime.now() - timedelta(days=90)).isoformat()
-
-        # Query the 'transaction' table
-        response = db.table('transaction').select('created_at, amount, payment_type') \
-            .eq('user_id', user_id) \
-            .gte('created_at', ninety_days_ago) \
-            .execute()
+        if timeframe not in TIMEFRAME_DAYS:
+            return {"message": "Invalid timeframe specified. Use 'daily', 'weekly', or 'monthly'."}
 
-        transactions = response.data
+        forecast = get_cached_forecast(user_id)
 
-        if len(transactions) < 15:
+        if not forecast or forecast.get('transaction_count', 0) < MIN_TRANSACTIONS:
             return {"message": "Not enough data for a reliable prediction."}
 
-        # Separate expenses
-        # Map 'outgoing' to 'expense' per your schema
-        expenses = [tx for tx in transactions if tx.get('payment_type') == 'expense']
-
-        if not expenses:
-            return {"message": "No expense data available for prediction."}
-
-        # Group expenses by day
-        daily_expenses = defaultdict(float)
-        for expense in expenses:
-            # Parse the 'created_at' timestamp string
-            expense_date = parse_datetime(expense['created_at']).date()
-            daily_expenses[expense_date] += expense['amount']
-
-        if not daily_expenses:
-            return {"message": "Not enough daily expense data for prediction."}
-
-        # Calculate average daily expense
-        avg_daily_expense = sum(daily_expenses.values()) / len(daily_expenses)
-
-        # Trend calculation
-        last_30_days_expenses = [v for k, v in daily_expenses.items() if
-                                 k >= (datetime.now() - timedelta(days=30)).date()]
-        previous_30_days_expenses = [v for k, v in daily_expenses.items() if
-                                     (datetime.now() - timedelta(days=60)).date() <= k < (
-                                                 datetime.now() - timedelta(days=30)).date()]
-
-        avg_last_30_days = sum(last_30_days_expenses) / len(last_30_days_expenses) if last_30_days_expenses else 0
-        avg_previous_30_days = sum(previous_30_days_expenses) / len(
-            previous_30_days_expenses) if previous_30_days_expenses else 0
-
-        if avg_previous_30_days > 0:
-            trend = ((avg_last_30_days - avg_previous_30_days) / avg_previous_30_days) * 100
-        else:
-            trend = 0
-
-        if timeframe == 'daily':
-            prediction = avg_daily_expense
-        elif timeframe == 'weekly':
-            prediction = avg_daily_expense * 7
-        elif timeframe == 'monthly':
-            prediction = avg_daily_expense * 30
-        else:
-            return {"message": "Invalid timeframe specified. Use 'daily', 'weekly', or 'monthly'."}
-
-        return {"predicted_expense": round(prediction, 2), "trend": round(trend, 2)}
+        return {
+            "predicted_expense": round(forecast[f"{timeframe}_expense"], 2),
+            "trend": round(forecast['trend'], 2),
+            "computed_at": forecast['computed_at'],
+        }
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"message": "An error occurred during prediction."}
 
 
+@single_flight("cashflow_prediction")
 def get_cashflow_prediction(user_id: str, timeframe: str):
     """
-    Predicts future cashflow based on historical data from Supabase.
+    Returns the predicted cashflow from the cached per-user forecast.
+    The forecast is only recomputed here when the cache entry is missing or stale.
     """
     try:
-        db = initialize_firebase()
-        if not db:
-            raise Exception("Supabase client not initialized")
-
-        # Fetch last 90 days of transactions for the user
-        ninety_days_ago = (datetime.now() - timedelta(days=90)).isoformat()
+        if timeframe not in TIMEFRAME_DAYS:
+            return {"message": "Invalid timeframe specified. Use 'daily', 'weekly', or 'monthly'."}
 
-        # Query the 'transaction' table
-        response = db.table('transaction').select('created_at, amount, payment_type') \
-            .eq('user_id', user_id) \
-            .gte('created_at', ninety_days_ago) \
-            .execute()
+        forecast = get_cached_forecast(user_id)
 
-        transactions = response.data
-
-        if len(transactions) < 15:
+        if not forecast or forecast.get('transaction_count', 0) < MIN_TRANSACTIONS:
             return {"message": "Not enough data for a reliable prediction."}
 
-        # Separate expenses and income
-        # Map 'outgoing'/'incoming' to 'expense'/'income' per your schema
-        expenses = [tx for tx in transactions if tx.get('payment_type') == 'expense']
-        income = [tx for tx in transactions if tx.get('payment_type') == 'income']
-
-        if not expenses and not income:
-            return {"message": "No transaction data available for prediction."}
-
-        # Group expenses by day
-        daily_expenses = defaultdict(float)
-        for expense in expenses:
-            expense_date = parse_datetime(expense['created_at']).date()
-            daily_expenses[expense_date] += expense['amount']
-
-        # Group income by day
-        daily_income = defaultdict(float)
-        for inc in income:
-            income_date = parse_datetime(inc['created_at']).date()
-            daily_income[income_date] += inc['amount']
-
-        # Calculate average daily expense and income
-        avg_daily_expense = sum(daily_expenses.values()) / len(daily_expenses) if daily_expenses else 0
-        avg_daily_income = sum(daily_income.values()) / len(daily_income) if daily_income else 0
-
-        avg_daily_cashflow = avg_daily_income - avg_daily_expense
-
-        if timeframe == 'daily':
-            prediction = avg_daily_cashflow
-        elif timeframe == 'weekly':
-            prediction = avg_daily_cashflow * 7
-        elif timeframe == 'monthly':
-            prediction = avg_daily_cashflow * 30
-        else:
-            return {"message": "Invalid timeframe specified. Use 'daily', 'weekly', or 'monthly'."}
-
-        return {"predicted_cashflow": round(prediction, 2)}
+        return {
+            "predicted_cashflow": round(forecast[f"{timeframe}_cashflow"], 2),
+            "computed_at": forecast['computed_at'],
+        }
 
     except Exception as e:
         print(f"An error occurred: {e}")
         return {"message": "An error occurred during prediction."}
 
 
+@single_flight("daily_spending_trend")
 def get_daily_spending_trend(user_id: str):
     """
     Gets the daily spending trend for the last 7 days from Supabase.
     """
     try:
-        db = initialize_firebase()
+        db = initialize_supabase()
         if not db:
             raise Exception("Supabase client not initialized")
 
@@ -162,6 +75,7 @@ def get_daily_spending_trend(user_id: str):
             .eq('user_id', user_id) \
             .gte('created_at', seven_days_ago) \
             .eq('payment_type', 'expense') \
+            .is_('refunded_by', 'null') \
             .execute()
 
         transactions = response.data
@@ -183,12 +97,13 @@ def get_daily_spending_trend(user_id: str):
         return {"message": "An error occurred while fetching daily trend."}
 
 
+@single_flight("monthly_spending_trend")
 def get_monthly_spending_trend(user_id: str):
     """
     Gets the monthly spending trend for the last 12 months from Supabase.
     """
     try:
-        db = initialize_firebase()
+        db = initialize_supabase()
         if not db:
             raise Exception("Supabase client not initialized")
 
@@ -200,6 +115,7 @@ def get_monthly_spending_trend(user_id: str):
             .eq('user_id', user_id) \
             .gte('created_at', twelve_months_ago) \
             .eq('payment_type', 'expense') \
+            .is_('refunded_by', 'null') \
             .execute()
 
         transactions = response.data
@@ -0,0 +1,164 @@
+from datetime import datetime, timezone
+import numpy as np
+from supabase import Client
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.recurring_detector import MIN_TRANSACTIONS, TOLERANCE_PERCENT, INTERVALS
+from services.timezones import as_local
+
+# --- 1. SETTINGS ---
+BILLS_TABLE = 'upcoming_bill'
+PAGE_SIZE = 1000  # Rows fetched / written per Supabase request
+CONSISTENT_SHARE = 0.8  # Share of payments that must be within TOLERANCE_PERCENT of the median
+
+
+# --- 2. DATA FETCHING ---
+def fetch_expense_columns(db: Client):
+    """
+    Streams every expense and returns it as columnar arrays.
+
+    Returns:
+        tuple: (user_ids, recipients, user_codes, recipient_codes, days, amounts)
+        where days are numpy day numbers (datetime64[D] as int).
+    """
+    users, recipients, dates, amounts = [], [], [], []
+    start = 0
+    while True:
+        page = db.table('transaction').select('user_id, sender_name, created_at, amount') \
+            .eq('payment_type', 'expense') \
+            .order('transaction_id') \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute().data or []
+        for tx in page:
+            if tx.get('amount') is None or not tx.get('sender_name') or not tx.get('created_at'):
+                continue
+            users.append(str(tx['user_id']))
+            recipients.append(tx['sender_name'])
+            dates.append(as_local(tx['created_at']).date().isoformat())  # Calendar date in LOCAL_TIMEZONE, not UTC
+            amounts.append(float(tx['amount']))
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+    user_ids, user_codes = np.unique(np.array(users, dtype=object), return_inverse=True)
+    recipient_names, recipient_codes = np.unique(np.array(recipients, dtype=object), return_inverse=True)
+    days = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+    return user_ids, recipient_names, user_codes, recipient_codes, days, np.array(amounts, dtype=float)
+
+
+# --- 3. VECTORIZED DETECTION ---
+def _segment_median(values, segment_ids, n_segments):
+    """Median of `values` for every segment id in one sort. Empty segments get NaN."""
+    medians = np.full(n_segments, np.nan)
+    if len(values) == 0:
+        return medians
+    order = np.lexsort((values, segment_ids))
+    values, segment_ids = values[order], segment_ids[order]
+    present, starts, counts = np.unique(segment_ids, return_index=True, return_counts=True)
+    low = values[starts + (counts - 1) // 2]
+    high = values[starts + counts // 2]
+    medians[present] = (low + high) / 2
+    return medians
+
+
+def detect_all(user_codes, recipient_codes, days, amounts):
+    """
+    Runs the detect_recurring rules for every (user, recipient) group at once.
+
+    Returns:
+        dict of arrays, one entry per detected subscription: user_code, recipient_code,
+        amount, frequency, transaction_count, last_day, next_due_day.
+    """
+    if len(days) == 0:
+        return {key: np.array([]) for key in
+                ("user_code", "recipient_code", "amount", "frequency", "transaction_count", "last_day", "next_due_day")}
+
+    # Sort by (user, recipient, date) and cut into contiguous groups
+    order = np.lexsort((days, recipient_codes, user_codes))
+    user_codes, recipient_codes = user_codes[order], recipient_codes[order]
+    days, amounts = days[order], amounts[order]
+
+    boundary = np.ones(len(days), dtype=bool)
+    boundary[1:] = (user_codes[1:] != user_codes[:-1]) | (recipient_codes[1:] != recipient_codes[:-1])
+    group_ids = np.cumsum(boundary) - 1
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, len(days)))
+    n_groups = len(starts)
+
+    # 1. Amount consistency around the group median
+    median_amount = _segment_median(amounts, group_ids, n_groups)
+    tolerance = median_amount[group_ids] * TOLERANCE_PERCENT
+    within = np.abs(amounts - median_amount[group_ids]) <= tolerance
+    consistent = np.bincount(group_ids, weights=within, minlength=n_groups) / counts >= CONSISTENT_SHARE
+
+    # 2. Median gap between consecutive payments inside each group
+    same_group = ~boundary[1:]
+    deltas = np.diff(days)[same_group].astype(float)
+    median_delta = _segment_median(deltas, group_ids[1:][same_group], n_groups)
+
+    # 3. First matching interval wins, in INTERVALS order
+    frequency = np.full(n_groups, -1)
+    for index, (avg_days, tol) in reversed(list(enumerate(INTERVALS.values()))):
+        frequency[np.abs(median_delta - avg_days) <= tol] = index
+
+    detected = (counts >= MIN_TRANSACTIONS) & consistent & (frequency >= 0)
+    last_day = days[starts + counts - 1]
+    return {
+        "user_code": user_codes[starts][detected],
+        "recipient_code": recipient_codes[starts][detected],
+        "amount": np.round(median_amount[detected], 2),
+        "frequency": frequency[detected],
+        "transaction_count": counts[detected],
+        "last_day": last_day[detected],
+        "next_due_day": last_day[detected] + np.rint(median_delta[detected]).astype(np.int64),
+    }
+
+
+# --- 4. CACHE WRITE ---
+def _to_rows(detected, user_ids, recipient_names, computed_at):
+    frequency_names = list(INTERVALS)
+    as_date = lambda day: str(np.datetime64(int(day), 'D'))
+    return [
+        {
+            "user_id": user_ids[detected["user_code"][i]],
+            "recipient": recipient_names[detected["recipient_code"][i]],
+            "amount": float(detected["amount"][i]),
+            "frequency": frequency_names[detected["frequency"][i]],
+            "transaction_count": int(detected["transaction_count"][i]),
+            "last_date": as_date(detected["last_day"][i]),
+            "next_due_date": as_date(detected["next_due_day"][i]),
+            "computed_at": computed_at,
+        }
+        for i in range(len(detected["user_code"]))
+    ]
+
+
+def refresh_upcoming_bills(db: Client):
+    """Recomputes subscriptions for every user and replaces the upcoming_bill cache."""
+    user_ids, recipient_names, user_codes, recipient_codes, days, amounts = fetch_expense_columns(db)
+    print(f"📊 Loaded {len(days)} expenses for {len(user_ids)} users.")
+
+    detected = detect_all(user_codes, recipient_codes, days, amounts)
+    computed_at = datetime.now(timezone.utc).isoformat()
+    rows = _to_rows(detected, user_ids, recipient_names, computed_at)
+
+    for i in range(0, len(rows), PAGE_SIZE):
+        db.table(BILLS_TABLE).upsert(rows[i:i + PAGE_SIZE], on_conflict='user_id,recipient').execute()
+    # Subscriptions that were not detected again in this run are no longer active
+    db.table(BILLS_TABLE).delete().lt('computed_at', computed_at).execute()
+    print(f"✅ Cached {len(rows)} recurring payments.")
+    return len(rows)
+
+
+# --- 5. EXECUTION ---
+def main():
+    print("--- Starting Nightly Recurring Payment Refresh ---")
+    db = initialize_supabase()
+    if not db:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+        return
+    refresh_upcoming_bills(db)
+    print("\n--- Refresh finished. ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 from collections import defaultdict
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 import numpy as np
 from core.setup import initialize_supabase  # Using your custom initializer
 from dateutil.parser import parse as parse_datetime  # For parsing timestamps
+from services import single_flight
 
 # --- 1. SUPABASE INITIALIZATION ---
 DB = initialize_supabase()
@@ -17,33 +18,48 @@ INTERVALS = {
     "yearly": (365, 15),
 }
 
+STATE_TABLE = 'recurring_state'
+RECENT_WINDOW = 6  # Latest amounts/intervals kept per recipient for the running medians
+WRITE_BATCH = 500  # Rows per upsert / recipients per delete when rebuilding
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+
 
 # --- 2. DATA FETCHING (MODIFIED FOR SUPABASE) ---
-def _fetch_user_transactions(user_id):
-    """Fetches all expense transactions for a given user from Supabase."""
+def _fetch_user_transactions(user_id, raise_errors=False):
+    """
+    Fetches all expense transactions for a given user from Supabase, page by page.
+    With `raise_errors` a failed read raises instead of returning [] (a rebuild must
+    not mistake a Supabase error for an empty history).
+    """
     try:
-        # Query the 'transaction' table for 'expense' types
-        response = DB.table('transaction').select('*') \
-            .eq('user_id', user_id) \
-            .eq('payment_type', 'expense') \
-            .execute()
-
         transactions = []
-        if not response.data:
-            return []
-
-        for data in response.data:
-            # Ensure transaction has the necessary fields
-            if all(k in data for k in ['created_at', 'amount', 'sender_name']):
-                try:
-                    # Parse the 'created_at' timestamp string into a date object
-                    data['tx_date'] = parse_datetime(data['created_at']).date()
-                    transactions.append(data)
-                except Exception as e:
-                    print(f"Skipping transaction due to date parse error: {e}")
-
-        return transactions
+        start = 0
+        while True:
+            # Query the 'transaction' table for 'expense' types
+            response = DB.table('transaction').select('created_at, amount, sender_name') \
+                .eq('user_id', user_id) \
+                .eq('payment_type', 'expense') \
+                .order('transaction_id') \
+                .range(start, start + PAGE_SIZE - 1) \
+                .execute()
+            page = response.data or []
+
+            for data in page:
+                # Ensure transaction has the necessary fields
+                if all(k in data for k in ['created_at', 'amount', 'sender_name']):
+                    try:
+                        # Parse the 'created_at' timestamp string into a date object
+                        data['tx_date'] = parse_datetime(data['created_at']).date()
+                        transactions.append(data)
+                    except Exception as e:
+                        print(f"Skipping transaction due to date parse error: {e}")
+
+            if len(page) < PAGE_SIZE:
+                return transactions
+            start += PAGE_SIZE
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error fetching transactions for user {user_id}: {e}")
         return []
 
@@ -105,7 +121,160 @@ def detect_recurring(user_id):
     return detected_recurring
 
 
-# --- 4. EXECUTION (UNCHANGED) ---
+# --- 4. INCREMENTAL STATE ---
+def _match_frequency(median_delta):
+    for name, (avg_days, tolerance) in INTERVALS.items():
+        if abs(median_delta - avg_days) <= tolerance:
+            return name
+    return None
+
+
+def _apply_transaction(state, amount, tx_date):
+    """
+    Folds one expense into a recipient's running state in O(1).
+    Only the last RECENT_WINDOW amounts and intervals are kept, so the medians
+    and the amount-consistency check always look at a bounded window.
+    """
+    last_date = date.fromisoformat(state['last_date']) if state.get('last_date') else None
+
+    state['transaction_count'] += 1
+    state['recent_amounts'] = (state['recent_amounts'] + [amount])[-RECENT_WINDOW:]
+    if last_date is not None and tx_date >= last_date:
+        state['recent_intervals'] = (state['recent_intervals'] + [(tx_date - last_date).days])[-RECENT_WINDOW:]
+    if last_date is None or tx_date > last_date:
+        state['last_date'] = tx_date.isoformat()
+
+    median_amount = float(np.median(state['recent_amounts']))
+    state['amount'] = round(median_amount, 2)
+    state['interval_days'] = float(np.median(state['recent_intervals'])) if state['recent_intervals'] else None
+
+    # Same rules as detect_recurring: enough payments, 80% within the amount tolerance, known interval
+    state['frequency'] = None
+    if state['transaction_count'] >= MIN_TRANSACTIONS and state['interval_days'] is not None:
+        lower_bound = median_amount * (1 - TOLERANCE_PERCENT)
+        upper_bound = median_amount * (1 + TOLERANCE_PERCENT)
+        consistent = [a for a in state['recent_amounts'] if lower_bound <= a <= upper_bound]
+        if len(consistent) / len(state['recent_amounts']) >= 0.8:
+            state['frequency'] = _match_frequency(state['interval_days'])
+
+    state['updated_at'] = datetime.now(timezone.utc).isoformat()
+    return state
+
+
+def _empty_state(user_id, recipient):
+    return {
+        "user_id": user_id,
+        "recipient": recipient,
+        "transaction_count": 0,
+        "last_date": None,
+        "recent_amounts": [],
+        "recent_intervals": [],
+        "amount": None,
+        "interval_days": None,
+        "frequency": None,
+    }
+
+
+def update_recurring_state(user_id, tx):
+    """
+    Intake hook: updates the stored state of the transaction's recipient.
+    One indexed read and one upsert, independent of the user's history size.
+    """
+    if tx.get('payment_type') != 'expense' or tx.get('amount') is None or not tx.get('sender_name'):
+        return None
+    recipient = tx['sender_name']
+    response = DB.table(STATE_TABLE).select('*') \
+        .eq('user_id', user_id) \
+        .eq('recipient', recipient) \
+        .execute()
+    state = response.data[0] if response.data else _empty_state(user_id, recipient)
+
+    state = _apply_transaction(state, float(tx['amount']), parse_datetime(tx['created_at']).date())
+    DB.table(STATE_TABLE).upsert(state, on_conflict='user_id,recipient').execute()
+    return state
+
+
+def _to_recurring(state):
+    return {
+        "recipient": state['recipient'],
+        "amount": state['amount'],
+        "frequency": state['frequency'],
+        "transaction_count": state['transaction_count'],
+    }
+
+
+@single_flight.single_flight("recurring")
+def get_recurring(user_id):
+    """Returns the user's confirmed recurring payments from the precomputed state."""
+    response = DB.table(STATE_TABLE).select('recipient, amount, frequency, transaction_count') \
+        .eq('user_id', user_id) \
+        .not_.is_('frequency', 'null') \
+        .execute()
+    return [_to_recurring(state) for state in response.data or []]
+
+
+def rebuild_recurring_state(user_id):
+    """
+    Repair tool: recomputes every recipient's state from the user's full expense
+    history and replaces the stored rows. New rows are upserted before stale
+    recipients are deleted, so a failure part-way never leaves the user with no state.
+    A failed read raises before anything is written.
+    """
+    transactions = _fetch_user_transactions(user_id, raise_errors=True)
+    transactions.sort(key=lambda tx: tx['tx_date'])
+
+    states = {}
+    for tx in transactions:
+        # Same rule as update_recurring_state: no recipient, nothing to track
+        if tx.get('amount') is None or not tx.get('sender_name'):
+            continue
+        recipient = tx['sender_name']
+        state = states.setdefault(recipient, _empty_state(user_id, recipient))
+        _apply_transaction(state, float(tx['amount']), tx['tx_date'])
+
+    rows = list(states.values())
+    for i in range(0, len(rows), WRITE_BATCH):
+        DB.table(STATE_TABLE).upsert(rows[i:i + WRITE_BATCH], on_conflict='user_id,recipient').execute()
+
+    # Only reached after a complete read of the history and every upsert succeeded
+    stored = []
+    start = 0
+    while True:
+        page = DB.table(STATE_TABLE).select('recipient').eq('user_id', user_id) \
+            .order('recipient') \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute().data or []
+        stored.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+    stale = sorted({row['recipient'] for row in stored if row.get('recipient')} - states.keys())
+    for i in range(0, len(stale), WRITE_BATCH):
+        DB.table(STATE_TABLE).delete().eq('user_id', user_id).in_('recipient', stale[i:i + WRITE_BATCH]).execute()
+    if any(not row.get('recipient') for row in stored):
+        DB.table(STATE_TABLE).delete().eq('user_id', user_id).is_('recipient', 'null').execute()
+        DB.table(STATE_TABLE).delete().eq('user_id', user_id).eq('recipient', '').execute()
+    single_flight.invalidate(user_id)
+    return [_to_recurring(state) for state in states.values() if state['frequency']]
+
+
+@single_flight.single_flight("upcoming_bills")
+def get_upcoming_bills(user_id, days=30):
+    """
+    Returns the user's subscriptions due in the next `days` days, soonest first.
+    Reads the upcoming_bill cache filled nightly by services/recurring_batch.py.
+    """
+    today = date.today()
+    response = DB.table('upcoming_bill').select('recipient, amount, frequency, last_date, next_due_date') \
+        .eq('user_id', user_id) \
+        .gte('next_due_date', today.isoformat()) \
+        .lte('next_due_date', (today + timedelta(days=days)).isoformat()) \
+        .order('next_due_date') \
+        .execute()
+    return response.data or []
+
+
+# --- 5. EXECUTION (UNCHANGED) ---
 if __name__ == '__main__':
     print("--- Starting Recurring Transaction Detector ---")
     if not DB:
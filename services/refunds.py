@@ -0,0 +1,215 @@
+import re
+import threading
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.timezones import as_utc
+from services.pendings import settles_pending
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+REFUND_WINDOW_DAYS = 45  # A credit can only reverse a debit made within this many days
+MAX_DEBITS_PER_USER = 500  # Open debits kept in memory per user (oldest are evicted first)
+MAX_INDEXED_USERS = 50_000  # Users kept in memory per process (LRU)
+PAGE_SIZE = 1000  # Rows fetched / written per Supabase request
+
+# Noise stripped from merchant names before matching, eg "AMAZON PAY INDIA PVT LTD" -> "amazon"
+MERCHANT_NOISE = re.compile(r"\b(pvt|private|ltd|limited|llp|inc|india|payments?|pay|online|services|retail|store)\b")
+
+
+def canonical_merchant(name):
+    """Normalizes a counterparty name so the debit and its refund land on the same key."""
+    name = re.sub(r"[^a-z0-9 ]+", " ", str(name or "").lower())
+    name = MERCHANT_NOISE.sub(" ", name)
+    return " ".join(name.split()) or "unknown"
+
+
+def _key(merchant, amount):
+    # Refunds reverse the exact amount, so the bucket is the amount in paise
+    return canonical_merchant(merchant), int(round(float(amount) * 100))
+
+
+# --- 2. IN-MEMORY INDEX ---
+class RefundIndex:
+    """
+    Per-user index of recent debits keyed by (canonical merchant, amount bucket).
+    Adding a debit and matching a credit are both O(1); expired debits are dropped lazily.
+    """
+
+    def __init__(self, window_days=REFUND_WINDOW_DAYS, max_users=MAX_INDEXED_USERS):
+        self.window = timedelta(days=window_days)
+        self.max_users = max_users
+        self.users = OrderedDict()  # user_id -> (key -> deque[(ts, transaction_id)], deque[(key, transaction_id)] in insertion order)
+        self.lock = threading.Lock()
+
+    def _user(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = (defaultdict(deque), deque())
+            if self.max_users and len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+        return entry
+
+    def has_user(self, user_id):
+        return user_id in self.users
+
+    def drop_user(self, user_id):
+        """Forgets a user so the next transaction re-reads their debits (eg after a bulk import)."""
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def ensure_user(self, user_id):
+        with self.lock:
+            self._user(user_id)
+
+    def add_debit(self, user_id, merchant, amount, ts, transaction_id):
+        with self.lock:
+            buckets, order = self._user(user_id)
+            key = _key(merchant, amount)
+            buckets[key].append((ts, transaction_id))
+            order.append((key, transaction_id))
+            # Entries for debits already matched or expired are left in `order` and skipped here
+            while len(order) > MAX_DEBITS_PER_USER:
+                oldest_key, oldest_id = order.popleft()
+                bucket = buckets.get(oldest_key)
+                if not bucket:
+                    continue
+                for entry in bucket:
+                    if entry[1] == oldest_id:
+                        bucket.remove(entry)
+                        break
+                if not bucket:
+                    del buckets[oldest_key]
+
+    def match_credit(self, user_id, merchant, amount, ts):
+        """
+        Returns the transaction_id of the oldest open debit this credit reverses
+        and removes it from the index, or None when there is no match.
+        """
+        with self.lock:
+            buckets, _ = self._user(user_id)
+            key = _key(merchant, amount)
+            candidates = buckets.get(key)
+            while candidates and ts - candidates[0][0] > self.window:
+                candidates.popleft()
+            if not candidates or candidates[0][0] > ts:
+                return None
+            _, transaction_id = candidates.popleft()
+            if not candidates:
+                del buckets[key]
+            return transaction_id
+
+
+index = RefundIndex()
+
+
+# --- 3. DATABASE HELPERS ---
+def _warm_up(user_id, skip_id=None):
+    """Loads the user's open debits from the refund window the first time we see them."""
+    if index.has_user(user_id):
+        return
+    since = (datetime.now(timezone.utc) - index.window).isoformat()
+    response = DB.table('transaction').select('transaction_id, sender_name, amount, created_at') \
+        .eq('user_id', user_id) \
+        .eq('payment_type', 'expense') \
+        .is_('refunded_by', 'null') \
+        .gte('created_at', since) \
+        .order('created_at') \
+        .execute()
+    index.ensure_user(user_id)
+    for tx in response.data or []:
+        if tx.get('amount') is not None and tx['transaction_id'] != skip_id:
+            index.add_debit(user_id, tx['sender_name'], tx['amount'], as_utc(tx['created_at']), tx['transaction_id'])
+
+
+def _tag_pair(debit_id, credit_id):
+    DB.table('transaction').update({"refunded_by": credit_id}).eq('transaction_id', debit_id).execute()
+    DB.table('transaction').update({"refund_of": debit_id}).eq('transaction_id', credit_id).execute()
+
+
+# --- 4. INTAKE HOOK ---
+def process_transaction(user_id, tx):
+    """
+    Called after a transaction is inserted. Debits are indexed; credits are matched
+    against the index and, on a hit, both rows are tagged. A credit that pays off an
+    open pending item is a repayment: pending reconciliation handles it, not this.
+
+    Returns:
+        int or None: the transaction_id of the reversed debit for a matched credit.
+    """
+    if tx.get('amount') is None or tx.get('transaction_id') is None:
+        return None
+    _warm_up(user_id, skip_id=tx['transaction_id'])
+    ts = as_utc(tx['created_at'])
+
+    if tx.get('payment_type') == 'expense':
+        index.add_debit(user_id, tx.get('sender_name'), tx['amount'], ts, tx['transaction_id'])
+        return None
+
+    if tx.get('payment_type') == 'income':
+        if settles_pending(user_id, tx):
+            return None
+        debit_id = index.match_credit(user_id, tx.get('sender_name'), tx['amount'], ts)
+        if debit_id is not None:
+            _tag_pair(debit_id, tx['transaction_id'])
+            print(f"↩️ Refund matched: credit #{tx['transaction_id']} reverses debit #{debit_id}.")
+        return debit_id
+    return None
+
+
+# --- 5. BACKFILL ---
+def backfill_refunds(user_id=None):
+    """
+    Replays existing transactions in time order through a fresh index and tags every
+    refund pair found. Limit it to one user with `user_id`, or run it for everyone.
+
+    Returns:
+        int: number of matched pairs.
+    """
+    replay = RefundIndex(max_users=None)  # The replay must not forget users mid-scan
+    pairs = []
+    start = 0
+    while True:
+        query = DB.table('transaction') \
+            .select('transaction_id, user_id, sender_name, amount, payment_type, created_at') \
+            .is_('refund_of', 'null') \
+            .is_('refunded_by', 'null')
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        page = query.order('created_at').order('transaction_id') \
+            .range(start, start + PAGE_SIZE - 1).execute().data or []
+
+        for tx in page:
+            if tx.get('amount') is None:
+                continue
+            ts = as_utc(tx['created_at'])
+            if tx.get('payment_type') == 'expense':
+                replay.add_debit(tx['user_id'], tx['sender_name'], tx['amount'], ts, tx['transaction_id'])
+            elif tx.get('payment_type') == 'income':
+                if settles_pending(tx['user_id'], tx):  # Same exclusion as process_transaction
+                    continue
+                debit_id = replay.match_credit(tx['user_id'], tx['sender_name'], tx['amount'], ts)
+                if debit_id is not None:
+                    pairs.append((debit_id, tx['transaction_id']))
+
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+    # Rows are tagged after the scan so the pages being read do not shift underneath us
+    for debit_id, credit_id in pairs:
+        _tag_pair(debit_id, credit_id)
+    print(f"✅ Backfill tagged {len(pairs)} refund pairs.")
+    return len(pairs)
+
+
+if __name__ == '__main__':
+    print("--- Starting Refund Backfill ---")
+    if not DB:
+        print("Halting: Supabase DB not initialized. Check core.setup and .env file.")
+    else:
+        backfill_refunds()
+    print("\n--- Backfill finished. ---")
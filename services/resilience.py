@@ -0,0 +1,233 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from services.metrics import metrics
+
+try:
+    from postgrest.exceptions import APIError  # A query error is an answer, not an outage
+except ImportError:
+    APIError = None
+
+# --- 1. SETTINGS ---
+CALL_WORKERS = 64  # Threads that run guarded calls (so a caller can stop waiting at its deadline)
+
+# name: (deadline in seconds, failures that open the breaker, seconds the breaker stays open, hedge delay or None)
+DEPENDENCIES = {
+    "supabase": (5.0, 5, 15.0, 0.25),
+    "gemini": (30.0, 3, 30.0, None),
+}
+
+
+class DeadlineExceeded(Exception):
+    """The dependency did not answer within its deadline."""
+
+
+class CircuitOpen(Exception):
+    """The dependency is failing; calls are refused until the breaker's next probe."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# A call abandoned at its deadline is not cancelled: it keeps running and keeps one of the
+# CALL_WORKERS threads until the client returns, so a hung dependency can drain this pool.
+pool = ThreadPoolExecutor(max_workers=CALL_WORKERS, thread_name_prefix="resilience")
+
+
+def is_rejected(error):
+    """
+    True when PostgREST answered with an error, so nothing was written. A timeout or a
+    connection reset is ambiguous instead: the write may have committed.
+    """
+    return APIError is not None and isinstance(error, APIError)
+
+
+def is_unique_violation(error):
+    """True for a PostgREST error caused by a unique index (the row is already there)."""
+    return getattr(error, 'code', None) == '23505'
+
+
+# --- 2. CIRCUIT BREAKER ---
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open -> half-open after
+    `reset_after` seconds, where a single probe call is let through: success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, name, threshold, reset_after, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.gauge(f"resilience.{self.name}.breaker_open", int(state != "closed"))
+        metrics.increment(f"resilience.{self.name}.breaker_{state}")
+
+    def allow(self):
+        """Raises CircuitOpen unless the call may go ahead."""
+        with self.lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_after - self.clock()
+            if self.state == "open" and remaining <= 0:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return
+            raise CircuitOpen(self.name, max(1, math.ceil(remaining)))
+
+    def release(self):
+        """Ends a call that proved nothing (the caller went away): frees the probe slot, counts nothing."""
+        with self.lock:
+            self.probing = False
+
+    def record(self, success):
+        with self.lock:
+            self.probing = False
+            if success:
+                self.failures = 0
+                if self.state != "closed":
+                    self._set_state("closed")
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+                if self.state != "open":
+                    self._set_state("open")
+
+
+# --- 3. DEPENDENCY GUARD ---
+class Dependency:
+    """Deadline + circuit breaker (+ optional hedging) around calls to one upstream."""
+
+    def __init__(self, name, timeout, threshold, reset_after, hedge_after=None, healthy_errors=()):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.healthy_errors = healthy_errors  # Errors that prove the upstream is up (eg a bad query)
+        self.breaker = CircuitBreaker(name, threshold, reset_after)
+
+    def _finish(self, started, success):
+        self.breaker.record(success)
+        metrics.observe(f"resilience.{self.name}.call_seconds", time.perf_counter() - started)
+        if not success:
+            metrics.increment(f"resilience.{self.name}.failures")
+
+    def call(self, fn, timeout=None, hedge=False):
+        """
+        Runs fn() under the dependency's deadline. With `hedge` (idempotent reads only),
+        a second identical attempt is started if the first is still running after
+        `hedge_after` seconds, and whichever answers first wins.
+        """
+        self.breaker.allow()
+        timeout = timeout or self.timeout
+        started = time.perf_counter()
+        try:
+            if hedge and self.hedge_after is not None:
+                result = self._hedged(fn, timeout)
+            else:
+                try:
+                    result = pool.submit(fn).result(timeout=timeout)
+                except FutureTimeout:
+                    raise DeadlineExceeded(f"{self.name} call exceeded {timeout}s") from None
+        except Exception as e:
+            self._finish(started, isinstance(e, self.healthy_errors))
+            raise
+        self._finish(started, True)
+        return result
+
+    def _hedged(self, fn, timeout):
+        deadline = time.perf_counter() + timeout
+        attempts = [pool.submit(fn)]
+        done, _ = wait(attempts, timeout=min(self.hedge_after, timeout))
+        if not done:
+            metrics.increment(f"resilience.{self.name}.hedged")
+            attempts.append(pool.submit(fn))
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not attempts[0]:
+                        metrics.increment(f"resilience.{self.name}.hedge_won")
+                    return attempt.result()
+                error = attempt.exception()
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"{self.name} call exceeded {timeout}s")
+
+    @contextmanager
+    def track(self):
+        """Breaker bookkeeping only, for calls that enforce their own deadline (eg streams)."""
+        self.breaker.allow()
+        started = time.perf_counter()
+        try:
+            yield
+        except (GeneratorExit, asyncio.CancelledError):
+            self.breaker.release()  # The caller went away; says nothing about the dependency
+            raise
+        except Exception as e:
+            self._finish(started, isinstance(e, self.healthy_errors))
+            raise
+        self._finish(started, True)
+
+
+supabase = Dependency("supabase", *DEPENDENCIES["supabase"], healthy_errors=(APIError,) if APIError else ())
+gemini = Dependency("gemini", *DEPENDENCIES["gemini"])
+dependencies = {"supabase": supabase, "gemini": gemini}
+
+
+# --- 4. SUPABASE CLIENT WRAPPER ---
+class ResilientQuery:
+    """Wraps a postgrest request builder; `.execute()` goes through the supabase guard."""
+
+    def __init__(self, builder, dependency):
+        self._builder = builder
+        self._dependency = dependency
+
+    def _wrap(self, value):
+        return ResilientQuery(value, self._dependency) if hasattr(value, 'execute') else value
+
+    def __getattr__(self, name):
+        value = getattr(self._builder, name)
+        if not callable(value):
+            return self._wrap(value)  # eg the `.not_` property
+
+        def method(*args, **kwargs):
+            return self._wrap(value(*args, **kwargs))
+        return method
+
+    def execute(self):
+        # Only plain GET selects are idempotent enough to send twice
+        idempotent = getattr(self._builder, 'http_method', None) == 'GET'
+        return self._dependency.call(self._builder.execute, hedge=idempotent)
+
+
+class ResilientClient:
+    """Supabase client whose table queries run with a deadline, a breaker and hedged selects."""
+
+    def __init__(self, client, dependency=supabase):
+        self._client = client
+        self._dependency = dependency
+
+    def table(self, name):
+        return ResilientQuery(self._client.table(name), self._dependency)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
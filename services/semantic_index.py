@@ -0,0 +1,342 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timedelta
+import numpy as np
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.timezones import LOCAL_TIMEZONE, as_local
+from services.metrics import metrics
+from services.work_queue import queue as work_queue
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+DIM = 256  # Hashed char-n-gram features per vector
+NGRAM = 3
+BRUTE_FORCE_BELOW = 4_000  # Smaller indexes are scanned exactly
+PROBES = 8  # Inverted lists scanned per query once the index is clustered
+KMEANS_ITERATIONS = 6
+KMEANS_SAMPLE = 20_000  # Vectors used to train the centroids
+RETRAIN_GROWTH = 2.0  # Centroids are retrained when the index has grown by this factor
+MAX_INDEXED_ROWS = 250_000  # Allocated index rows per process across all users (LRU by user), ~1.5 KiB each
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+MIN_SCORE = 0.15  # Cosine similarity below this is not considered relevant
+COLUMNS = 'transaction_id, created_at, amount, sender_name, category, message, payment_type'
+
+NOISE_DIGITS = re.compile(r"\d{6,}")
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+# --- 2. EMBEDDING ---
+@lru_cache(maxsize=100_000)
+def _word_hashes(word):
+    padded = f" {word} "
+    hashes = [zlib.crc32(padded.encode())]  # Whole-word feature
+    hashes.extend(zlib.crc32(padded[i:i + NGRAM].encode()) for i in range(len(padded) - NGRAM + 1))
+    return hashes
+
+
+def _ngram_hashes(text):
+    hashes = []
+    # Long digit runs are reference / account numbers: unique per SMS, so pure noise here
+    for word in re.findall(r"[a-z]+|\d{1,5}(?!\d)", NOISE_DIGITS.sub(" ", text.lower())):
+        hashes.extend(_word_hashes(word))
+    return hashes
+
+
+def embed(texts):
+    """
+    Hashing vectorizer over character trigrams (plus whole words): no vocabulary, no
+    network, stable across processes. Returns L2-normalized float32 rows.
+    """
+    rows, hashes = [], []
+    for row, text in enumerate(texts):
+        text_hashes = _ngram_hashes(text)
+        rows.extend([row] * len(text_hashes))
+        hashes.extend(text_hashes)
+    hashes = np.asarray(hashes, dtype=np.uint32)
+    # Low bits pick the slot, the top bit picks the sign (reduces collision bias)
+    slots = np.asarray(rows, dtype=np.intp) * DIM + (hashes % DIM).astype(np.intp)
+    signs = np.where(hashes >> np.uint32(31), 1.0, -1.0)
+    vectors = np.bincount(slots, weights=signs, minlength=len(texts) * DIM) \
+        .astype(np.float32).reshape(len(texts), DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def transaction_text(tx, created_at=None):
+    """The searchable text of a transaction: merchant, category, SMS text and (local) weekday."""
+    created_at = created_at or (as_local(tx['created_at']) if tx.get('created_at') else None)
+    weekday = WEEKDAYS[created_at.weekday()] if created_at else ""
+    return " ".join(str(part) for part in (
+        tx.get('sender_name'), tx.get('category'), tx.get('message'), tx.get('payment_type'), weekday,
+    ) if part)
+
+
+# --- 3. INDEX ---
+class UserIndex:
+    """
+    One user's vectors with an IVF (inverted file) structure on top: vectors are
+    clustered around ~sqrt(n) centroids and a query only scans the PROBES closest lists.
+    """
+
+    def __init__(self):
+        self.vectors = np.zeros((0, DIM), dtype=np.float32)
+        self.size = 0
+        self.ids = set()  # transaction_ids already indexed (intake and a cold load can overlap)
+        self.rows = []  # Compact copies of the indexed transactions, for the results
+        self.days = np.zeros(0, dtype=np.int64)  # created_at as local date ordinals, for date filters
+        self.centroids = None
+        self.labels = np.zeros(0, dtype=np.int32)  # Closest centroid of every vector
+        self.order = None  # Positions sorted by label; list c is order[offsets[c]:offsets[c + 1]]
+        self.offsets = None
+        self.trained_size = 0
+        self.lock = threading.Lock()
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.vectors):
+            return
+        capacity = max(needed, 2 * len(self.vectors), 256)
+        vectors = np.zeros((capacity, DIM), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        days = np.zeros(capacity, dtype=np.int64)
+        days[:self.size] = self.days[:self.size]
+        labels = np.zeros(capacity, dtype=np.int32)
+        labels[:self.size] = self.labels[:self.size]
+        self.vectors, self.days, self.labels = vectors, days, labels
+
+    def add(self, transactions):
+        created = [as_local(tx['created_at']) if tx.get('created_at') else None for tx in transactions]
+        vectors = embed([transaction_text(tx, ts) for tx, ts in zip(transactions, created)])
+        with self.lock:
+            keep = [i for i, tx in enumerate(transactions)
+                    if tx.get('transaction_id') is not None and tx['transaction_id'] not in self.ids]
+            if not keep:
+                return 0
+            transactions, vectors = [transactions[i] for i in keep], vectors[keep]
+            created = [created[i] for i in keep]
+            start = self.size
+            self._reserve(len(transactions))
+            self.vectors[start:start + len(transactions)] = vectors
+            for offset, (tx, ts) in enumerate(zip(transactions, created)):
+                self.days[start + offset] = ts.date().toordinal() if ts else 0
+                self.ids.add(tx['transaction_id'])
+                self.rows.append({key: tx.get(key) for key in ('transaction_id', 'created_at', 'amount', 'sender_name', 'category', 'message')})
+            self.size += len(transactions)
+
+            if self.size >= BRUTE_FORCE_BELOW and self.size >= self.trained_size * RETRAIN_GROWTH:
+                self._train()
+            elif self.centroids is not None:
+                self.labels[start:self.size] = np.argmax(vectors @ self.centroids.T, axis=1)
+                self.order = None  # Lists are regrouped lazily on the next search
+            return len(transactions)
+
+    def _train(self):
+        """Spherical k-means on a sample, then every vector is assigned to its closest centroid."""
+        data = self.vectors[:self.size]
+        n_lists = int(np.sqrt(self.size))
+        rng = np.random.default_rng(0)
+        sample = data[rng.choice(self.size, min(self.size, KMEANS_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind='stable')
+            present, starts = np.unique(labels[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids
+        self.labels[:self.size] = np.argmax(data @ centroids.T, axis=1)
+        self.order = None
+        self.trained_size = self.size
+
+    def _group(self):
+        labels = self.labels[:self.size]
+        self.order = np.argsort(labels, kind='stable')
+        self.offsets = np.searchsorted(labels[self.order], np.arange(len(self.centroids) + 1))
+
+    @property
+    def capacity(self):
+        """Allocated rows (_reserve over-allocates up to 2x): what the index actually holds in memory."""
+        return len(self.vectors)
+
+    @property
+    def n_lists(self):
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def search(self, query_vector, k, day_range=None):
+        with self.lock:
+            if self.size == 0:
+                return []
+            if day_range is not None:
+                # A few days of rows are cheap to score exactly
+                days = self.days[:self.size]
+                candidates = np.flatnonzero((days >= day_range[0]) & (days <= day_range[1]))
+            elif self.centroids is None:
+                candidates = np.arange(self.size)
+            else:
+                if self.order is None:
+                    self._group()
+                closest = np.argpartition(-(self.centroids @ query_vector), PROBES)[:PROBES]
+                candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in closest])
+            if candidates.size == 0:
+                return []
+            scores = self.vectors[candidates] @ query_vector
+            top = np.argsort(-scores)[:k] if scores.size <= k else np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.rows[candidates[i]]) for i in top if scores[i] >= MIN_SCORE]
+
+
+class SemanticIndex:
+    """
+    Per-user indexes, built from Supabase on the work queue and kept current by intake.
+    Bounded by the total number of allocated index rows: the least recently used users go first.
+    """
+
+    def __init__(self, max_rows=MAX_INDEXED_ROWS):
+        self.max_rows = max_rows
+        self.users = OrderedDict()
+        self.rows = 0  # Sum of `counted`
+        self.counted = {}  # user_id -> the capacity last counted in `rows` for their index
+        self.lock = threading.Lock()
+
+    def _load(self, user_id):
+        index = UserIndex()
+        start = 0
+        while True:
+            page = DB.table('transaction').select(COLUMNS) \
+                .eq('user_id', user_id) \
+                .order('transaction_id') \
+                .range(start, start + PAGE_SIZE - 1) \
+                .execute().data or []
+            index.add(page)
+            if len(page) < PAGE_SIZE:
+                return index
+            start += PAGE_SIZE
+
+    def _evict(self):
+        # The most recent user stays even if their index alone is over the budget
+        while self.rows > self.max_rows and len(self.users) > 1:
+            user_id, _ = self.users.popitem(last=False)
+            self.rows -= self.counted.pop(user_id)
+            metrics.increment("semantic_index.evicted")
+        metrics.gauge("semantic_index.rows", self.rows)
+
+    def _count(self, user_id, index):
+        # The arrays grow in steps, so the change since the last count, not the rows added
+        capacity = index.capacity
+        self.rows += capacity - self.counted.get(user_id, 0)
+        self.counted[user_id] = capacity
+
+    def get(self, user_id):
+        """The user's index, or None when it is not in memory (see build)."""
+        with self.lock:
+            index = self.users.get(user_id)
+            if index is not None:
+                self.users.move_to_end(user_id)
+            return index
+
+    def build(self, user_id):
+        """Loads the user's index from Supabase unless it is already in memory. Runs on the work queue."""
+        if self.get(user_id) is not None:
+            return
+        index = self._load(user_id)
+        with self.lock:
+            if user_id not in self.users:
+                self.users[user_id] = index
+                self._count(user_id, index)
+                self._evict()
+
+    def add(self, user_id, transactions):
+        index = self.get(user_id)
+        if index is None:
+            return
+        if not index.add(transactions):
+            return
+        with self.lock:
+            if self.users.get(user_id) is index:  # Not evicted or dropped meanwhile
+                self._count(user_id, index)
+                self._evict()
+
+    def drop(self, user_id):
+        with self.lock:
+            if self.users.pop(user_id, None) is not None:
+                self.rows -= self.counted.pop(user_id)
+
+
+semantic_index = SemanticIndex()
+
+
+# --- 4. QUERIES ---
+def date_range_hint(query, today=None):
+    """Turns 'today', 'yesterday', 'last tuesday', 'this/last week' into a (first, last) ordinal day range."""
+    today = today or datetime.now(LOCAL_TIMEZONE).date()
+    text = query.lower()
+    if "yesterday" in text:
+        day = today - timedelta(days=1)
+        return day.toordinal(), day.toordinal()
+    if "today" in text:
+        return today.toordinal(), today.toordinal()
+    if "last week" in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start.toordinal(), (start + timedelta(days=6)).toordinal()
+    if "this week" in text:
+        start = today - timedelta(days=today.weekday())
+        return start.toordinal(), today.toordinal()
+    match = re.search(r"\b(last|this|on)?\s*(" + "|".join(WEEKDAYS) + r")\b", text)
+    if match:
+        # Most recent such weekday before today ("last tuesday" said on a tuesday means a week ago)
+        back = (today.weekday() - WEEKDAYS.index(match.group(2))) % 7 or 7
+        day = today - timedelta(days=back)
+        return day.toordinal(), day.toordinal()
+    return None
+
+
+def add_transaction(user_id, tx):
+    """Intake hook: indexes the new row if the user's index is already in memory."""
+    semantic_index.add(user_id, [tx])
+
+
+def invalidate(user_id):
+    """Drops the user's in-memory index; it is rebuilt on the work queue after the next search."""
+    semantic_index.drop(user_id)
+
+
+def search(user_id, query, k=5):
+    """
+    Returns up to k of the user's transactions most similar to `query`, best first,
+    as (score, row) pairs. Date words in the query narrow the search to those days.
+
+    Returns None while the user's index is not in memory: loading it reads their whole
+    history, so it is queued on the work queue instead of running inside the request.
+    """
+    index = semantic_index.get(user_id)
+    if index is None:
+        metrics.increment("semantic_index.cold")
+        try:
+            work_queue.submit(user_id, "semantic_index_build", semantic_index.build, user_id, coalesce=True)
+            return None
+        except RuntimeError:
+            # No event loop (scripts, experiments): there is no request to keep responsive
+            semantic_index.build(user_id)
+            index = semantic_index.get(user_id)
+    day_range = date_range_hint(query)
+    results = index.search(embed([query])[0], k, day_range)
+    if not results and day_range is not None:
+        results = index.search(embed([query])[0], k)  # The date hint was wrong or too narrow
+    return results
+
+
+def format_results(results):
+    """Compact one-line-per-row text for prompts."""
+    return "\n".join(
+        f"- {row['created_at'][:10] if row.get('created_at') else ''} ₹{row.get('amount')} "
+        f"{row.get('sender_name') or ''} [{row.get('category') or 'Uncategorized'}] {row.get('message') or ''}".strip()
+        for _, row in results
+    )
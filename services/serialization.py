@@ -0,0 +1,156 @@
+import contextvars
+import dataclasses
+import datetime
+import decimal
+import gzip
+import uuid
+import brotli
+import msgpack
+import orjson
+from fastapi.responses import JSONResponse
+
+# --- 1. SETTINGS ---
+COMPRESS_ABOVE_BYTES = 1024  # Smaller bodies fit in a packet or two; compressing them only costs CPU
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # Brotli's fast end still beats gzip -6 on JSON
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+# --- 2. ENCODERS ---
+def _default(value):
+    """Types orjson / msgpack / json don't know natively."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    if hasattr(value, "tolist"):  # numpy arrays and scalars
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps_json(payload):
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def dumps_msgpack(payload):
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+ENCODERS = {JSON: dumps_json, MSGPACK: dumps_msgpack}
+
+
+# --- 3. CONTENT NEGOTIATION ---
+_request_headers = contextvars.ContextVar("request_headers", default=None)  # (accept, accept-encoding)
+
+
+def negotiate_type(accept):
+    """MessagePack when the client asks for it, JSON otherwise."""
+    if accept and any(kind in accept for kind in MSGPACK_TYPES):
+        return MSGPACK
+    return JSON
+
+
+def _qualities(header):
+    """'br;q=0, gzip' -> {'br': 0.0, 'gzip': 1.0}. A malformed q counts as 0 (not acceptable)."""
+    qualities = {}
+    for part in (header or "").lower().split(","):
+        name, *params = [piece.strip() for piece in part.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    return qualities
+
+
+def negotiate_encoding(accept_encoding):
+    """The client's highest-q encoding we support (br on a tie); q=0 means 'never send this'."""
+    qualities = _qualities(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in ("br", "gzip"):
+        q = qualities.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class NegotiationMiddleware:
+    """Pure ASGI middleware: exposes the request's Accept headers to APIResponse (any thread, any route)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept":
+                accept = value.decode("latin-1")
+            elif name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        token = _request_headers.set((accept, accept_encoding))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_headers.reset(token)
+
+
+# --- 4. RESPONSES ---
+class APIResponse(JSONResponse):
+    """
+    Default response class: JSON through orjson, or MessagePack for clients that send
+    `Accept: application/msgpack`; bodies over COMPRESS_ABOVE_BYTES are brotli- or
+    gzip-compressed per Accept-Encoding.
+    """
+
+    media_type = JSON
+
+    def __init__(self, content=None, status_code=200, headers=None, media_type=None, background=None):
+        accept, accept_encoding = _request_headers.get() or (None, None)
+        self.media_type = media_type or negotiate_type(accept)
+        self.encoding = negotiate_encoding(accept_encoding)
+        super().__init__(content, status_code, headers, self.media_type, background)
+        self.headers["Vary"] = "Accept, Accept-Encoding"
+        if self.encoding and len(self.body) > COMPRESS_ABOVE_BYTES and "content-encoding" not in self.headers:
+            self.body = compress(self.body, self.encoding)
+            self.headers["Content-Encoding"] = self.encoding
+            self.headers["Content-Length"] = str(len(self.body))
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return ENCODERS.get(self.media_type, dumps_json)(content)
+
+
+def respond(content, status_code=200, headers=None):
+    """
+    Returns rows as they came from Supabase without FastAPI's per-item jsonable_encoder
+    pass (or response_model validation): use it for large lists. Document the shape with
+    `responses={200: {"model": ...}}` on the route instead of `response_model`.
+    """
+    return APIResponse(content, status_code=status_code, headers=headers)
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from services.metrics import metrics
+
+# --- 1. SETTINGS ---
+RESULT_TTL_SECONDS = 5.0  # Covers the burst of identical requests when the app opens
+MAX_CACHED_USERS = 5_000
+
+
+# --- 2. SINGLE FLIGHT ---
+class SingleFlight:
+    """
+    Concurrent identical calls (same function and arguments) share one computation, and
+    its result is reused for a few seconds. Keyed per user (the first argument), so a
+    user's results can be dropped together when their data changes.
+
+    The in-flight computation is a concurrent.futures.Future: threadpool callers block
+    on it, async callers await it, and either kind can be the one that computes.
+    Results are shared between callers: treat them as read-only.
+    """
+
+    def __init__(self, ttl=RESULT_TTL_SECONDS, max_users=MAX_CACHED_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.users = OrderedDict()  # user_id -> {key: (expires_at, value)}
+        self.flights = {}  # key -> Future of the running computation
+        self.tasks = set()  # Running coroutine computations (strong references)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, args, kwargs):
+        return (name, args, tuple(sorted(kwargs.items())))
+
+    def _begin(self, key, user_id):
+        """Returns ("hit", value), ("coalesced", flight) to wait on, or ("computed", flight) to fill."""
+        with self.lock:
+            entries = self.users.get(user_id)
+            entry = entries.get(key) if entries else None
+            if entry is not None and entry[0] >= time.monotonic():
+                self.users.move_to_end(user_id)
+                return "hit", entry[1]
+            flight = self.flights.get(key)
+            if flight is not None:
+                return "coalesced", flight
+            flight = Future()
+            flight.user_id = user_id
+            flight.stale = False  # Set by invalidate(): the result must not be cached
+            self.flights[key] = flight
+            return "computed", flight
+
+    def _finish(self, key, flight, ttl, value=None, error=None):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            if error is None and not flight.stale:
+                entries = self.users.setdefault(flight.user_id, {})
+                entries[key] = (time.monotonic() + ttl, value)
+                self.users.move_to_end(flight.user_id)
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+        if flight.done():
+            return
+        if error is None:
+            flight.set_result(value)
+        else:
+            flight.set_exception(error)
+
+    def _run(self, key, flight, fn, args, kwargs, ttl):
+        started = time.perf_counter()
+        try:
+            value = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, flight, ttl, error=e)
+        else:
+            self._finish(key, flight, ttl, value)
+        metrics.observe(f"single_flight.seconds.{key[0]}", time.perf_counter() - started)
+
+    async def _run_async(self, key, flight, fn, args, kwargs, ttl):
+        started = time.perf_counter()
+        try:
+            value = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, flight, ttl, error=e)
+        else:
+            self._finish(key, flight, ttl, value)
+        metrics.observe(f"single_flight.seconds.{key[0]}", time.perf_counter() - started)
+
+    def _count(self, name, outcome):
+        metrics.increment(f"single_flight.{outcome}.{name}")  # hit / coalesced / computed
+
+    def call(self, name, fn, args, kwargs, ttl=None):
+        """From a sync caller (e.g. a threadpool endpoint): blocks until the shared result is ready."""
+        key = self._key(name, args, kwargs)
+        outcome, value = self._begin(key, args[0])
+        self._count(name, outcome)
+        if outcome == "hit":
+            return value
+        if outcome == "computed":
+            self._run(key, value, fn, args, kwargs, self.ttl if ttl is None else ttl)
+        return value.result()
+
+    async def call_async(self, name, fn, args, kwargs, ttl=None):
+        """
+        From the event loop. A sync `fn` runs on the default executor. The computation
+        doesn't belong to the caller that started it: a cancelled caller doesn't cancel it
+        for the others.
+        """
+        key = self._key(name, args, kwargs)
+        outcome, value = self._begin(key, args[0])
+        self._count(name, outcome)
+        if outcome == "hit":
+            return value
+        if outcome == "computed":
+            ttl = self.ttl if ttl is None else ttl
+            loop = asyncio.get_running_loop()
+            if inspect.iscoroutinefunction(fn):
+                task = loop.create_task(self._run_async(key, value, fn, args, kwargs, ttl))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            else:
+                loop.run_in_executor(None, self._run, key, value, fn, args, kwargs, ttl)
+        return await asyncio.shield(asyncio.wrap_future(value))
+
+    def invalidate(self, user_id):
+        """Drops the user's results; computations already running are not cached when they finish."""
+        with self.lock:
+            self.users.pop(user_id, None)
+            for key, flight in list(self.flights.items()):
+                if flight.user_id == user_id:
+                    flight.stale = True
+                    del self.flights[key]
+
+
+flights = SingleFlight()
+
+
+def single_flight(name, ttl=None):
+    """
+    Decorator for per-user reads whose first argument is the user_id. Sync functions keep
+    a sync signature and gain `.aio(...)` for async callers; async functions stay async.
+    The undecorated function is available as `.uncached`.
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        def bind(args, kwargs):
+            # f(u), f(u, 30) and f(u, days=30) are the same call
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return bound.args, bound.kwargs
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                return await flights.call_async(name, fn, *bind(args, kwargs), ttl)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                return flights.call(name, fn, *bind(args, kwargs), ttl)
+
+            async def aio(*args, **kwargs):
+                return await flights.call_async(name, fn, *bind(args, kwargs), ttl)
+            wrapper.aio = aio
+        wrapper.uncached = fn
+        return wrapper
+    return decorate
+
+
+def invalidate(user_id):
+    """Intake / sync hook: the user's next reads recompute instead of returning cached results."""
+    flights.invalidate(user_id)
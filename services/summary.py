@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+from services.timezones import as_utc
+from services.agent_tools import period_range
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+SUMMARY_TABLE = 'summary'
+PAGE_SIZE = 1000  # Rows fetched per Supabase request
+
+# summary column prefix -> calendar period (in services.timezones.LOCAL_TIMEZONE)
+PERIODS = {"day": "today", "week": "this_week", "month": "this_month", "year": "this_year"}
+
+
+# --- 2. SUMMARY ---
+def compute_summary(rows, now=None):
+    """Spending, income and cashflow of the current day, week, month and year."""
+    now = now or datetime.now(timezone.utc)
+    starts = {prefix: period_range(period, now)[0] for prefix, period in PERIODS.items()}
+    summary = {f"{prefix}_{kind}": 0.0 for prefix in PERIODS for kind in ("out", "in", "cashflow")}
+    for tx in rows:
+        if tx.get('amount') is None or not tx.get('created_at'):
+            continue
+        ts = as_utc(tx['created_at'])
+        kind = "out" if tx.get('payment_type') == 'expense' else "in"
+        for prefix, start in starts.items():
+            if ts >= start:
+                summary[f"{prefix}_{kind}"] += float(tx['amount'])
+    for prefix in PERIODS:
+        summary[f"{prefix}_cashflow"] = summary[f"{prefix}_in"] - summary[f"{prefix}_out"]
+    return {key: round(value, 2) for key, value in summary.items()}
+
+
+def refresh_summary(user_id):
+    """Recomputes the user's summary row from this year's transactions (refund pairs excluded)."""
+    since = period_range("this_year")[0].isoformat()
+    rows = []
+    start = 0
+    while True:
+        page = DB.table('transaction').select('amount, payment_type, created_at') \
+            .eq('user_id', user_id) \
+            .gte('created_at', since) \
+            .is_('refund_of', 'null') \
+            .is_('refunded_by', 'null') \
+            .order('transaction_id') \
+            .range(start, start + PAGE_SIZE - 1) \
+            .execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+    summary = compute_summary(rows)
+    DB.table(SUMMARY_TABLE).upsert(dict(summary, user_id=user_id), on_conflict='user_id').execute()
+    return summary
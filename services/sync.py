@@ -0,0 +1,348 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from core.setup import initialize_supabase  # Using your custom initializer
+from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+from services import pendings
+from services import semantic_index
+from services import agent_tools
+from services import single_flight
+from services.digest import mark_stale as mark_digest_stale
+from services.summary import refresh_summary
+from services.intake_jobs import enqueue_followups
+from services.work_queue import queue as work_queue
+from services.metrics import metrics
+from services.resilience import is_unique_violation
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+TOMBSTONE_TABLE = 'sync_tombstone'
+PUSH_LOG_TABLE = 'sync_push'
+MAX_PULL_ROWS = 500  # Changed rows (plus tombstones) per table per pull page
+MAX_PUSH_CHANGES = 500
+SETTLE_SECONDS = 2.0  # Versions newer than this may still have lower-numbered writes in flight
+MAX_REMEMBERED_PUSHES = 10_000  # Push results kept in memory in front of the table (retries)
+STALE_CLAIM_SECONDS = 120  # A batch still "running" after this long was abandoned (crash): a retry takes it over
+
+# Synced tables: primary key, and the columns a client may change on an existing row.
+# Client-owned columns are merged over concurrent server changes (the user's edit wins);
+# every other column is server-owned and a client value for it is ignored.
+TABLES = {
+    "transaction": {"key": "transaction_id", "client_owned": ("category", "anomaly", "sender_name", "message")},
+    "limit": {"key": "user_id", "client_owned": ("daily", "weekly", "monthly", "yearly")},
+    "pending": {"key": "pending_id", "client_owned": ()},  # Changed through settle/delete only
+    "summary": {"key": "user_id", "client_owned": ()},  # Derived on the server; pull only
+}
+TRANSACTION_INSERT_COLUMNS = ("created_at", "day", "amount", "sender_name", "payment_method",
+                              "payment_type", "category", "message", "anomaly")
+
+
+class SyncError(Exception):
+    """A malformed pull or push request; mapped to 400."""
+
+
+class PushInProgress(Exception):
+    """The same batch is being applied by another request; mapped to 409 (retry later)."""
+
+
+# --- 2. PULL ---
+def _changed_rows(table, user_id, cursor, limit):
+    return DB.table(table).select('*') \
+        .eq('user_id', user_id) \
+        .gt('sync_version', cursor) \
+        .order('sync_version') \
+        .limit(limit) \
+        .execute().data or []
+
+
+def _tombstones(user_id, cursor, limit):
+    return DB.table(TOMBSTONE_TABLE).select('table_name, row_key, sync_version, deleted_at') \
+        .eq('user_id', user_id) \
+        .gt('sync_version', cursor) \
+        .order('sync_version') \
+        .limit(limit) \
+        .execute().data or []
+
+
+def _is_settled(row, settled_before):
+    stamp = row.get('updated_at') or row.get('deleted_at')
+    return stamp is None or parse_datetime(stamp) <= settled_before
+
+
+def pull(user_id, cursor=0, limit=MAX_PULL_ROWS, now=None):
+    """
+    Everything about the user that changed after `cursor`: changed rows per table and
+    tombstones (table -> deleted keys). Pass the returned cursor to the next pull; while
+    `has_more` is set, pull again straight away.
+
+    Every write gets a number from one global sequence (Docs/sync.sql), so one cursor
+    covers all tables, and the payload grows with the number of changes, not table size.
+    """
+    now = now or datetime.now(timezone.utc)
+    pages = {table: _changed_rows(table, user_id, cursor, limit) for table in TABLES}
+    pages[TOMBSTONE_TABLE] = _tombstones(user_id, cursor, limit)
+
+    # A full page means more rows wait beyond it: stop at the lowest such page end so no
+    # table skips versions, and send the rest next time
+    truncated = [rows[-1]['sync_version'] for rows in pages.values() if len(rows) >= limit]
+    upper = min(truncated) if truncated else None
+    changes = sorted(
+        ((row['sync_version'], table, row) for table, rows in pages.items() for row in rows
+         if upper is None or row['sync_version'] <= upper),
+        key=lambda change: change[0],
+    )
+
+    # The cursor stops before the first write young enough that an older version may still commit
+    settled_before = now - timedelta(seconds=SETTLE_SECONDS)
+    next_cursor = cursor
+    for version, _, row in changes:
+        if not _is_settled(row, settled_before):
+            break
+        next_cursor = version
+
+    result = {"cursor": next_cursor, "has_more": upper is not None, "changes": {}, "deleted": {}}
+    for _, table, row in changes:
+        if table == TOMBSTONE_TABLE:
+            result["deleted"].setdefault(row['table_name'], []).append(row['row_key'])
+        else:
+            result["changes"].setdefault(table, []).append(row)
+    metrics.observe("sync.pull_rows", len(changes))
+    return result
+
+
+# --- 3. PUSH ---
+class PushLog:
+    """
+    Push batches by batch_id. A batch is claimed (a "running" row) before any change is
+    applied, so a retry that arrives while the first attempt still runs is refused, and a
+    finished batch is answered from its stored result instead of being applied again.
+    """
+
+    def __init__(self, max_size=MAX_REMEMBERED_PUSHES):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def claim(self, user_id, batch_id):
+        """
+        Returns None when this request now owns the batch and must apply it, or the stored
+        result of a batch that was already applied. Raises PushInProgress otherwise.
+        """
+        with self.lock:
+            result = self.results.get((user_id, batch_id))
+        if result is not None:
+            return result
+        now = datetime.now(timezone.utc)
+        try:
+            DB.table(PUSH_LOG_TABLE).insert({
+                "user_id": user_id,
+                "batch_id": batch_id,
+                "status": "running",
+                "created_at": now.isoformat(),
+            }).execute()
+            return None
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise
+        response = DB.table(PUSH_LOG_TABLE).select('status, result') \
+            .eq('user_id', user_id) \
+            .eq('batch_id', batch_id) \
+            .execute()
+        row = response.data[0] if response.data else None
+        if row is not None and row['status'] == "done":
+            self._remember(user_id, batch_id, row['result'])
+            return row['result']
+        # Still running: another request is applying it, or it crashed half way. Only an
+        # abandoned claim is taken over; replaying it is safe because inserts carry client_ref.
+        cutoff = (now - timedelta(seconds=STALE_CLAIM_SECONDS)).isoformat()
+        taken = DB.table(PUSH_LOG_TABLE).update({"created_at": now.isoformat()}) \
+            .eq('user_id', user_id) \
+            .eq('batch_id', batch_id) \
+            .eq('status', "running") \
+            .lt('created_at', cutoff) \
+            .execute()
+        if taken.data:
+            metrics.increment("sync.push_taken_over")
+            return None
+        raise PushInProgress(f"Batch {batch_id} is still being applied")
+
+    def finish(self, user_id, batch_id, result):
+        DB.table(PUSH_LOG_TABLE).update({"status": "done", "result": result}) \
+            .eq('user_id', user_id) \
+            .eq('batch_id', batch_id) \
+            .execute()
+        self._remember(user_id, batch_id, result)
+
+    def _remember(self, user_id, batch_id, result):
+        with self.lock:
+            self.results[(user_id, batch_id)] = result
+            if len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+
+push_log = PushLog()
+
+
+def _current(table, user_id, key):
+    response = DB.table(table).select('*') \
+        .eq('user_id', user_id) \
+        .eq(TABLES[table]["key"], key) \
+        .execute()
+    return response.data[0] if response.data else None
+
+
+def _outcome(status, change, row=None, reason=None):
+    outcome = {"table": change.get("table"), "key": change.get("key"), "op": change.get("op"), "status": status}
+    if change.get("client_ref") is not None:
+        outcome["client_ref"] = change["client_ref"]  # Lets the client map an insert to its new key
+    if row is not None:
+        outcome["row"] = row  # The server's row after the change, with its new sync_version
+    if reason:
+        outcome["reason"] = reason
+    return outcome
+
+
+def _by_client_ref(table, user_id, client_ref):
+    response = DB.table(table).select('*') \
+        .eq('user_id', user_id) \
+        .eq('client_ref', client_ref) \
+        .execute()
+    return response.data[0] if response.data else None
+
+
+def _apply_transaction(user_id, change):
+    op = change.get("op")
+    values = change.get("row") or {}
+    if op == "insert":
+        row = {column: values.get(column) for column in TRANSACTION_INSERT_COLUMNS if column in values}
+        if row.get("amount") is None or not row.get("created_at") or not change.get("client_ref"):
+            return _outcome("rejected", change, reason="amount, created_at and client_ref are required")
+        row.setdefault("day", parse_datetime(row["created_at"]).strftime("%A"))
+        row.setdefault("anomaly", False)
+        try:
+            response = DB.table('transaction').insert(dict(row, user_id=user_id, client_ref=change["client_ref"])).execute()
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise
+            # Inserted by an earlier attempt of this change: unique (user_id, client_ref)
+            return _outcome("applied", change, _by_client_ref('transaction', user_id, change["client_ref"]))
+        inserted = response.data[0]
+        enqueue_followups(user_id, inserted, inserted["created_at"])
+        return _outcome("applied", change, inserted)
+    return _apply_update_or_delete("transaction", user_id, change)
+
+
+def _apply_update_or_delete(table, user_id, change):
+    """
+    Updates and deletes carry `base_version`, the row version the client last saw. On a
+    mismatch the server changed the row meanwhile: client-owned columns are still applied
+    over it ("merged"); a delete still wins; an update of a deleted row is rejected.
+    """
+    key_column = TABLES[table]["key"]
+    current = _current(table, user_id, change.get("key"))
+    if current is None:
+        if change.get("op") == "delete":
+            return _outcome("applied", change)  # Already gone
+        return _outcome("rejected", change, reason="deleted on the server")
+    conflict = change.get("base_version") != current.get("sync_version")
+    if conflict:
+        metrics.increment(f"sync.conflicts.{table}")
+
+    if change.get("op") == "delete":
+        DB.table(table).delete().eq('user_id', user_id).eq(key_column, change["key"]).execute()
+        return _outcome("applied", change)
+
+    values = change.get("row") or {}
+    updates = {column: values[column] for column in TABLES[table]["client_owned"] if column in values}
+    if not updates:
+        return _outcome("rejected", change, current, reason="no client-owned columns in the change")
+    response = DB.table(table).update(updates).eq('user_id', user_id).eq(key_column, change["key"]).execute()
+    return _outcome("merged" if conflict else "applied", change, response.data[0] if response.data else current)
+
+
+def _apply_limit(user_id, change):
+    values = change.get("row") or {}
+    updates = {column: values[column] for column in TABLES["limit"]["client_owned"] if column in values}
+    if change.get("op") != "upsert" or not updates:
+        return _outcome("rejected", change, reason="limits only accept upserts of daily/weekly/monthly/yearly")
+    current = _current("limit", user_id, user_id)
+    conflict = current is not None and change.get("base_version") != current.get("sync_version")
+    if conflict:
+        metrics.increment("sync.conflicts.limit")
+    response = DB.table('limit').upsert(dict(updates, user_id=user_id), on_conflict='user_id').execute()
+    return _outcome("merged" if conflict else "applied", dict(change, key=user_id), response.data[0] if response.data else None)
+
+
+def _apply_pending(user_id, change):
+    """Pending items go through services/pendings.py so balances and the reconciliation index stay right."""
+    op = change.get("op")
+    values = change.get("row") or {}
+    if op == "insert":
+        if not change.get("client_ref"):
+            return _outcome("rejected", change, reason="client_ref is required")
+        try:
+            pending_id = pendings.add_pending_item(
+                user_id, values["description"], float(values["amount"]), values["type"], values["person_name"],
+                client_ref=change["client_ref"],
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return _outcome("rejected", change, reason=f"invalid pending item: {e}")
+        return _outcome("applied", change, _current("pending", user_id, pending_id))
+    if op == "settle":
+        settled = pendings.settle_pending_items(user_id, [change.get("key")])
+        row = _current("pending", user_id, change.get("key"))
+        if settled:
+            return _outcome("applied", change, row)
+        return _outcome("rejected", change, row, reason="deleted on the server" if row is None else "already settled")
+    if op == "delete":
+        pendings.delete_pending_items(user_id, [change.get("key")])
+        return _outcome("applied", change)
+    return _outcome("rejected", change, reason="pending items accept insert, settle and delete")
+
+
+APPLY = {"transaction": _apply_transaction, "limit": _apply_limit, "pending": _apply_pending}
+
+
+def push(user_id, batch_id, changes):
+    """
+    Applies a batch of offline changes in order and returns one outcome per change:
+    applied, merged (conflict resolved per column ownership) or rejected (with the reason
+    and the server's row). A retried batch_id gets the stored outcomes back; while the
+    first attempt is still running, PushInProgress is raised.
+    """
+    if not batch_id:
+        raise SyncError("batch_id is required")
+    if len(changes) > MAX_PUSH_CHANGES:
+        raise SyncError(f"At most {MAX_PUSH_CHANGES} changes per push")
+    previous = push_log.claim(user_id, batch_id)
+    if previous is not None:
+        metrics.increment("sync.push_replayed")
+        return previous
+
+    outcomes = []
+    touched_transactions = False
+    for change in changes:
+        table = change.get("table")
+        if table not in APPLY:
+            outcomes.append(_outcome("rejected", change, reason=f"{table} cannot be changed by clients"))
+            continue
+        try:
+            outcome = APPLY[table](user_id, change)
+        except Exception as e:
+            print(f"❌ Sync push failed for UserID '{user_id}' ({table} {change.get('op')}): {e}")
+            outcome = _outcome("error", change, reason=str(e))
+        outcomes.append(outcome)
+        metrics.increment(f"sync.push.{outcome['status']}")
+        touched_transactions |= table == "transaction" and outcome["status"] in ("applied", "merged")
+
+    if touched_transactions:
+        # Edits and deletes change totals and search results (inserts already queued theirs)
+        for name, job in (("agent_tools_cache", agent_tools.invalidate), ("read_cache", single_flight.invalidate),
+                          ("semantic_index_reset", semantic_index.invalidate),
+                          ("digest_stale", mark_digest_stale), ("summary", refresh_summary)):
+            work_queue.submit(user_id, name, job, user_id, coalesce=True)
+
+    result = {"batch_id": batch_id, "results": outcomes}
+    push_log.finish(user_id, batch_id, result)
+    return result
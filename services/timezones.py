@@ -0,0 +1,29 @@
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+
+# --- 1. SETTINGS ---
+# The users' zone: calendar days and weeks, and the hour of day, are taken here, not in UTC
+LOCAL_TIMEZONE = ZoneInfo(os.getenv("LOCAL_TIMEZONE", "Asia/Kolkata"))
+
+
+# --- 2. CONVERSIONS ---
+def as_utc(value):
+    """
+    ISO string or datetime -> aware UTC datetime. Naive values are taken as UTC, which is
+    how Supabase interprets them when they are stored.
+    """
+    if isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            dt = parse_datetime(value)
+    else:
+        dt = value
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def as_local(value):
+    """Same as as_utc(), in LOCAL_TIMEZONE: the date and time the user's phone shows."""
+    return as_utc(value).astimezone(LOCAL_TIMEZONE)
@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict, deque
+from core.setup import initialize_supabase  # Using your custom initializer
+from dateutil.parser import parse as parse_datetime  # For parsing ISO timestamps
+
+# --- 1. SUPABASE INITIALIZATION & SETTINGS ---
+DB = initialize_supabase()
+
+# Sliding windows as (window length in seconds, number of ring buckets)
+VELOCITY_WINDOWS = {
+    "5m": (300, 10),
+    "1h": (3600, 12),
+    "1d": (86400, 24),
+}
+
+SMALL_DEBIT_LIMIT = 200.0  # Debits at or below this count towards card-testing bursts
+BURST_LIMITS = {  # Max small debits per window before the user is flagged
+    "5m": 5,
+    "1h": 15,
+    "1d": 40,
+}
+MERCHANT_BURST_LIMIT = 3  # Max debits to the same merchant inside MERCHANT_WINDOW_SECONDS
+MERCHANT_WINDOW_SECONDS = 300
+
+NEW_MERCHANT_WINDOW = "1h"
+NEW_MERCHANT_LIMIT = 4  # Max first-time merchants inside NEW_MERCHANT_WINDOW
+NEW_MERCHANT_AMOUNT_FACTOR = 5.0  # First payment to a merchant this many times the usual debit is a spike
+MEAN_DEBIT_ALPHA = 0.1  # Smoothing of the user's typical debit amount
+NEW_MERCHANT_MIN_DEBITS = 10  # Known debits needed before "new merchant" means anything
+WARM_UP_DEBITS = 200  # Latest debits replayed into the state of a user seen for the first time
+
+DOUBLING_RUN = 3  # Consecutive doublings needed to flag an escalation
+DOUBLING_RATIO = (1.8, 2.2)  # Accepted next/previous amount ratio
+DOUBLING_WINDOW_SECONDS = 3600  # The whole run must happen within this time
+
+MAX_MERCHANTS_PER_USER = 64  # Merchant counters and "seen" entries kept per user (LRU)
+MAX_TRACKED_USERS = 10_000  # Users kept in memory per process (LRU); a full user is ~14 KiB, so ~140 MB
+
+
+# --- 2. RING BUFFER COUNTERS ---
+class RingCounter:
+    """
+    Event count and amount sum over a sliding window, kept in a fixed number of time buckets.
+    Updates and reads touch at most `buckets` slots, so both are O(1) with bounded memory.
+    """
+    __slots__ = ("bucket_seconds", "counts", "sums", "slots")
+
+    def __init__(self, window_seconds, buckets):
+        self.bucket_seconds = window_seconds / buckets
+        self.counts = [0] * buckets
+        self.sums = [0.0] * buckets
+        self.slots = [-1] * buckets
+
+    def add(self, ts, amount=0.0):
+        slot = int(ts // self.bucket_seconds)
+        i = slot % len(self.slots)
+        if self.slots[i] > slot:
+            return  # Older than the window; the bucket already holds newer data
+        if self.slots[i] != slot:
+            self.slots[i] = slot
+            self.counts[i] = 0
+            self.sums[i] = 0.0
+        self.counts[i] += 1
+        self.sums[i] += amount
+
+    def count(self, ts):
+        oldest = int(ts // self.bucket_seconds) - len(self.slots)
+        return sum(c for c, s in zip(self.counts, self.slots) if s > oldest)
+
+    def total(self, ts):
+        oldest = int(ts // self.bucket_seconds) - len(self.slots)
+        return sum(v for v, s in zip(self.sums, self.slots) if s > oldest)
+
+
+def _windows():
+    return {name: RingCounter(seconds, buckets) for name, (seconds, buckets) in VELOCITY_WINDOWS.items()}
+
+
+class UserVelocity:
+    """All velocity state of one user. Its size is capped by MAX_MERCHANTS_PER_USER."""
+    __slots__ = ("small_debits", "new_merchants", "merchants", "recent", "mean_debit", "debits")
+
+    def __init__(self):
+        self.small_debits = _windows()
+        seconds, buckets = VELOCITY_WINDOWS[NEW_MERCHANT_WINDOW]
+        self.new_merchants = RingCounter(seconds, buckets)
+        self.merchants = OrderedDict()  # merchant -> timestamps of its latest MERCHANT_BURST_LIMIT + 1 debits
+        self.recent = deque(maxlen=DOUBLING_RUN + 1)  # (ts, amount) of the latest debits
+        self.mean_debit = None
+        self.debits = 0  # Debits seen (replayed history included)
+
+
+# --- 3. DETECTOR ---
+class VelocityDetector:
+    """
+    Per-process velocity and burst detector. `evaluate` is called once per intake
+    event and returns the list of rules the event tripped (empty when it looks normal).
+    """
+
+    def __init__(self, max_users=MAX_TRACKED_USERS):
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def has_user(self, user_id):
+        with self.lock:
+            return user_id in self.users
+
+    def warm_up(self, user_id, history):
+        """
+        Seeds a user seen for the first time (new process, or evicted from the LRU) with
+        their latest debits, `history` as (merchant, amount, ts) oldest first, so known
+        merchants and the usual amount carry over instead of starting from nothing.
+        """
+        with self.lock:
+            if user_id in self.users:
+                return
+            state = self._state(user_id)
+            for merchant, amount, ts in history:
+                if amount is not None:
+                    self._record(state, (merchant or "Unknown").strip().lower(), float(amount), ts, replay=True)
+
+    def _state(self, user_id):
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = UserVelocity()
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+        return state
+
+    def evaluate(self, user_id, merchant, amount, ts, is_debit=True):
+        """
+        Args:
+            user_id: owner of the transaction.
+            merchant: counterparty name as parsed from the message.
+            amount (float): transaction amount.
+            ts (float): event time as a UNIX timestamp.
+            is_debit (bool): only debits are checked; credits are ignored.
+
+        Returns:
+            list: reasons such as "burst_5m", "merchant_burst", "new_merchant_spike", "amount_doubling".
+        """
+        if not is_debit or amount is None:
+            return []
+        merchant = (merchant or "Unknown").strip().lower()
+
+        with self.lock:
+            return self._record(self._state(user_id), merchant, amount, ts)
+
+    @staticmethod
+    def _record(state, merchant, amount, ts, replay=False):
+        """Adds one debit to the state and returns the rules it tripped (replayed history trips none)."""
+        reasons = []
+
+        # Card-testing bursts: many small debits in a short window
+        if amount <= SMALL_DEBIT_LIMIT:
+            for name, counter in state.small_debits.items():
+                counter.add(ts, amount)
+                if counter.count(ts) > BURST_LIMITS[name]:
+                    reasons.append(f"burst_{name}")
+
+        # Repeated debits to the same merchant
+        merchant_times = state.merchants.get(merchant)
+        is_new_merchant = merchant_times is None
+        if is_new_merchant:
+            merchant_times = state.merchants[merchant] = deque(maxlen=MERCHANT_BURST_LIMIT + 1)
+            if len(state.merchants) > MAX_MERCHANTS_PER_USER:
+                state.merchants.popitem(last=False)
+        else:
+            state.merchants.move_to_end(merchant)
+        merchant_times.append(ts)
+        if len(merchant_times) == merchant_times.maxlen \
+                and ts - merchant_times[0] <= MERCHANT_WINDOW_SECONDS:
+            reasons.append("merchant_burst")
+
+        # Sudden spread to, or a large first payment at, unseen merchants (once enough
+        # history is known; replayed merchants aren't new, the replay only starts late)
+        if is_new_merchant and not replay and state.debits >= NEW_MERCHANT_MIN_DEBITS:
+            state.new_merchants.add(ts)
+            if state.new_merchants.count(ts) > NEW_MERCHANT_LIMIT \
+                    or amount >= state.mean_debit * NEW_MERCHANT_AMOUNT_FACTOR:
+                reasons.append("new_merchant_spike")
+
+        # Escalating amounts: each debit roughly double the previous one
+        state.recent.append((ts, amount))
+        if len(state.recent) == state.recent.maxlen \
+                and state.recent[-1][0] - state.recent[0][0] <= DOUBLING_WINDOW_SECONDS:
+            low, high = DOUBLING_RATIO
+            pairs = zip(state.recent, list(state.recent)[1:])
+            if all(prev[1] > 0 and low <= nxt[1] / prev[1] <= high for prev, nxt in pairs):
+                reasons.append("amount_doubling")
+
+        if state.mean_debit is None:
+            state.mean_debit = amount
+        else:
+            state.mean_debit += MEAN_DEBIT_ALPHA * (amount - state.mean_debit)
+
+        state.debits += 1
+        return [] if replay else reasons
+
+
+# Shared detector used by the intake router
+detector = VelocityDetector()
+
+
+def warm_up(user_id):
+    """Loads the user's latest debits into the detector the first time the process sees them."""
+    if detector.has_user(user_id):
+        return
+    response = DB.table('transaction').select('sender_name, amount, created_at') \
+        .eq('user_id', user_id) \
+        .eq('payment_type', 'expense') \
+        .order('created_at', desc=True) \
+        .limit(WARM_UP_DEBITS) \
+        .execute()
+    history = [(row['sender_name'], row['amount'], parse_datetime(row['created_at']).timestamp())
+               for row in reversed(response.data or [])]
+    detector.warm_up(user_id, history)
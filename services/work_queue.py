@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import OrderedDict
+from services.metrics import metrics
+
+# --- 1. SETTINGS ---
+WORKERS = 4  # Jobs run concurrently (each in a thread: jobs are blocking Supabase calls)
+MAX_PENDING_JOBS = 10_000  # Beyond this new jobs are dropped; everything queued here is rebuildable
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 0.5  # Delay before the first retry, doubled after every further failure
+DRAIN_TIMEOUT_SECONDS = 10.0  # How long shutdown waits for queued jobs
+
+
+class Job:
+    __slots__ = ("name", "fn", "args", "attempts", "enqueued_at")
+
+    def __init__(self, name, fn, args):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+# --- 2. QUEUE ---
+class WorkQueue:
+    """
+    Bounded asyncio worker pool for work derived from stored transactions. Jobs are
+    grouped per user: one user's jobs run in order on one worker at a time (they
+    read-modify-write the same per-user state), and a coalescing job that is already
+    waiting for that user absorbs later submissions of the same job.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # user_id -> [Job], waiting
+        self.size = 0  # Jobs waiting in `pending`
+        self.running = set()  # Users a worker is busy with
+        self.retrying = 0  # Jobs sleeping through their backoff
+        self.ready = None  # asyncio.Queue of users with pending jobs and no worker on them
+        self.tasks = []
+        self.loop = None
+        self.accepting = True
+
+    def _publish(self):
+        metrics.gauge("work_queue.depth", self.size + self.retrying)
+        metrics.gauge("work_queue.busy_workers", len(self.running))
+
+    def start(self):
+        """Starts the workers on the running event loop (called at startup, or by the first submit)."""
+        loop = asyncio.get_running_loop()
+        if self.tasks and self.loop is loop:
+            return
+        self.loop = loop
+        self.accepting = True
+        self.running.clear()
+        self.ready = asyncio.Queue()
+        for user_id in self.pending:
+            self.ready.put_nowait(user_id)
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, user_id, name, fn, *args, coalesce=False):
+        """
+        Queues fn(*args) to run after the current request. With `coalesce`, a waiting copy of the
+        same job for this user is reused instead (eg cache invalidation, summary rebuilds).
+        Returns False if the job was dropped. Safe to call from worker threads once started.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None and self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(lambda: self.submit(user_id, name, fn, *args, coalesce=coalesce))
+            return True
+        if self.loop is not loop or not self.tasks:
+            self.start()
+        if not self.accepting or self.size >= self.max_pending:
+            metrics.increment(f"work_queue.dropped.{name}")
+            print(f"⚠️ Work queue full or draining, dropped '{name}' for UserID '{user_id}'")
+            return False
+        jobs = self.pending.get(user_id, [])
+        waiting = next((job for job in jobs if job.name == name), None) if coalesce else None
+        if waiting is not None:
+            # Moved behind the jobs queued since, so it still runs after everything it summarizes
+            jobs.remove(waiting)
+            jobs.append(waiting)
+            metrics.increment(f"work_queue.coalesced.{name}")
+            return True
+        self._push(user_id, Job(name, fn, args))
+        return True
+
+    def _push(self, user_id, job):
+        jobs = self.pending.get(user_id)
+        if jobs is None:
+            jobs = self.pending[user_id] = []
+            if user_id not in self.running:
+                self.ready.put_nowait(user_id)
+        jobs.append(job)
+        self.size += 1
+        self._publish()
+
+    def _retry(self, user_id, job):
+        self.retrying -= 1
+        self._push(user_id, job)
+
+    async def _worker(self):
+        while True:
+            user_id = await self.ready.get()
+            jobs = self.pending.pop(user_id, [])
+            self.size -= len(jobs)
+            self.running.add(user_id)
+            self._publish()
+            try:
+                for job in jobs:
+                    await self._run(user_id, job)
+            finally:
+                self.running.discard(user_id)
+                if user_id in self.pending:
+                    self.ready.put_nowait(user_id)  # Jobs arrived while this user's batch ran
+                self._publish()
+
+    async def _run(self, user_id, job):
+        if job.attempts == 0:
+            metrics.observe("work_queue.wait_seconds", time.monotonic() - job.enqueued_at)
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(job.fn, *job.args)
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts < MAX_ATTEMPTS:
+                delay = BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+                print(f"⚠️ {job.name} failed for UserID '{user_id}' (attempt {job.attempts}), retrying in {delay}s: {e}")
+                metrics.increment(f"work_queue.retries.{job.name}")
+                self.retrying += 1
+                self.loop.call_later(delay, self._retry, user_id, job)
+            else:
+                print(f"❌ {job.name} failed for UserID '{user_id}' after {job.attempts} attempts: {e}")
+                metrics.increment(f"work_queue.failed.{job.name}")
+            return
+        metrics.observe(f"work_queue.job_seconds.{job.name}", time.perf_counter() - started)
+        metrics.observe("work_queue.latency_seconds", time.monotonic() - job.enqueued_at)
+        metrics.increment(f"work_queue.completed.{job.name}")
+
+    def idle(self):
+        return not (self.size or self.running or self.retrying)
+
+    async def drain(self, timeout=DRAIN_TIMEOUT_SECONDS):
+        """Stops accepting jobs, waits up to `timeout` seconds for queued ones, then stops the workers."""
+        self.accepting = False
+        if not self.tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while not self.idle() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if not self.idle():
+            lost = self.size + self.retrying + len(self.running)
+            metrics.increment("work_queue.lost_on_shutdown", lost)
+            print(f"⚠️ Work queue drain timed out, {lost} job(s) not finished")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+queue = WorkQueue()